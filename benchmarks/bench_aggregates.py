@@ -0,0 +1,90 @@
+# Benchmark: dashboard queries (plays per day, per hour, per artist and the daily audio profile over the
+# whole history) scanning the plays tables vs reading the summary tables, and the time to keep the
+# summaries up to date after one hourly run vs rebuilding them from the whole history
+#
+# Usage: python benchmarks/bench_aggregates.py [history sizes...]   (default: 100000 1000000)
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from sqlalchemy import create_engine, text
+
+from fake_data import make_tracks_df, make_details_df, make_features_df
+from spotify_aggregate import ListeningAggregator
+from spotify_load import SpotifyLoader
+
+NEW_PLAYS = 500
+
+# The same four dashboard queries, over every play and over the summaries
+SCAN_QUERIES = [
+    """SELECT r.timestamp, COUNT(*), SUM(d.length) FROM recent_tracks r LEFT JOIN track_details d ON d.track_id = r.track_id
+       WHERE r.user_id = 'default' AND r.played_at >= :since GROUP BY r.timestamp""",
+    """SELECT SUBSTR(r.played_at, 12, 2), COUNT(*) FROM recent_tracks r
+       WHERE r.user_id = 'default' AND r.played_at >= :since GROUP BY SUBSTR(r.played_at, 12, 2)""",
+    """SELECT d.artist_name, COUNT(*) FROM recent_tracks r JOIN track_details d ON d.track_id = r.track_id
+       WHERE r.user_id = 'default' AND r.played_at >= :since GROUP BY d.artist_name ORDER BY COUNT(*) DESC LIMIT 10""",
+    """SELECT r.timestamp, AVG(f.valence), AVG(f.energy) FROM recent_tracks r JOIN track_features f ON f.track_id = r.track_id
+       WHERE r.user_id = 'default' AND r.played_at >= :since GROUP BY r.timestamp""",
+]
+
+SUMMARY_QUERIES = [
+    "SELECT day, plays, ms_played FROM daily_listening WHERE user_id = 'default' AND day >= :since",
+    "SELECT hour, SUM(plays) FROM hourly_listening WHERE user_id = 'default' AND day >= :since GROUP BY hour",
+    """SELECT artist_name, SUM(plays) FROM daily_artist_listening WHERE user_id = 'default' AND day >= :since
+       GROUP BY artist_name ORDER BY SUM(plays) DESC LIMIT 10""",
+    "SELECT day, avg_valence, avg_energy FROM daily_audio_profile WHERE user_id = 'default' AND day >= :since",
+]
+
+def run_queries(engine, queries, since):
+    start = time.perf_counter()
+    with engine.connect() as connection:
+        for query in queries:
+            connection.execute(text(query), {"since": since}).fetchall()
+    return time.perf_counter() - start
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [100_000, 1_000_000]
+
+    print(f"{NEW_PLAYS} new plays per run, SQLite")
+    print(f"{'history':>9} {'scan ms':>8} {'summary ms':>11} {'update ms':>10} {'rebuild ms':>11}")
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+            loader = SpotifyLoader(engine)
+            loader.create_tables()
+            aggregator = ListeningAggregator(engine)
+            aggregator.create_tables()
+
+            # Seed the history and its summaries
+            history_df = make_tracks_df(size)
+            track_ids = history_df["track_id"].unique()
+            loader.load(history_df, make_details_df(track_ids), make_features_df(track_ids))
+            aggregator.rebuild()
+
+            # One hourly run, then its summaries
+            new_df = make_tracks_df(NEW_PLAYS, start=size)
+            new_ids = new_df["track_id"].unique()
+            loader.load(new_df, make_details_df(new_ids), make_features_df(new_ids))
+
+            start = time.perf_counter()
+            aggregator.update(new_df)
+            update_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            aggregator.rebuild()
+            rebuild_time = time.perf_counter() - start
+
+            # The dashboard of the whole history
+            scan_time = run_queries(engine, SCAN_QUERIES, "2000-01-01")
+            summary_time = run_queries(engine, SUMMARY_QUERIES, "2000-01-01")
+
+            engine.dispose()
+
+        print(f"{size:>9} {scan_time * 1000:>8.1f} {summary_time * 1000:>11.1f} {update_time * 1000:>10.1f} {rebuild_time * 1000:>11.1f}")
+
+if __name__ == "__main__":
+    main()
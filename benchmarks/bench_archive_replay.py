@@ -0,0 +1,78 @@
+# Benchmark: reprocessing a month of plays by calling the mock API again vs replaying the raw response archive
+# Both runs load into a fresh SQLite database; the replay never touches the network.
+#
+# Usage: python benchmarks/bench_archive_replay.py
+import os
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from mock_spotify import MockSpotifyServer, StaticTokenManager
+from spotify_archive import RawArchive, ArchiveReplay
+from spotify_etl import SpotifyETL
+from spotify_load import SpotifyLoader
+
+LATENCY = 0.02
+PLAYS = 30 * 24 * 60  # a month of plays, one per minute
+TRACKS = 5_000
+
+def make_loader(folder, name):
+    loader = SpotifyLoader(create_engine(f"sqlite:///{os.path.join(folder, name)}"))
+    loader.create_tables()
+    return loader
+
+def table_counts(loader):
+    with loader.engine.connect() as connection:
+        return [connection.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar()
+                for table in ("recent_tracks", "track_details", "track_features")]
+
+def main():
+    server = MockSpotifyServer(latency=LATENCY, plays=PLAYS, tracks=TRACKS).start()
+
+    with tempfile.TemporaryDirectory() as folder:
+        archive = RawArchive(os.path.join(folder, "archive"))
+        etl = SpotifyETL(
+            StaticTokenManager(),
+            recent_tracks_url=f"{server.base_url}/me/player/recently-played",
+            tracks_details_url=f"{server.base_url}/tracks",
+            tracks_features_url=f"{server.base_url}/audio-features",
+            archive=archive
+        )
+
+        # Extract the month through the API, archiving every response on the way
+        api_loader = make_loader(folder, "api.db")
+        server.reset_count()
+        start = time.perf_counter()
+        tracks_df = etl.extract_recently_played_tracks(after=0)
+        details_df, features_df = etl.extract_track_enrichment(tracks_df)
+        api_loader.load(tracks_df, details_df, features_df, bulk=True)
+        archive.close()
+        api_seconds = time.perf_counter() - start
+        requests = server.request_count
+        server.stop()
+
+        # Rebuild the same tables from the archive only
+        replay_loader = make_loader(folder, "replay.db")
+        start = time.perf_counter()
+        ArchiveReplay(archive, etl.cache).run(replay_loader)
+        replay_seconds = time.perf_counter() - start
+
+        api_counts, replay_counts = table_counts(api_loader), table_counts(replay_loader)
+        assert api_counts == replay_counts, (api_counts, replay_counts)
+
+        size = sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(archive.path) for name in names)
+
+    print(f"{PLAYS} plays over {TRACKS} tracks, {LATENCY * 1000:.0f} ms per request")
+    print(f"Archive: {archive.records_written} responses, {size / 2 ** 20:.1f} MiB")
+    print(f"{'source':>8} {'requests':>9} {'seconds':>8}")
+    print(f"{'api':>8} {requests:>9} {api_seconds:>8.2f}")
+    print(f"{'archive':>8} {0:>9} {replay_seconds:>8.2f}")
+    print(f"Rows (plays, details, features): {replay_counts}")
+
+if __name__ == "__main__":
+    main()
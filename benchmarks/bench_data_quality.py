@@ -0,0 +1,49 @@
+# Benchmark: time of the rule-based DataQualityChecker vs the original data_quality checks
+# (emptiness, one unique key, any null) on multi-million-row frames
+#
+# Usage: python benchmarks/bench_data_quality.py [sizes...]   (default: 1000000 5000000)
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from fake_data import make_tracks_df, make_features_df
+from spotify_quality import DataQualityChecker
+
+# The checks SpotifyETL.data_quality ran before the rule engine
+def original_data_quality(load_df, primary_key_column):
+    if load_df.empty:
+        return False
+    if load_df.duplicated(subset=primary_key_column).any():
+        raise Exception("Primary Key Exception, Data Might Contain Duplicates")
+    if load_df.isnull().values.any():
+        raise Exception("Null Values Found")
+
+def timed(function):
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [1_000_000, 5_000_000]
+    checker = DataQualityChecker()
+
+    print(f"{'table':>15} {'rows':>9} {'original s':>11} {'rules s':>8} {'rules rows/s':>13}")
+    for size in sizes:
+        tracks_df = make_tracks_df(size, tracks=size // 10)
+        features_df = make_features_df(tracks_df["track_id"].unique())
+        details_ids = pd.DataFrame({"track_id": features_df["track_id"]})
+
+        for table_name, df, key, references in (
+            ("recent_tracks", tracks_df, ["user_id", "played_at"], {"track_details": details_ids}),
+            ("track_features", features_df, "track_id", None),
+        ):
+            original = timed(lambda: original_data_quality(df, key))
+            rules = timed(lambda: checker.check(df, table_name, references))
+            print(f"{table_name:>15} {len(df):>9} {original:>11.2f} {rules:>8.2f} {len(df) / rules:>13.0f}")
+
+if __name__ == "__main__":
+    main()
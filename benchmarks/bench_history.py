@@ -0,0 +1,111 @@
+# Benchmark: keeping the popularity of every track over time by appending a snapshot of every track on
+# each run vs recording only the changes in track_popularity_history (SpotifyLoader.changed_rows, then
+# one row per changed track): rows written, table size and time per run, over a day of hourly runs
+#
+# Usage: python benchmarks/bench_history.py [tracks...]   (default: 10000 100000)
+# Runs on throwaway SQLite files, or on the database of BENCH_DB_URL (its ETL tables are dropped)
+import os
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import numpy as np
+from sqlalchemy import create_engine, make_url, text
+
+from fake_data import make_details_df
+from spotify_load import SpotifyLoader
+from spotify_parse import typed_frame
+from spotify_schema import TABLES, TRACK_DETAILS_DTYPES
+
+RUNS = 24
+# Share of the tracks whose popularity moves between two runs
+CHANGE_RATE = 0.01
+
+SNAPSHOTS_DDL = """
+    CREATE TABLE track_popularity_snapshots(
+    track_id VARCHAR(200),
+    observed_at TIMESTAMPTZ,
+    popularity INTEGER,
+    PRIMARY KEY (track_id, observed_at)
+)
+"""
+
+# Helper to get the size of a table with its indexes, in MiB
+def table_mib(engine, table_name):
+    with engine.connect() as connection:
+        if engine.dialect.name == "postgresql":
+            size = connection.execute(text(f"SELECT pg_total_relation_size('{table_name}')")).scalar()
+        else:
+            size = connection.execute(
+                text("SELECT SUM(pgsize) FROM dbstat WHERE name = :name OR name IN "
+                     "(SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :name)"),
+                {"name": table_name}
+            ).scalar()
+    return size / 2**20
+
+def reset_tables(engine):
+    with engine.begin() as connection:
+        for table_name in ["track_popularity_snapshots", *TABLES]:
+            connection.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+
+def count_rows(engine, table_name):
+    with engine.connect() as connection:
+        return connection.execute(text(f"SELECT COUNT(*) FROM {table_name}")).scalar()
+
+def run(engine, size):
+    reset_tables(engine)
+    loader = SpotifyLoader(engine)
+    loader.create_tables()
+    with engine.begin() as connection:
+        connection.execute(text(SNAPSHOTS_DDL))
+
+    details_df = typed_frame(make_details_df([f"id{i:07d}" for i in range(size)]), TRACK_DETAILS_DTYPES)
+    rng = np.random.default_rng(0)
+    snapshot_seconds = history_seconds = 0.0
+
+    for _ in range(RUNS):
+        # Every run sees every track, a few of them with a new popularity
+        moved = rng.random(size) < CHANGE_RATE
+        details_df.loc[moved, "popularity"] = rng.integers(0, 100, moved.sum()).astype("int8")
+
+        # Both sides append their rows the same way, the history one only after finding the changes
+        start = time.perf_counter()
+        with engine.begin() as connection:
+            snapshot_df = details_df[["track_id", "popularity"]].assign(observed_at=datetime.now(timezone.utc))
+            snapshot_df.to_sql("track_popularity_snapshots", connection, if_exists="append", index=False, chunksize=10_000)
+        snapshot_seconds += time.perf_counter() - start
+
+        start = time.perf_counter()
+        with engine.begin() as connection:
+            changes_df = loader.changed_rows(connection, "track_popularity_history", details_df, datetime.now(timezone.utc))
+            changes_df.to_sql("track_popularity_history", connection, if_exists="append", index=False, chunksize=10_000)
+        history_seconds += time.perf_counter() - start
+
+    return (count_rows(engine, "track_popularity_snapshots"), table_mib(engine, "track_popularity_snapshots"),
+            snapshot_seconds / RUNS, count_rows(engine, "track_popularity_history"),
+            table_mib(engine, "track_popularity_history"), history_seconds / RUNS)
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [10_000, 100_000]
+    db_url = os.getenv("BENCH_DB_URL")
+
+    print(f"{make_url(db_url).get_backend_name() if db_url else 'sqlite'} database, {RUNS} runs, "
+          f"{CHANGE_RATE:.0%} of the tracks change between runs")
+    print(f"{'tracks':>8} {'snapshot rows':>14} {'MiB':>7} {'ms/run':>8} {'history rows':>13} {'MiB':>7} {'ms/run':>8}")
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(db_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+            snapshot_rows, snapshot_mib, snapshot_time, history_rows, history_mib, history_time = run(engine, size)
+            if db_url:
+                reset_tables(engine)
+            engine.dispose()
+
+        print(f"{size:>8} {snapshot_rows:>14} {snapshot_mib:>7.1f} {snapshot_time * 1000:>8.1f} "
+              f"{history_rows:>13} {history_mib:>7.1f} {history_time * 1000:>8.1f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# Benchmark: requests/sec of the pooled, keep-alive HttpClient vs one connection per request
+# (plain requests.get, as HttpClient worked before) against the local mock API
+#
+# Usage: python benchmarks/bench_http_client.py
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from mock_spotify import MockSpotifyServer
+from spotify_token import HttpClient
+
+REQUESTS = 2_000
+
+# Client opening a new connection for every request
+class UnpooledHttpClient:
+    def get(self, url, headers):
+        return requests.get(url, headers=headers)
+
+def run(client, url, workers):
+    headers = {"Authorization": "Bearer mock-token"}
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        statuses = list(executor.map(lambda _: client.get(url, headers=headers).status_code, range(REQUESTS)))
+    elapsed = time.perf_counter() - start
+    assert all(status == 200 for status in statuses)
+    return REQUESTS / elapsed
+
+def main():
+    server = MockSpotifyServer().start()
+    url = f"{server.base_url}/tracks/abc"
+
+    print(f"{REQUESTS} requests per run")
+    print(f"{'workers':>8} {'unpooled req/s':>15} {'pooled req/s':>13}")
+    for workers in (1, 8):
+        unpooled = run(UnpooledHttpClient(), url, workers)
+        pooled = run(HttpClient(pool_size=workers), url, workers)
+        print(f"{workers:>8} {unpooled:>15.0f} {pooled:>13.0f}")
+
+    server.stop()
+
+if __name__ == "__main__":
+    main()
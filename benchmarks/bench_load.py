@@ -0,0 +1,59 @@
+# Benchmark: time to load one hourly run (new plays + their details and features) as the play history
+# grows, with SpotifyLoader's upserts vs rewriting the whole history with to_sql(if_exists='replace')
+#
+# Usage: python benchmarks/bench_load.py [history sizes...]   (default: 10000 100000 1000000)
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pandas as pd
+from sqlalchemy import create_engine
+
+from fake_data import make_tracks_df, make_details_df, make_features_df
+from spotify_load import SpotifyLoader
+
+NEW_PLAYS = 500
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+
+    print(f"{NEW_PLAYS} new plays per run, SQLite")
+    print(f"{'history':>9} {'upsert s':>9} {'replace s':>10}")
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+            loader = SpotifyLoader(engine)
+            loader.create_tables()
+
+            # Seed the history
+            history_df = make_tracks_df(size)
+            track_ids = history_df["track_id"].unique()
+            loader.load(history_df, make_details_df(track_ids), make_features_df(track_ids))
+
+            # One hourly run: new plays, mostly of tracks that are already known
+            new_df = make_tracks_df(NEW_PLAYS, start=size)
+            new_ids = new_df["track_id"].unique()
+            details_df, features_df = make_details_df(new_ids), make_features_df(new_ids)
+
+            start = time.perf_counter()
+            loader.load(new_df, details_df, features_df)
+            upsert_time = time.perf_counter() - start
+
+            # Keeping the history with to_sql means rewriting every play on every run
+            full_df = pd.concat([history_df, new_df], ignore_index=True)
+            start = time.perf_counter()
+            full_df.to_sql("recent_tracks_replace", engine, if_exists="replace")
+            details_df.to_sql("track_details_replace", engine, if_exists="replace")
+            features_df.to_sql("track_features_replace", engine, if_exists="replace")
+            replace_time = time.perf_counter() - start
+
+            engine.dispose()
+
+        print(f"{size:>9} {upsert_time:>9.3f} {replace_time:>10.3f}")
+
+if __name__ == "__main__":
+    main()
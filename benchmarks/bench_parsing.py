@@ -0,0 +1,112 @@
+# Benchmark: records/sec and peak memory of parsing Spotify responses into DataFrames, the previous way
+# (json.loads, one dict per row, pd.DataFrame of the list) vs the typed column-buffer parsers of
+# spotify_parse.py, with orjson when it is installed and with the standard library decoder
+#
+# Usage: python benchmarks/bench_parsing.py
+import gc
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import spotify_parse
+from mock_spotify import fake_track, fake_audio_features, fake_play
+from spotify_etl import SpotifyETL, TRACK_DETAILS_COLUMNS, TRACK_FEATURES_COLUMNS, RECENT_TRACKS_COLUMNS
+from spotify_parse import parse_tracks, parse_audio_features, parse_recently_played_items, concat_columns, TRACK_DETAILS_DTYPES, TRACK_FEATURES_DTYPES
+
+RECORDS = 200_000
+
+# Raw response bodies, as the API sends them
+def make_bodies():
+    ids = [f"id{i:07d}" for i in range(RECORDS)]
+    tracks = [(batch, json.dumps({"tracks": [fake_track(i) for i in batch]}).encode())
+              for batch in (ids[start:start + 50] for start in range(0, RECORDS, 50))]
+    features = [(batch, json.dumps({"audio_features": [fake_audio_features(i) for i in batch]}).encode())
+                for batch in (ids[start:start + 100] for start in range(0, RECORDS, 100))]
+    pages = [json.dumps({"items": [fake_play(i, 10_000) for i in range(start, start + 50)]}).encode()
+             for start in range(0, RECORDS, 50)]
+    return {"tracks": tracks, "audio-features": features, "recently-played": pages}
+
+# Previous parsing: standard library decoder, a dict (or parallel lists) per row, one DataFrame at the end
+def dict_tracks(etl, bodies):
+    rows = []
+    for batch, body in bodies:
+        for track_id, track in zip(batch, json.loads(body)["tracks"]):
+            rows.append(etl.parse_track_details(track_id, track))
+    return pd.DataFrame(rows, columns=TRACK_DETAILS_COLUMNS)
+
+def dict_features(etl, bodies):
+    rows = []
+    for batch, body in bodies:
+        for track_id, features in zip(batch, json.loads(body)["audio_features"]):
+            rows.append(etl.parse_track_features(track_id, features))
+    return pd.DataFrame(rows, columns=TRACK_FEATURES_COLUMNS)
+
+def dict_plays(etl, bodies):
+    pages = []
+    for body in bodies:
+        items = json.loads(body)["items"]
+        pages.append(pd.DataFrame({
+            "track_id": [item["track"]["id"] for item in items],
+            "played_at": [item["played_at"] for item in items],
+            "timestamp": [item["played_at"][0:10] for item in items],
+            "user_id": etl.user_id
+        }, columns=RECENT_TRACKS_COLUMNS))
+    return pd.concat(pages, ignore_index=True)
+
+# Column-buffer parsing: typed column arrays per response, one DataFrame at the end
+def buffer_tracks(etl, bodies):
+    batches = [parse_tracks(batch, spotify_parse.loads(body)["tracks"])[0] for batch, body in bodies]
+    return concat_columns(batches, TRACK_DETAILS_DTYPES)
+
+def buffer_features(etl, bodies):
+    batches = [parse_audio_features(batch, spotify_parse.loads(body)["audio_features"])[0] for batch, body in bodies]
+    return concat_columns(batches, TRACK_FEATURES_DTYPES)
+
+def buffer_plays(etl, bodies):
+    pages = [parse_recently_played_items(spotify_parse.loads(body)["items"], etl.user_id) for body in bodies]
+    return pd.concat(pages, ignore_index=True)
+
+def measure(parse, etl, bodies):
+    gc.collect()
+    start = time.perf_counter()
+    df = parse(etl, bodies)
+    elapsed = time.perf_counter() - start
+    frame_mib = df.memory_usage(deep=True).sum() / 2 ** 20
+    del df
+
+    gc.collect()
+    tracemalloc.start()
+    parse(etl, bodies)
+    peak_mib = tracemalloc.get_traced_memory()[1] / 2 ** 20
+    tracemalloc.stop()
+
+    return RECORDS / elapsed, peak_mib, frame_mib
+
+def main():
+    etl = SpotifyETL(None, None, None, None)
+    bodies = make_bodies()
+    orjson = spotify_parse.orjson
+
+    runs = [("dicts", None, (dict_tracks, dict_features, dict_plays))]
+    if orjson is not None:
+        runs.append(("buffers+orjson", orjson, (buffer_tracks, buffer_features, buffer_plays)))
+    runs.append(("buffers+json", None, (buffer_tracks, buffer_features, buffer_plays)))
+
+    print(f"{RECORDS} records per endpoint")
+    print(f"{'endpoint':>16} {'parser':>15} {'records/s':>10} {'peak MiB':>9} {'frame MiB':>10}")
+    for index, endpoint in enumerate(("tracks", "audio-features", "recently-played")):
+        for name, decoder, parsers in runs:
+            spotify_parse.orjson = decoder
+            throughput, peak, frame = measure(parsers[index], etl, bodies[endpoint])
+            print(f"{endpoint:>16} {name:>15} {throughput:>10.0f} {peak:>9.1f} {frame:>10.1f}")
+
+    spotify_parse.orjson = orjson
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,291 @@
+# Benchmark: the whole ETL (extract, details, features, dimensions, quality, load, aggregate) against the mock API, end to end
+# into a database, with throughput, request latency percentiles and peak memory per stage
+#
+# Usage: python benchmarks/bench_pipeline.py [--scenario default|errors|throttled|large] [--rate-limiter] [--repeat 3]
+#                                            [--output results.json] [--compare baseline.json]
+#
+# Every run uses the same fixed dataset and a seeded error generator, and the timings are the median of
+# --repeat runs, so results of different commits can be compared: save one with --output and pass it to
+# --compare on the next commit, which exits with status 1 when a stage got slower than --threshold.
+# The database is a temporary SQLite file unless BENCH_DB_URL points to a PostgreSQL database
+# (the ETL tables are dropped first). Peak memory comes from a separate run under tracemalloc,
+# which slows Python down too much to be timed.
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+from sqlalchemy import create_engine, text
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from mock_spotify import MockSpotifyServer, StaticTokenManager
+from spotify_etl import SpotifyETL, DEFAULT_MAX_WORKERS
+from spotify_aggregate import ListeningAggregator, AGGREGATES
+from spotify_load import SpotifyLoader, TABLES
+from spotify_metrics import RunMetrics
+from spotify_token import HttpClient, RateLimiter
+
+# Stages of a run, in order
+STAGES = ["extract", "details", "features", "dimensions", "quality", "load", "aggregate"]
+
+# Preset workloads: dataset size and how badly the mock API behaves
+SCENARIOS = {
+    "default": {"plays": 10_000, "tracks": 2_000, "latency": 0.01, "error_rate": 0.0, "rate_limit": None, "rate_limiter": False},
+    "errors": {"plays": 10_000, "tracks": 2_000, "latency": 0.01, "error_rate": 0.02, "rate_limit": None, "rate_limiter": False},
+    "throttled": {"plays": 10_000, "tracks": 2_000, "latency": 0.01, "error_rate": 0.0, "rate_limit": 50, "rate_limiter": False},
+    "large": {"plays": 100_000, "tracks": 20_000, "latency": 0.01, "error_rate": 0.0, "rate_limit": None, "rate_limiter": False},
+}
+
+# Exporter keeping every request latency, for exact percentiles instead of the histogram buckets
+class LatencyRecorder:
+    def __init__(self):
+        self.latencies = {}
+
+    def observe_request(self, endpoint, seconds):
+        self.latencies.setdefault(endpoint, []).append(seconds)
+
+    def export(self, report):
+        pass
+
+def reset_tables(engine):
+    with engine.begin() as connection:
+        for table_name in [*TABLES, *AGGREGATES]:
+            connection.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+
+# Helper to count the rows of every table of a run
+def rows(frames):
+    return (len(frames["tracks"]) + len(frames["details"]) + len(frames["features"])
+            + sum(len(df) for df in frames["dimensions"].values()))
+
+# Helper to run the pipeline once, returns the seconds, rows and peak memory (if traced) of every stage
+def run_pipeline(server, db_url, settings, metrics, trace_memory=False):
+    # Same backoff jitter on every run
+    random.seed(0)
+
+    engine = create_engine(db_url)
+    reset_tables(engine)
+    loader = SpotifyLoader(engine, metrics=metrics)
+    loader.create_tables()
+    aggregator = ListeningAggregator(engine, metrics=metrics)
+    aggregator.create_tables()
+
+    rate_limiter = RateLimiter() if settings["rate_limiter"] else None
+    etl = SpotifyETL(
+        StaticTokenManager(),
+        recent_tracks_url=f"{server.base_url}/me/player/recently-played",
+        tracks_details_url=f"{server.base_url}/tracks",
+        tracks_features_url=f"{server.base_url}/audio-features",
+        http_client=HttpClient(pool_size=DEFAULT_MAX_WORKERS, backoff_factor=0.05, rate_limiter=rate_limiter, metrics=metrics),
+        metrics=metrics
+    )
+
+    stages = {}
+    frames = {}
+
+    def stage(name, function):
+        if trace_memory:
+            tracemalloc.reset_peak()
+            baseline = tracemalloc.get_traced_memory()[0]
+        started = time.perf_counter()
+        rows = function()
+        stages[name] = {"seconds": time.perf_counter() - started, "rows": rows}
+        if trace_memory:
+            stages[name]["peak_mib"] = (tracemalloc.get_traced_memory()[1] - baseline) / 2 ** 20
+
+    def extract():
+        frames["tracks"] = etl.extract_recently_played_tracks(after=0)
+        return len(frames["tracks"])
+
+    def details():
+        frames["details"] = etl.extract_track_details(frames["tracks"])
+        return len(frames["details"])
+
+    def features():
+        frames["features"] = etl.extract_track_features(frames["tracks"])
+        return len(frames["features"])
+
+    def dimensions():
+        frames["dimensions"] = etl.extract_dimensions(frames["tracks"])
+        return sum(len(df) for df in frames["dimensions"].values())
+
+    def quality():
+        etl.data_quality(frames["details"], 'track_details')
+        etl.data_quality(frames["features"], 'track_features')
+        etl.data_quality(frames["tracks"], 'recent_tracks', references={"track_details": frames["details"]})
+        etl.data_quality(frames["dimensions"]["artists"], 'artists')
+        etl.data_quality(frames["dimensions"]["albums"], 'albums')
+        etl.data_quality(frames["dimensions"]["track_artists"], 'track_artists', references={"artists": frames["dimensions"]["artists"]})
+        etl.data_quality(frames["dimensions"]["track_albums"], 'track_albums', references={"albums": frames["dimensions"]["albums"]})
+        return rows(frames)
+
+    def load():
+        loader.load(frames["tracks"], frames["details"], frames["features"], bulk=True, dimensions=frames["dimensions"])
+        return rows(frames)
+
+    def aggregate():
+        return aggregator.update(frames["tracks"])
+
+    # The ETL reports every step and retry, keep the benchmark output readable
+    with contextlib.redirect_stdout(io.StringIO()):
+        for name, function in zip(STAGES, [extract, details, features, dimensions, quality, load, aggregate]):
+            stage(name, function)
+
+    engine.dispose()
+    return stages
+
+# Helper to get the current commit, to tell saved results apart
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__)), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def benchmark(settings, repeat):
+    server = MockSpotifyServer(plays=settings["plays"], tracks=settings["tracks"], latency=settings["latency"],
+                               error_rate=settings["error_rate"], rate_limit=settings["rate_limit"]).start()
+
+    with tempfile.TemporaryDirectory() as folder:
+        db_url = os.getenv("BENCH_DB_URL") or f"sqlite:///{os.path.join(folder, 'bench.db')}"
+
+        # Timed runs, each with a fresh database and a fresh error generator
+        runs = []
+        recorder = LatencyRecorder()
+        metrics = RunMetrics("bench", [recorder])
+        for _ in range(repeat):
+            server.random.seed(0)
+            runs.append(run_pipeline(server, db_url, settings, metrics))
+
+        # One more run under tracemalloc for the peak memory of each stage
+        server.random.seed(0)
+        tracemalloc.start()
+        try:
+            memory_run = run_pipeline(server, db_url, settings, RunMetrics("memory"), trace_memory=True)
+        finally:
+            tracemalloc.stop()
+
+        dialect = create_engine(db_url).dialect.name
+
+    server.stop()
+
+    stages = {}
+    for name in STAGES:
+        seconds = statistics.median(run[name]["seconds"] for run in runs)
+        rows = runs[-1][name]["rows"]
+        stages[name] = {
+            "seconds": round(seconds, 4),
+            "rows": rows,
+            "rows_per_second": round(rows / seconds, 1) if seconds else None,
+            "peak_mib": round(memory_run[name]["peak_mib"], 2),
+        }
+
+    # Requests and their outcome summed over the timed runs, reported per run
+    report = metrics.report()
+    endpoints = {}
+    for endpoint, latencies in sorted(recorder.latencies.items()):
+        counters = report["endpoints"][endpoint]
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        endpoints[endpoint] = {
+            "requests": counters["requests"] // repeat,
+            "errors": counters["errors"] // repeat,
+            "throttled": counters["throttled"] // repeat,
+            "retries": counters["retries"] // repeat,
+            "p50_ms": round(p50, 2),
+            "p95_ms": round(p95, 2),
+            "p99_ms": round(p99, 2),
+        }
+
+    return {
+        "commit": git_commit(),
+        "database": dialect,
+        "settings": settings,
+        "repeat": repeat,
+        "total_seconds": round(sum(stage["seconds"] for stage in stages.values()), 4),
+        "stages": stages,
+        "endpoints": endpoints,
+    }
+
+def print_results(results):
+    settings = results["settings"]
+    print(f"{settings['plays']} plays over {settings['tracks']} tracks, {settings['latency'] * 1000:.0f} ms per request, "
+          f"{settings['error_rate']:.0%} errors, rate limit {settings['rate_limit'] or 'none'}"
+          f"{' with the RateLimiter' if settings['rate_limiter'] else ''} "
+          f"({results['database']}, median of {results['repeat']} run(s), commit {results['commit']})")
+
+    print(f"{'stage':>10} {'seconds':>8} {'rows':>8} {'rows/s':>10} {'peak MiB':>9}")
+    for name, stage in results["stages"].items():
+        print(f"{name:>10} {stage['seconds']:>8.3f} {stage['rows']:>8} {stage['rows_per_second'] or 0:>10.0f} {stage['peak_mib']:>9.1f}")
+    print(f"{'total':>10} {results['total_seconds']:>8.3f}")
+
+    print(f"{'endpoint':>16} {'requests':>9} {'errors':>7} {'429s':>5} {'retries':>8} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7}")
+    for endpoint, counters in results["endpoints"].items():
+        print(f"{endpoint:>16} {counters['requests']:>9} {counters['errors']:>7} {counters['throttled']:>5} {counters['retries']:>8} "
+              f"{counters['p50_ms']:>7.1f} {counters['p95_ms']:>7.1f} {counters['p99_ms']:>7.1f}")
+
+# Helper to compare the stage timings with saved results, returns the stages slower than the threshold
+def compare(results, baseline, threshold):
+    if baseline["settings"] != results["settings"]:
+        print("Warning: the baseline was measured with other settings, the comparison is not meaningful.")
+
+    print(f"Compared with commit {baseline.get('commit')}:")
+    regressions = []
+    for name, stage in results["stages"].items():
+        before = baseline["stages"].get(name)
+        if not before or not before["seconds"]:
+            continue
+        change = stage["seconds"] / before["seconds"] - 1
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  <- slower"
+        print(f"{name:>10} {before['seconds']:>8.3f}s -> {stage['seconds']:>8.3f}s ({change:+.0%}){flag}")
+
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the ETL end to end against the mock Spotify API.")
+    parser.add_argument("--scenario", choices=SCENARIOS, default="default")
+    parser.add_argument("--plays", type=int, help="override the scenario's number of plays")
+    parser.add_argument("--tracks", type=int, help="override the scenario's number of distinct tracks")
+    parser.add_argument("--latency", type=float, help="override the scenario's seconds per request")
+    parser.add_argument("--error-rate", type=float, help="override the scenario's fraction of 503 responses")
+    parser.add_argument("--rate-limit", type=int, help="override the scenario's requests per second before 429s")
+    parser.add_argument("--rate-limiter", action="store_true", default=None,
+                        help="send the requests through the client-side RateLimiter and its default limits")
+    parser.add_argument("--repeat", type=int, default=3, help="timed runs, the median is reported")
+    parser.add_argument("--output", help="save the results as JSON")
+    parser.add_argument("--compare", help="results JSON of an earlier commit to compare with")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown of a stage reported as a regression")
+    args = parser.parse_args()
+
+    settings = dict(SCENARIOS[args.scenario])
+    for name in ("plays", "tracks", "latency", "error_rate", "rate_limit", "rate_limiter"):
+        if getattr(args, name) is not None:
+            settings[name] = getattr(args, name)
+
+    results = benchmark(settings, args.repeat)
+    print_results(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        if regressions:
+            print(f"Regression in {', '.join(regressions)}")
+            sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,55 @@
+# Benchmark: throughput and 429 responses of the HttpClient with and without the per-endpoint RateLimiter
+# against a mock API that only accepts SERVER_RATE requests per second
+#
+# Usage: python benchmarks/bench_rate_limit.py
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from mock_spotify import MockSpotifyServer
+from spotify_token import HttpClient, RateLimiter
+
+REQUESTS = 3_000
+WORKERS = 16
+SERVER_RATE = 100
+RETRY_AFTER = 3
+
+# The limiter starts above what the server accepts, so it has to find the sustainable rate on its own
+CLIENT_LIMITS = {"tracks": (2 * SERVER_RATE, 20), "default": (2 * SERVER_RATE, 20)}
+
+def run(server, client):
+    url = f"{server.base_url}/tracks/abc"
+    headers = {"Authorization": "Bearer mock-token"}
+    server.throttled_count = 0
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=WORKERS) as executor:
+        statuses = list(executor.map(lambda _: client.get(url, headers=headers).status_code, range(REQUESTS)))
+    elapsed = time.perf_counter() - start
+
+    ok = sum(status == 200 for status in statuses)
+    return ok / elapsed, server.throttled_count, REQUESTS - ok
+
+def main():
+    server = MockSpotifyServer(rate_limit=SERVER_RATE, retry_after=RETRY_AFTER).start()
+
+    print(f"{REQUESTS} requests, {WORKERS} workers, server limit {SERVER_RATE} req/s, Retry-After {RETRY_AFTER}s")
+    print(f"{'client':>12} {'ok req/s':>9} {'429s':>6} {'failed':>7}")
+
+    throughput, throttled, failed = run(server, HttpClient(pool_size=WORKERS))
+    print(f"{'unlimited':>12} {throughput:>9.0f} {throttled:>6} {failed:>7}")
+
+    rate_limiter = RateLimiter(CLIENT_LIMITS)
+    throughput, throttled, failed = run(server, HttpClient(pool_size=WORKERS, rate_limiter=rate_limiter))
+    print(f"{'rate limited':>12} {throughput:>9.0f} {throttled:>6} {failed:>7}")
+
+    tracks = rate_limiter.stats()["tracks"]
+    print(f"Limiter: waited {tracks['waited']:.2f}s in total, {tracks['throttled']} throttled, settled at {tracks['rate']:.0f} req/s")
+
+    server.stop()
+
+if __name__ == "__main__":
+    main()
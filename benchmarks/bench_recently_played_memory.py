@@ -0,0 +1,46 @@
+# Benchmark: peak Python memory of extracting recently played tracks from a mocked paginated endpoint,
+# materializing every page into one DataFrame vs consuming the pages as they arrive
+#
+# Usage: python benchmarks/bench_recently_played_memory.py
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from mock_spotify import MockSpotifyServer, StaticTokenManager
+from spotify_etl import SpotifyETL
+
+def peak_memory(function):
+    tracemalloc.start()
+    result = function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, peak / 1024 / 1024
+
+def main():
+    print(f"{'plays':>7} {'pages':>6} {'materialized MiB':>17} {'streaming MiB':>14}")
+
+    for plays in (1_000, 10_000, 50_000):
+        server = MockSpotifyServer(plays=plays).start()
+        etl = SpotifyETL(
+            StaticTokenManager(),
+            recent_tracks_url=f"{server.base_url}/me/player/recently-played",
+            tracks_details_url=f"{server.base_url}/tracks",
+            tracks_features_url=f"{server.base_url}/audio-features"
+        )
+
+        # Materialized: every page ends up in a single DataFrame
+        rows, materialized = peak_memory(lambda: len(etl.extract_recently_played_tracks(after=0)))
+        assert rows == plays
+
+        # Streaming: each page is handed over and released before the next one is fetched
+        server.reset_count()
+        rows, streaming = peak_memory(lambda: sum(len(page) for page in etl.iter_recently_played_pages(after=0)))
+        assert rows == plays
+
+        print(f"{plays:>7} {server.request_count:>6} {materialized:>17.1f} {streaming:>14.1f}")
+        server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# Benchmark: the typed schema of spotify_schema.py vs the string schema it replaced (played_at and
+# timestamp as VARCHAR and Python strings, 32-bit numbers, no index on played_at): DataFrame memory of
+# the plays, track details and track features, size of the recent_tracks table, and latency of a
+# one-day time-range query over every listener's plays
+#
+# Usage: python benchmarks/bench_schema.py [plays...]   (default: 100000 1000000)
+# Runs on throwaway SQLite files, or on the database of BENCH_DB_URL (its ETL tables are dropped)
+import os
+import statistics
+import sys
+import tempfile
+import time
+from datetime import timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pandas as pd
+from sqlalchemy import DateTime, bindparam, create_engine, make_url, text
+
+from fake_data import make_tracks_df, make_details_df, make_features_df
+from spotify_load import SpotifyLoader
+from spotify_parse import typed_frame
+from spotify_schema import TABLES, RECENT_TRACKS_DTYPES, TRACK_DETAILS_DTYPES, TRACK_FEATURES_DTYPES
+
+QUERY_REPEAT = 20
+
+# The string schema, as loaded before spotify_schema.py
+LEGACY_RECENT_TRACKS_DDL = """
+    CREATE TABLE recent_tracks_legacy(
+    user_id VARCHAR(200),
+    played_at VARCHAR(200),
+    track_id VARCHAR(200),
+    timestamp VARCHAR(200),
+    PRIMARY KEY (user_id, played_at)
+)
+"""
+
+LEGACY_DTYPES = {
+    "recent_tracks": {"track_id": object, "played_at": object, "timestamp": object, "user_id": object},
+    "track_details": dict(TRACK_DETAILS_DTYPES, popularity="int32"),
+    "track_features": dict(TRACK_FEATURES_DTYPES, key="int32", mode="int32", time_signature="int32"),
+}
+
+# The plays of one day, every listener's
+RANGE_QUERY = "SELECT COUNT(*), COUNT(DISTINCT track_id) FROM {table} WHERE played_at >= :start AND played_at < :end"
+
+# Helper to turn typed plays back into the strings Spotify sends, as the old parser kept them
+def legacy_tracks_df(tracks_df):
+    return typed_frame(pd.DataFrame({
+        "track_id": tracks_df["track_id"],
+        "played_at": tracks_df["played_at"].dt.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        "timestamp": tracks_df["timestamp"].dt.strftime("%Y-%m-%d"),
+        "user_id": tracks_df["user_id"].astype(str),
+    }), LEGACY_DTYPES["recent_tracks"])
+
+def memory_mib(*frames):
+    return sum(df.memory_usage(deep=True).sum() for df in frames) / 2**20
+
+# Helper to get the size of a table with its indexes, in MiB
+def table_mib(engine, table_name):
+    with engine.connect() as connection:
+        if engine.dialect.name == "postgresql":
+            size = connection.execute(text(f"SELECT pg_total_relation_size('{table_name}')")).scalar()
+        else:
+            # Every page of the table and its indexes, through the dbstat virtual table
+            size = connection.execute(
+                text("SELECT SUM(pgsize) FROM dbstat WHERE name = :name OR name IN "
+                     "(SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = :name)"),
+                {"name": table_name}
+            ).scalar()
+    return size / 2**20
+
+# Helper to time the one-day query, median of QUERY_REPEAT runs in milliseconds
+def query_ms(engine, statement, params):
+    times = []
+    with engine.connect() as connection:
+        for _ in range(QUERY_REPEAT):
+            start = time.perf_counter()
+            connection.execute(statement, params).fetchall()
+            times.append(time.perf_counter() - start)
+    return statistics.median(times) * 1000
+
+def reset_tables(engine):
+    with engine.begin() as connection:
+        for table_name in ["recent_tracks_legacy", *TABLES]:
+            connection.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+
+def run(engine, size):
+    reset_tables(engine)
+
+    # Half the plays for each of two listeners, so the (user_id, played_at) key can't serve the range
+    tracks_df = pd.concat([make_tracks_df(size // 2), make_tracks_df(size - size // 2).assign(user_id="other")],
+                          ignore_index=True)
+    tracks_df = typed_frame(tracks_df, RECENT_TRACKS_DTYPES)
+    track_ids = tracks_df["track_id"].unique()
+    details_df = typed_frame(make_details_df(track_ids), TRACK_DETAILS_DTYPES)
+    features_df = typed_frame(make_features_df(track_ids), TRACK_FEATURES_DTYPES)
+
+    legacy_df = legacy_tracks_df(tracks_df)
+    before_mib = memory_mib(legacy_df, typed_frame(details_df, LEGACY_DTYPES["track_details"]),
+                            typed_frame(features_df, LEGACY_DTYPES["track_features"]))
+    after_mib = memory_mib(tracks_df, details_df, features_df)
+
+    # The same plays in the string table and in the typed one
+    with engine.begin() as connection:
+        connection.execute(text(LEGACY_RECENT_TRACKS_DDL))
+    legacy_df.to_sql("recent_tracks_legacy", engine, if_exists="append", index=False, chunksize=10_000)
+    loader = SpotifyLoader(engine)
+    loader.create_tables()
+    loader.load(tracks_df, details_df, features_df)
+    if engine.dialect.name == "postgresql":
+        with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as connection:
+            connection.execute(text("VACUUM ANALYZE recent_tracks_legacy"))
+            connection.execute(text("VACUUM ANALYZE recent_tracks"))
+    else:
+        with engine.begin() as connection:
+            connection.execute(text("ANALYZE"))
+
+    # A day in the middle of the history
+    day = tracks_df["timestamp"].iloc[len(tracks_df) // 4].to_pydatetime().replace(tzinfo=timezone.utc)
+    next_day = day + timedelta(days=1)
+    legacy_ms = query_ms(engine, text(RANGE_QUERY.format(table="recent_tracks_legacy")),
+                         {"start": day.strftime("%Y-%m-%dT%H:%M:%S"), "end": next_day.strftime("%Y-%m-%dT%H:%M:%S")})
+    typed_statement = text(RANGE_QUERY.format(table="recent_tracks")).bindparams(
+        bindparam("start", type_=DateTime(timezone=True)), bindparam("end", type_=DateTime(timezone=True)))
+    typed_ms = query_ms(engine, typed_statement, {"start": day, "end": next_day})
+
+    return before_mib, after_mib, table_mib(engine, "recent_tracks_legacy"), table_mib(engine, "recent_tracks"), legacy_ms, typed_ms
+
+def main():
+    sizes = [int(size) for size in sys.argv[1:]] or [100_000, 1_000_000]
+    db_url = os.getenv("BENCH_DB_URL")
+
+    print(f"{make_url(db_url).get_backend_name() if db_url else 'sqlite'} database, one-day query median of {QUERY_REPEAT} runs")
+    print(f"{'plays':>9} {'frames MiB':>16} {'table MiB':>16} {'range query ms':>18}")
+    print(f"{'':>9} {'before':>7} {'after':>8} {'before':>7} {'after':>8} {'before':>8} {'after':>9}")
+
+    for size in sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = create_engine(db_url or f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+            before_mib, after_mib, legacy_table, typed_table, legacy_ms, typed_ms = run(engine, size)
+            if db_url:
+                reset_tables(engine)
+            engine.dispose()
+
+        print(f"{size:>9} {before_mib:>7.1f} {after_mib:>8.1f} {legacy_table:>7.1f} {typed_table:>8.1f} {legacy_ms:>8.2f} {typed_ms:>9.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+# Benchmark: per-track vs batched track details extraction against the local mock API
+#
+# Usage: python benchmarks/bench_track_details.py
+import os
+import sys
+import time
+
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from mock_spotify import MockSpotifyServer, StaticTokenManager
+from spotify_etl import SpotifyETL
+
+def run(etl, server, track_df, batched):
+    server.reset_count()
+    start = time.perf_counter()
+    details_df = etl.extract_track_details(track_df, batched=batched)
+    elapsed = time.perf_counter() - start
+    return server.request_count, elapsed, len(details_df)
+
+def main():
+    server = MockSpotifyServer().start()
+    etl = SpotifyETL(
+        StaticTokenManager(),
+        recent_tracks_url=f"{server.base_url}/me/player/recently-played",
+        tracks_details_url=f"{server.base_url}/tracks",
+        tracks_features_url=f"{server.base_url}/audio-features"
+    )
+
+    print(f"{'ids':>6} {'mode':>9} {'requests':>9} {'rows':>6} {'seconds':>8}")
+    for n in (1_000, 10_000):
+        track_df = pd.DataFrame({"track_id": [f"id{i:07d}" for i in range(n)]})
+        for batched in (False, True):
+            requests, elapsed, rows = run(etl, server, track_df, batched)
+            mode = "batched" if batched else "per-track"
+            print(f"{n:>6} {mode:>9} {requests:>9} {rows:>6} {elapsed:>8.2f}")
+
+    server.stop()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# Synthetic ETL DataFrames, shaped like SpotifyETL's output, for the load and transform benchmarks
+import numpy as np
+import pandas as pd
+
+from spotify_etl import DEFAULT_USER_ID, TRACK_DETAILS_COLUMNS, TRACK_FEATURES_COLUMNS
+from spotify_parse import typed_frame, played_day
+from spotify_schema import RECENT_TRACKS_DTYPES
+
+# Helper to build n plays, one per minute starting `start` minutes after 2020-01-01, over `tracks` distinct tracks
+def make_tracks_df(n, start=0, tracks=10_000):
+    played_at = pd.Series(pd.Timestamp("2020-01-01", tz="UTC") + pd.to_timedelta(np.arange(start, start + n), unit="min"))
+    return typed_frame(pd.DataFrame({
+        "track_id": pd.Series(np.arange(start, start + n) % tracks).map("id{:07d}".format).astype(object),
+        "played_at": played_at,
+        "timestamp": played_day(played_at),
+        "user_id": DEFAULT_USER_ID
+    }), RECENT_TRACKS_DTYPES)
+
+# Helper to build the track details rows of the given track IDs
+def make_details_df(track_ids):
+    track_ids = pd.Series(track_ids)
+    n = len(track_ids)
+    rng = np.random.default_rng(0)
+    return pd.DataFrame({
+        "track_id": track_ids,
+        "track_name": "Track " + track_ids,
+        "artist_name": "Artist " + (track_ids.str[-3:]),
+        "album_name": "Album " + (track_ids.str[-4:]),
+        "release_date": "2020-01-01",
+        "length": rng.integers(60_000, 400_000, n),
+        "popularity": rng.integers(0, 100, n),
+        "explicit": rng.integers(0, 2, n).astype(bool),
+        "type": "track"
+    }, columns=TRACK_DETAILS_COLUMNS)
+
+# Helper to build the audio features rows of the given track IDs
+def make_features_df(track_ids):
+    track_ids = pd.Series(track_ids)
+    n = len(track_ids)
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame({"track_id": track_ids})
+    for column in ("danceability", "energy", "acousticness", "instrumentalness", "liveness", "speechiness", "valence"):
+        df[column] = rng.random(n)
+    df["duration_ms"] = rng.integers(60_000, 400_000, n)
+    df["key"] = rng.integers(0, 12, n)
+    df["loudness"] = rng.uniform(-30, 0, n)
+    df["mode"] = rng.integers(0, 2, n)
+    df["tempo"] = rng.uniform(60, 200, n)
+    df["time_signature"] = rng.integers(3, 8, n)
+    return df[TRACK_FEATURES_COLUMNS]
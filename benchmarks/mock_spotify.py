@@ -0,0 +1,346 @@
+# Local mock of the Spotify Web API used by the benchmarks in this folder
+#
+# It can also be run on its own, e.g. to point the DAG or spotify_etl.py at it:
+# python benchmarks/mock_spotify.py --port 8000 --plays 5000 --latency 0.02
+import argparse
+import json
+import random
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+# Time of the first play in the mocked listening history
+PLAYS_START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+# Helper to build a fake track object for an ID, shaped like Spotify's /v1/tracks response
+# Tracks share albums and artists like a real library: ten tracks per album and per artist, and one
+# track in four also credits a featured artist shared by a hundred tracks.
+def fake_track(track_id):
+    artists = [{"id": f"artist-{track_id[:-1]}", "name": f"Artist {track_id[:-1]}"}]
+    if track_id[-1] in "048":
+        artists.append({"id": f"artist-{track_id[:-2]}", "name": f"Artist {track_id[:-2]}"})
+
+    return {
+        "id": track_id,
+        "name": f"Track {track_id}",
+        "artists": artists,
+        "album": {"id": f"album-{track_id[:-1]}", "name": f"Album {track_id[:-1]}", "release_date": "2020-01-01"},
+        "duration_ms": 200000,
+        "popularity": 50,
+        "explicit": False,
+        "type": "track"
+    }
+
+# Helper to build fake audio features for an ID, shaped like Spotify's /v1/audio-features response
+def fake_audio_features(track_id):
+    return {
+        "id": track_id,
+        "danceability": 0.5,
+        "duration_ms": 200000,
+        "energy": 0.5,
+        "acousticness": 0.5,
+        "instrumentalness": 0.0,
+        "key": 5,
+        "liveness": 0.1,
+        "loudness": -6.0,
+        "mode": 1,
+        "speechiness": 0.05,
+        "tempo": 120.0,
+        "time_signature": 4,
+        "valence": 0.5
+    }
+
+# Helper to build a fake artist object for an ID, shaped like Spotify's /v1/artists response
+def fake_artist(artist_id):
+    return {
+        "id": artist_id,
+        "name": f"Artist {artist_id.removeprefix('artist-')}",
+        "genres": ["rock", "indie rock"] if len(artist_id) % 2 else ["pop"],
+        "popularity": 60,
+        "followers": {"href": None, "total": 12345},
+        "type": "artist"
+    }
+
+# Helper to build a fake album object for an ID, shaped like Spotify's /v1/albums response
+def fake_album(album_id):
+    return {
+        "id": album_id,
+        "name": f"Album {album_id.removeprefix('album-')}",
+        "album_type": "album",
+        "release_date": "2020-01-01",
+        "total_tracks": 10,
+        "label": "Mock Records",
+        "popularity": 40,
+        "type": "album"
+    }
+
+# Helper to build the recently played item number i: one play per minute since 2020-01-01, over `tracks` tracks
+def fake_play(i, tracks):
+    played_at = PLAYS_START + timedelta(minutes=i)
+    return {
+        "track": fake_track(f"id{i % tracks:07d}"),
+        "played_at": played_at.strftime("%Y-%m-%dT%H:%M:%S.000Z"),
+        "context": None
+    }
+
+# Helper to get the Unix timestamp in milliseconds of the recently played item number i
+def play_timestamp(i):
+    return int((PLAYS_START + timedelta(minutes=i)).timestamp()) * 1000
+
+# Request handler serving the mocked endpoints
+class MockSpotifyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    # Send headers and body in one segment, otherwise Nagle's algorithm and delayed ACKs
+    # stall every response on a keep-alive connection by ~40ms
+    disable_nagle_algorithm = True
+    wbufsize = -1
+
+    def do_GET(self):
+        server = self.server
+        server.count_request()
+
+        # Simulate network and server time
+        if server.latency:
+            time.sleep(server.latency)
+
+        if not server.admit():
+            self.send_json(429, {"error": {"status": 429, "message": "API rate limit exceeded"}},
+                           {"Retry-After": str(server.retry_after)})
+            return
+
+        if server.fail():
+            self.send_json(503, {"error": {"status": 503, "message": "Service unavailable"}})
+            return
+
+        if not server.authorize(self.headers.get("Authorization", "")):
+            self.send_json(401, {"error": {"status": 401, "message": "The access token expired"}})
+            return
+
+        parsed = urlparse(self.path)
+        params = parse_qs(parsed.query)
+        parts = parsed.path.rstrip("/").split("/")
+
+        if parsed.path == "/v1/me/player/recently-played":
+            # Pages of `limit` plays after the `after` cursor, oldest first, like a cursor-paginated API
+            limit = min(int(params.get("limit", ["20"])[0]), 50)
+            after = int(params.get("after", ["0"])[0])
+            first = max(0, -(-(after + 1 - play_timestamp(0)) // 60_000))
+            last = min(first + limit, server.plays)
+            items = [fake_play(i, server.tracks) for i in range(first, last)]
+
+            next_url = None
+            if last < server.plays and items:
+                next_url = f"{server.base_url}/me/player/recently-played?limit={limit}&after={play_timestamp(last - 1)}"
+
+            self.send_json(200, {"items": items, "next": next_url, "limit": limit})
+
+        elif parsed.path == "/v1/tracks":
+            ids = params.get("ids", [""])[0].split(",")
+            body = {"tracks": [None if i in server.missing_ids else fake_track(i) for i in ids]}
+            self.send_json(200, body)
+
+        elif parsed.path.startswith("/v1/tracks/"):
+            track_id = parts[-1]
+            if track_id in server.missing_ids:
+                self.send_json(404, {"error": {"status": 404, "message": "Not found"}})
+            else:
+                self.send_json(200, fake_track(track_id))
+
+        elif parsed.path == "/v1/audio-features":
+            ids = params.get("ids", [""])[0].split(",")
+            body = {"audio_features": [None if i in server.missing_ids else fake_audio_features(i) for i in ids]}
+            self.send_json(200, body)
+
+        elif parsed.path == "/v1/artists":
+            ids = params.get("ids", [""])[0].split(",")
+            body = {"artists": [None if i in server.missing_ids else fake_artist(i) for i in ids]}
+            self.send_json(200, body)
+
+        elif parsed.path == "/v1/albums":
+            ids = params.get("ids", [""])[0].split(",")
+            body = {"albums": [None if i in server.missing_ids else fake_album(i) for i in ids]}
+            self.send_json(200, body)
+
+        elif parsed.path.startswith("/v1/audio-features/"):
+            track_id = parts[-1]
+            if track_id in server.missing_ids:
+                self.send_json(404, {"error": {"status": 404, "message": "Not found"}})
+            else:
+                self.send_json(200, fake_audio_features(track_id))
+
+        else:
+            self.send_json(404, {"error": {"status": 404, "message": "Unknown endpoint"}})
+
+    def do_POST(self):
+        server = self.server
+        server.count_request()
+
+        # Drain the form body so the keep-alive connection stays usable
+        self.rfile.read(int(self.headers.get("Content-Length", 0)))
+
+        if server.latency:
+            time.sleep(server.latency)
+
+        if urlparse(self.path).path == "/api/token":
+            self.send_json(200, {
+                "access_token": server.issue_token(),
+                "token_type": "Bearer",
+                "expires_in": server.token_expires_in
+            })
+        else:
+            self.send_json(404, {"error": {"status": 404, "message": "Unknown endpoint"}})
+
+    def send_json(self, status, body, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    # Silence the default per-request logging
+    def log_message(self, format, *args):
+        pass
+
+# Threaded HTTP server that counts the requests it receives
+class MockSpotifyServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, port=0, missing_ids=(), latency=0.0, plays=0, tracks=1_000, token_expires_in=3600, token_uses=None,
+                 rate_limit=None, retry_after=1, error_rate=0.0, seed=0):
+        super().__init__(("127.0.0.1", port), MockSpotifyHandler)
+        # Fraction of the API requests answered with a 503, drawn from a seeded generator so runs are comparable
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.error_count = 0
+        # When set, going over rate_limit API requests per second gets every request a 429 for retry_after seconds
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.recent_requests = deque()
+        self.blocked_until = 0.0
+        self.throttled_count = 0
+        self.token_expires_in = token_expires_in
+        self.tokens_issued = 0
+        # When set, only tokens issued by the token endpoint are accepted, each for this many requests
+        self.token_uses = token_uses
+        self.remaining_uses = {}
+        self.plays = plays
+        self.tracks = tracks
+        self.latency = latency
+        self.missing_ids = set(missing_ids)
+        self.request_count = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    @property
+    def token_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/api/token"
+
+    # Method to hand out a new access token from the token endpoint
+    def issue_token(self):
+        with self._lock:
+            self.tokens_issued += 1
+            token = f"mock-token-{self.tokens_issued}"
+            self.remaining_uses[token] = self.token_uses
+            return token
+
+    # Method to check the bearer token of an API request, simulating tokens expiring mid-run
+    def authorize(self, authorization):
+        if self.token_uses is None:
+            return True
+
+        token = authorization.removeprefix("Bearer ")
+        with self._lock:
+            if self.remaining_uses.get(token, 0) <= 0:
+                return False
+            self.remaining_uses[token] -= 1
+            return True
+
+    # Method to apply the server-side rate limit over a sliding one second window
+    def admit(self):
+        if self.rate_limit is None:
+            return True
+
+        now = time.monotonic()
+        with self._lock:
+            # Like Spotify, a client over the limit is rejected until its Retry-After delay is over
+            if now < self.blocked_until:
+                self.throttled_count += 1
+                return False
+
+            while self.recent_requests and now - self.recent_requests[0] >= 1:
+                self.recent_requests.popleft()
+            if len(self.recent_requests) >= self.rate_limit:
+                self.blocked_until = now + self.retry_after
+                self.throttled_count += 1
+                return False
+            self.recent_requests.append(now)
+            return True
+
+    # Method to decide whether an API request fails with a transient server error
+    def fail(self):
+        if not self.error_rate:
+            return False
+
+        with self._lock:
+            if self.random.random() < self.error_rate:
+                self.error_count += 1
+                return True
+            return False
+
+    def count_request(self):
+        with self._lock:
+            self.request_count += 1
+
+    def reset_count(self):
+        with self._lock:
+            self.request_count = 0
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+# Token manager stand-in that hands out a fixed token, so benchmarks never call accounts.spotify.com
+class StaticTokenManager:
+    def get_access_token(self):
+        return "mock-token"
+
+    def refresh_rejected_token(self, rejected_token):
+        return "mock-token"
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a mock of the Spotify Web API on localhost.")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--plays", type=int, default=1_000, help="plays in the listening history, one per minute from 2020-01-01")
+    parser.add_argument("--tracks", type=int, default=1_000, help="distinct tracks the plays cycle through")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of API requests answered with a 503")
+    parser.add_argument("--rate-limit", type=int, help="API requests per second before every request gets a 429")
+    parser.add_argument("--retry-after", type=int, default=1, help="seconds a client over the rate limit is rejected for")
+    args = parser.parse_args()
+
+    server = MockSpotifyServer(args.port, plays=args.plays, tracks=args.tracks, latency=args.latency,
+                               rate_limit=args.rate_limit, retry_after=args.retry_after, error_rate=args.error_rate)
+    print(f"API: {server.base_url}")
+    print(f"Token endpoint: {server.token_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+if __name__ == "__main__":
+    main()
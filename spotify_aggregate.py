@@ -0,0 +1,228 @@
+import argparse
+import os
+from datetime import date, datetime, time, timedelta, timezone
+
+from dotenv import load_dotenv
+from sqlalchemy import DateTime, bindparam, create_engine, text
+
+from spotify_metrics import NULL_METRICS, metrics_from_env, timed_stage
+
+# DDL of the summary tables maintained from recent_tracks, track_details and track_features
+# Days and hours are UTC, like played_at. Plays without track details count in the totals but
+# not in ms_played; plays without audio features are left out of the averages (see feature_plays).
+DAILY_LISTENING_DDL = """
+    CREATE TABLE IF NOT EXISTS daily_listening(
+    user_id VARCHAR(200),
+    day DATE,
+    plays INTEGER,
+    distinct_tracks INTEGER,
+    ms_played BIGINT,
+    PRIMARY KEY (user_id, day)
+)
+"""
+
+HOURLY_LISTENING_DDL = """
+    CREATE TABLE IF NOT EXISTS hourly_listening(
+    user_id VARCHAR(200),
+    day DATE,
+    hour INTEGER,
+    plays INTEGER,
+    ms_played BIGINT,
+    PRIMARY KEY (user_id, day, hour)
+)
+"""
+
+DAILY_ARTIST_LISTENING_DDL = """
+    CREATE TABLE IF NOT EXISTS daily_artist_listening(
+    user_id VARCHAR(200),
+    day DATE,
+    artist_name VARCHAR(200),
+    plays INTEGER,
+    ms_played BIGINT,
+    PRIMARY KEY (user_id, day, artist_name)
+)
+"""
+
+DAILY_AUDIO_PROFILE_DDL = """
+    CREATE TABLE IF NOT EXISTS daily_audio_profile(
+    user_id VARCHAR(200),
+    day DATE,
+    feature_plays INTEGER,
+    avg_danceability FLOAT,
+    avg_energy FLOAT,
+    avg_valence FLOAT,
+    avg_acousticness FLOAT,
+    avg_instrumentalness FLOAT,
+    avg_speechiness FLOAT,
+    avg_loudness FLOAT,
+    avg_tempo FLOAT,
+    PRIMARY KEY (user_id, day)
+)
+"""
+
+# Plays of one listener within a range of days, found through the (user_id, played_at) primary key
+PLAYS_IN_RANGE = "r.user_id = :user_id AND r.played_at >= :start AND r.played_at < :end"
+
+# UTC hour of a play on each database (SQLite stores played_at as "YYYY-MM-DD HH:MM:SS.ffffff" in UTC)
+HOUR_EXPRESSIONS = {
+    "postgresql": "CAST(EXTRACT(HOUR FROM r.played_at AT TIME ZONE 'UTC') AS INTEGER)",
+    "sqlite": "CAST(SUBSTR(r.played_at, 12, 2) AS INTEGER)",
+}
+
+# Each summary table: its DDL, key, and the SELECT computing its rows from the plays in range
+AGGREGATES = {
+    "daily_listening": {
+        "ddl": DAILY_LISTENING_DDL,
+        "key": ["user_id", "day"],
+        "select": f"""
+            SELECT r.user_id, r.timestamp, COUNT(*), COUNT(DISTINCT r.track_id), COALESCE(SUM(d.length), 0)
+            FROM recent_tracks r LEFT JOIN track_details d ON d.track_id = r.track_id
+            WHERE {PLAYS_IN_RANGE}
+            GROUP BY r.user_id, r.timestamp
+        """,
+        "columns": ["user_id", "day", "plays", "distinct_tracks", "ms_played"],
+    },
+    "hourly_listening": {
+        "ddl": HOURLY_LISTENING_DDL,
+        "key": ["user_id", "day", "hour"],
+        "select": f"""
+            SELECT r.user_id, r.timestamp, {{hour}}, COUNT(*), COALESCE(SUM(d.length), 0)
+            FROM recent_tracks r LEFT JOIN track_details d ON d.track_id = r.track_id
+            WHERE {PLAYS_IN_RANGE}
+            GROUP BY r.user_id, r.timestamp, {{hour}}
+        """,
+        "columns": ["user_id", "day", "hour", "plays", "ms_played"],
+    },
+    "daily_artist_listening": {
+        "ddl": DAILY_ARTIST_LISTENING_DDL,
+        "key": ["user_id", "day", "artist_name"],
+        "select": f"""
+            SELECT r.user_id, r.timestamp, d.artist_name, COUNT(*), COALESCE(SUM(d.length), 0)
+            FROM recent_tracks r JOIN track_details d ON d.track_id = r.track_id
+            WHERE {PLAYS_IN_RANGE} AND d.artist_name IS NOT NULL
+            GROUP BY r.user_id, r.timestamp, d.artist_name
+        """,
+        "columns": ["user_id", "day", "artist_name", "plays", "ms_played"],
+    },
+    "daily_audio_profile": {
+        "ddl": DAILY_AUDIO_PROFILE_DDL,
+        "key": ["user_id", "day"],
+        "select": f"""
+            SELECT r.user_id, r.timestamp, COUNT(*), AVG(f.danceability), AVG(f.energy), AVG(f.valence),
+                   AVG(f.acousticness), AVG(f.instrumentalness), AVG(f.speechiness), AVG(f.loudness), AVG(f.tempo)
+            FROM recent_tracks r JOIN track_features f ON f.track_id = r.track_id
+            WHERE {PLAYS_IN_RANGE}
+            GROUP BY r.user_id, r.timestamp
+        """,
+        "columns": ["user_id", "day", "feature_plays", "avg_danceability", "avg_energy", "avg_valence", "avg_acousticness",
+                    "avg_instrumentalness", "avg_speechiness", "avg_loudness", "avg_tempo"],
+    },
+}
+
+# Helper to read a day given as a date, a datetime or a YYYY-MM-DD string (e.g. from SQLite)
+def as_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+# Helper to get the first and last day of each listener's plays in a recent_tracks DataFrame
+def played_days(tracks_df):
+    days = tracks_df.groupby("user_id", observed=True)["timestamp"].agg(["min", "max"])
+    return {user_id: (as_date(row["min"]), as_date(row["max"])) for user_id, row in days.iterrows()}
+
+# Class to maintain daily and hourly listening summaries per user, artist and audio-feature profile
+# Each run refreshes only the days of its new plays: the rows of those days are recomputed from the
+# plays tables with one INSERT ... SELECT ... GROUP BY per summary table and upserted on the table's key.
+# Recomputing a whole day instead of adding the new plays to it keeps the summaries exact when a page is
+# loaded twice (plays are upserted, a replayed play isn't new) and when details arrive after the play.
+# A run costs O(plays of its days), and dashboards read O(days) rows instead of scanning every play.
+class ListeningAggregator:
+    def __init__(self, engine, metrics=None):
+        self.engine = engine
+        # Optional RunMetrics timing the refreshes and counting the rows written, see spotify_metrics.py
+        self.metrics = metrics or NULL_METRICS
+
+    # Method to create the summary tables if they don't exist yet
+    def create_tables(self):
+        with self.engine.begin() as connection:
+            for aggregate in AGGREGATES.values():
+                connection.execute(text(aggregate["ddl"]))
+
+    # Method to build the statement refreshing a summary table from the plays in range
+    # The range bounds are bound as TIMESTAMPTZ values, so they compare with played_at on every database
+    def refresh_statement(self, table_name):
+        aggregate = AGGREGATES[table_name]
+        select = aggregate["select"].format(hour=HOUR_EXPRESSIONS[self.engine.dialect.name])
+        updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in aggregate["columns"] if column not in aggregate["key"])
+        return text(
+            f"INSERT INTO {table_name} ({', '.join(aggregate['columns'])}) {select} "
+            f"ON CONFLICT ({', '.join(aggregate['key'])}) DO UPDATE SET {updates}"
+        ).bindparams(bindparam("start", type_=DateTime(timezone=True)), bindparam("end", type_=DateTime(timezone=True)))
+
+    # Method to recompute the summaries of the given days within an open transaction
+    # `days` maps each user_id to its first and last day to refresh (inclusive, UTC)
+    # Returns the number of summary rows written
+    def refresh(self, connection, days):
+        rows = 0
+        for table_name in AGGREGATES:
+            statement = self.refresh_statement(table_name)
+            for user_id, (first_day, last_day) in days.items():
+                start = datetime.combine(as_date(first_day), time(), timezone.utc)
+                end = datetime.combine(as_date(last_day) + timedelta(days=1), time(), timezone.utc)
+                result = connection.execute(statement, {"user_id": user_id, "start": start, "end": end})
+                rows += max(result.rowcount, 0)
+        return rows
+
+    # Method to refresh the summaries of the days of freshly loaded plays, in one transaction
+    @timed_stage("aggregate")
+    def update(self, tracks_df):
+        if tracks_df is None or tracks_df.empty:
+            return 0
+
+        days = played_days(tracks_df)
+        with self.engine.begin() as connection:
+            rows = self.refresh(connection, days)
+
+        self.metrics.count("aggregate", "rows_written", rows)
+        print(f"Refreshed {rows} summary row(s) for {len(days)} listener(s).")
+        return rows
+
+    # Method to rebuild the summaries of a listener's whole history (or of every listener), e.g. to
+    # populate them for plays loaded before the summary tables existed
+    @timed_stage("aggregate")
+    def rebuild(self, user_id=None, first_day=None, last_day=None):
+        with self.engine.begin() as connection:
+            query = "SELECT user_id, MIN(timestamp), MAX(timestamp) FROM recent_tracks"
+            if user_id is not None:
+                query += " WHERE user_id = :user_id"
+            history = connection.execute(text(query + " GROUP BY user_id"), {"user_id": user_id}).fetchall()
+
+            days = {user: (first_day or first, last_day or last) for user, first, last in history}
+            rows = self.refresh(connection, days)
+
+        self.metrics.count("aggregate", "rows_written", rows)
+        print(f"Rebuilt {rows} summary row(s) for {len(days)} listener(s).")
+        return rows
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the listening summaries from the plays tables.")
+    parser.add_argument("--user", help="only rebuild this listener's summaries")
+    parser.add_argument("--start", help="first day to rebuild, e.g. 2024-01-01 (default: the first play)")
+    parser.add_argument("--end", help="last day to rebuild (inclusive), e.g. 2024-01-31 (default: the last play)")
+    args = parser.parse_args()
+
+    # Loading environment variables
+    load_dotenv()
+
+    metrics = metrics_from_env()
+    aggregator = ListeningAggregator(create_engine(os.getenv("POSTGRESQL_CONN")), metrics=metrics)
+    aggregator.create_tables()
+    try:
+        aggregator.rebuild(args.user, args.start, args.end)
+    finally:
+        metrics.export()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,340 @@
+import argparse
+import glob
+import gzip
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import date, datetime, timezone
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+from spotify_cache import TrackMetadataCache, DEFAULT_CACHE_PATH
+from spotify_parse import (typed_frame, concat_columns, parse_recently_played_items, parse_tracks, parse_audio_features,
+                           parse_track_links, parse_artists, parse_albums, link_frames, fetch_times)
+from spotify_quality import DataQualityChecker
+from spotify_schema import RECENT_TRACKS_DTYPES, TRACK_DETAILS_DTYPES, TRACK_FEATURES_DTYPES, ARTISTS_DTYPES, ALBUMS_DTYPES
+
+# Default folder of the raw response archive
+DEFAULT_ARCHIVE_PATH = "spotify_archive"
+
+# Number of responses buffered per endpoint before a part file is written
+DEFAULT_FLUSH_RECORDS = 1_000
+
+# File extension of each archive format
+ARCHIVE_FORMATS = {"jsonl": ".jsonl.gz", "parquet": ".parquet"}
+
+# Class to keep the raw JSON responses of the Spotify API in a local landing zone
+# Responses are buffered and written as part files under <path>/<endpoint>/date=YYYY-MM-DD/, the date
+# being the UTC day they were fetched. Each record holds the fetch time, the user_id, the request URL
+# and the untouched response body. The default format is gzipped JSON Lines; "parquet" writes
+# zstd-compressed Parquet files instead and needs pyarrow.
+class RawArchive:
+    def __init__(self, path=DEFAULT_ARCHIVE_PATH, format="jsonl", flush_records=DEFAULT_FLUSH_RECORDS):
+        if format not in ARCHIVE_FORMATS:
+            raise ValueError(f"Unknown archive format {format}, expected one of {', '.join(ARCHIVE_FORMATS)}")
+        if format == "parquet":
+            import pyarrow  # noqa: F401 - fail now rather than at the first flush
+
+        self.path = path
+        self.format = format
+        self.flush_records = flush_records
+        self.buffers = {}
+        self.records_written = 0
+        self._lock = threading.Lock()
+
+    # Method to add a response to the archive, writing the endpoint's buffer once it is full
+    def write(self, endpoint, url, body, user_id):
+        record = {"fetched_at": time.time(), "user_id": user_id, "url": url, "body": json.dumps(body)}
+
+        with self._lock:
+            buffer = self.buffers.setdefault(endpoint, [])
+            buffer.append(record)
+            if len(buffer) >= self.flush_records:
+                self.write_part(endpoint, buffer)
+                self.buffers[endpoint] = []
+
+    # Method to write every buffered response
+    def flush(self):
+        with self._lock:
+            for endpoint, buffer in self.buffers.items():
+                if buffer:
+                    self.write_part(endpoint, buffer)
+            self.buffers = {}
+
+    def close(self):
+        self.flush()
+
+    # Method to write buffered records as one part file per fetch date
+    def write_part(self, endpoint, records):
+        by_date = {}
+        for record in records:
+            date = datetime.fromtimestamp(record["fetched_at"], timezone.utc).date().isoformat()
+            by_date.setdefault(date, []).append(record)
+
+        for date, date_records in by_date.items():
+            folder = os.path.join(self.path, endpoint, f"date={date}")
+            os.makedirs(folder, exist_ok=True)
+            part_path = os.path.join(folder, f"part-{time.time_ns()}-{uuid.uuid4().hex[:8]}{ARCHIVE_FORMATS[self.format]}")
+
+            # Write to a temporary name first, readers never see half-written parts
+            tmp_path = f"{part_path}.tmp"
+            if self.format == "parquet":
+                import pyarrow as pa
+                import pyarrow.parquet as pq
+
+                pq.write_table(pa.Table.from_pylist(date_records), tmp_path, compression="zstd")
+            else:
+                with gzip.open(tmp_path, "wt") as f:
+                    for record in date_records:
+                        f.write(json.dumps(record) + "\n")
+            os.replace(tmp_path, part_path)
+
+            self.records_written += len(date_records)
+
+    # Method to list the fetch dates of an endpoint's partitions between the start and end dates (inclusive), oldest first
+    def dates(self, endpoint, start=None, end=None):
+        dates = sorted(
+            date.fromisoformat(os.path.basename(folder).removeprefix("date="))
+            for folder in glob.glob(os.path.join(self.path, endpoint, "date=*"))
+        )
+        return [day for day in dates if (start is None or day >= start) and (end is None or day <= end)]
+
+    # Method to list the part files of an endpoint fetched between the start and end dates (inclusive)
+    def parts(self, endpoint, start=None, end=None):
+        paths = []
+        for day in self.dates(endpoint, start, end):
+            folder = os.path.join(self.path, endpoint, f"date={day.isoformat()}")
+            paths.extend(sorted(
+                path for extension in ARCHIVE_FORMATS.values()
+                for path in glob.glob(os.path.join(folder, f"*{extension}"))
+            ))
+        return paths
+
+    # Generator yielding the archived records of an endpoint, oldest part first, with parsed bodies
+    def read(self, endpoint, start=None, end=None):
+        for path in self.parts(endpoint, start, end):
+            if path.endswith(".parquet"):
+                import pyarrow.parquet as pq
+
+                records = pq.read_table(path).to_pylist()
+            else:
+                with gzip.open(path, "rt") as f:
+                    records = [json.loads(line) for line in f]
+
+            for record in records:
+                record["body"] = json.loads(record["body"])
+                yield record
+
+# Helper to get the track IDs a tracks or audio-features request asked for, in request order
+def requested_ids(url):
+    parsed = urlparse(url)
+    ids = parse_qs(parsed.query).get("ids")
+    if ids:
+        return ids[0].split(",")
+    return [parsed.path.rstrip("/").split("/")[-1]]
+
+# Column types of the album and artist IDs of the tracks, the rows cached as "links"
+TRACK_LINKS_DTYPES = {"track_id": object, "album_id": object, "artist_ids": object}
+
+# Helper to parse the album and artist IDs of the track objects of a /v1/tracks response as column arrays
+def parse_link_columns(track_ids, tracks):
+    links = parse_track_links(track_ids, tracks)
+    artist_ids = np.empty(len(links), dtype=object)
+    artist_ids[:] = [link["artist_ids"] for link in links]
+    columns = {
+        "track_id": np.array([link["track_id"] for link in links], dtype=object),
+        "album_id": np.array([link["album_id"] for link in links], dtype=object),
+        "artist_ids": artist_ids,
+    }
+    return columns, []
+
+# Archived endpoint, parser, key and column types of each kind of metadata rows, by metadata cache kind
+METADATA_ENDPOINTS = {
+    "details": {"endpoint": "tracks", "field": "tracks", "parse": parse_tracks, "key": "track_id", "dtypes": TRACK_DETAILS_DTYPES},
+    "features": {"endpoint": "audio-features", "field": "audio_features", "parse": parse_audio_features, "key": "track_id",
+                 "dtypes": TRACK_FEATURES_DTYPES},
+    "links": {"endpoint": "tracks", "field": "tracks", "parse": parse_link_columns, "key": "track_id", "dtypes": TRACK_LINKS_DTYPES},
+    "artists": {"endpoint": "artists", "field": "artists", "parse": parse_artists, "key": "artist_id", "dtypes": ARTISTS_DTYPES},
+    "albums": {"endpoint": "albums", "field": "albums", "parse": parse_albums, "key": "album_id", "dtypes": ALBUMS_DTYPES},
+}
+
+# Class to rebuild the ETL DataFrames from a RawArchive and load them without touching the network
+# Plays come from the recently played responses fetched between the start and end dates. Their details,
+# features, artists and albums come from the latest archived response of each ID, fetched up to the end
+# date, and from the metadata cache (read offline) for IDs that were served by the cache.
+# The responses go through the same parsers as the API's, no SpotifyETL (HTTP client, token) is needed.
+# Replayed rows never overwrite rows already loaded: those may come from later runs, with newer values.
+class ArchiveReplay:
+    def __init__(self, archive, cache=None, quality_checker=None, aggregator=None):
+        self.archive = archive
+        self.cache = cache
+        self.quality_checker = quality_checker or DataQualityChecker()
+        # Optional ListeningAggregator refreshing the listening summaries of the replayed days
+        self.aggregator = aggregator
+
+    # Method to rebuild the plays archived between the start and end dates
+    def plays(self, start=None, end=None):
+        pages = [
+            parse_recently_played_items(record["body"]["items"], record["user_id"])
+            for record in self.archive.read("recently-played", start, end)
+        ]
+
+        if not pages:
+            return typed_frame([], RECENT_TRACKS_DTYPES)
+
+        # Consecutive runs overlap, keep each play once
+        tracks_df = pd.concat(pages, ignore_index=True).drop_duplicates(subset=["user_id", "played_at"], ignore_index=True)
+        return typed_frame(tracks_df, RECENT_TRACKS_DTYPES)
+
+    # Method to collect the latest archived row of every requested ID of a kind (see METADATA_ENDPOINTS),
+    # fetched up to the end date, as a DataFrame with the Unix time each row was fetched at (fetched_at)
+    # Partitions are read newest first and an ID is no longer looked for once found, so the scan stops as
+    # soon as every ID has its latest row. `since` maps IDs to the oldest fetch date worth reading for them.
+    def latest_rows(self, kind, ids, end=None, since=None):
+        settings = METADATA_ENDPOINTS[kind]
+        since = since or {}
+        remaining = set(ids)
+        dated_batches = []
+
+        for day in reversed(self.archive.dates(settings["endpoint"], end=end)):
+            remaining = {id_ for id_ in remaining if id_ not in since or since[id_] <= day}
+            if not remaining:
+                break
+
+            batches = []
+            for record in self.archive.read(settings["endpoint"], day, day):
+                body = record["body"]
+                objects = body[settings["field"]] if settings["field"] in body else [body]
+                columns, _ = settings["parse"](requested_ids(record["url"]), objects)
+
+                # Only the rows of the replayed IDs are kept in memory
+                keys = columns[settings["key"]]
+                keep = np.fromiter((id_ in remaining for id_ in keys), dtype=bool, count=len(keys))
+                if keep.any():
+                    batches.append({column: values[keep] for column, values in columns.items()})
+                    batches[-1]["fetched_at"] = np.full(keep.sum(), record["fetched_at"], dtype="float64")
+
+            remaining.difference_update(id_ for batch in batches for id_ in batch[settings["key"]])
+            dated_batches.append(batches)
+
+        # Put the batches back in fetch order, so the last row of an ID is its latest
+        batches = [batch for batches in reversed(dated_batches) for batch in batches]
+        dtypes = {**settings["dtypes"], "fetched_at": "float64"}
+        return concat_columns(batches, dtypes).drop_duplicates(settings["key"], keep="last", ignore_index=True)
+
+    # Method to rebuild the rows of the given IDs of a kind, filling gaps from the cache
+    # Returns the rows and the times they were fetched from the API, as UTC times indexed by ID: a replayed
+    # popularity was observed then, not at replay time (see SpotifyLoader.load).
+    # A row cached at some date up to `end` is as recent as anything archived before that date, so older
+    # partitions aren't read for its ID
+    def metadata_frame(self, kind, ids, end=None):
+        settings = METADATA_ENDPOINTS[kind]
+        key, dtypes = settings["key"], settings["dtypes"]
+
+        cached_times = self.cache.fetched_times(kind, ids) if self.cache is not None else {}
+        since = {}
+        for id_, fetched_at in cached_times.items():
+            fetched_on = datetime.fromtimestamp(fetched_at, timezone.utc).date()
+            if end is None or fetched_on <= end:
+                since[id_] = fetched_on
+
+        df = self.latest_rows(kind, ids, end, since)
+
+        archived = set(df[key])
+        missing = [id_ for id_ in ids if id_ not in archived]
+        if missing and self.cache is not None:
+            cached = self.cache.get_many(kind, missing)
+            if cached:
+                cached_df = typed_frame(list(cached.values()), dtypes).assign(fetched_at=[cached_times.get(id_) for id_ in cached])
+                df = pd.concat([df, cached_df], ignore_index=True)
+
+        # Keep the rows in ids order whether they came from the archive or the cache
+        position = {id_: i for i, id_ in enumerate(ids)}
+        df = df.sort_values(key, key=lambda keys: keys.map(position), ignore_index=True)
+        return typed_frame(df, dtypes), fetch_times(dict(zip(df[key], df["fetched_at"])))
+
+    # Method to rebuild the artists, albums, track_artists and track_albums of the given tracks, like
+    # SpotifyETL.extract_dimensions does from the API
+    def dimensions(self, track_ids, end=None):
+        links_df, _ = self.metadata_frame("links", track_ids, end)
+        track_artists_df, track_albums_df = link_frames(links_df.to_dict("records"))
+
+        return {
+            "artists": self.metadata_frame("artists", list(track_artists_df["artist_id"].unique()), end)[0],
+            "albums": self.metadata_frame("albums", list(track_albums_df["album_id"].unique()), end)[0],
+            "track_artists": track_artists_df,
+            "track_albums": track_albums_df,
+        }
+
+    # Method to rebuild the plays, track details, track features and dimensions of the archived date range,
+    # with the times the details were fetched at
+    def extract(self, start=None, end=None):
+        tracks_df = self.plays(start, end)
+        track_ids = list(tracks_df["track_id"].unique())
+
+        details_df, observed_at = self.metadata_frame("details", track_ids, end)
+        features_df, _ = self.metadata_frame("features", track_ids, end)
+        dimensions = self.dimensions(track_ids, end)
+
+        return tracks_df, details_df, features_df, dimensions, observed_at
+
+    # Method to check and load the archived date range, returns the number of plays loaded
+    def run(self, loader, start=None, end=None):
+        tracks_df, details_df, features_df, dimensions, observed_at = self.extract(start, end)
+        if tracks_df.empty:
+            print("No archived plays in this date range.")
+            return 0
+
+        self.quality_checker.validate(details_df, 'track_details')
+        self.quality_checker.validate(features_df, 'track_features', allow_empty=True)
+        self.quality_checker.validate(tracks_df, 'recent_tracks', references={"track_details": details_df})
+        # Tracks whose artists or albums were never fetched have none, possibly all of them
+        self.quality_checker.validate(dimensions["artists"], 'artists', allow_empty=True)
+        self.quality_checker.validate(dimensions["albums"], 'albums', allow_empty=True)
+        self.quality_checker.validate(dimensions["track_artists"], 'track_artists', references={"artists": dimensions["artists"]}, allow_empty=True)
+        self.quality_checker.validate(dimensions["track_albums"], 'track_albums', references={"albums": dimensions["albums"]}, allow_empty=True)
+        loader.load(tracks_df, details_df, features_df, bulk=True, dimensions=dimensions, insert_only=True, observed_at=observed_at)
+        if self.aggregator is not None:
+            self.aggregator.update(tracks_df)
+
+        return len(tracks_df)
+
+# Helper to parse a command line date
+def parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+def main():
+    parser = argparse.ArgumentParser(description="Reload the Spotify tables from the raw response archive, offline.")
+    parser.add_argument("start", type=parse_date, help="first fetch date to replay, e.g. 2024-01-01")
+    parser.add_argument("end", type=parse_date, help="last fetch date to replay (inclusive), e.g. 2024-01-31")
+    args = parser.parse_args()
+
+    # The loader and the summaries are only imported when replaying from the command line
+    from sqlalchemy import create_engine
+    from spotify_load import SpotifyLoader
+    from spotify_aggregate import ListeningAggregator
+
+    # Loading environment variables
+    load_dotenv()
+
+    # Defining the connection to the database
+    engine = create_engine(os.getenv("POSTGRESQL_CONN"))
+    loader = SpotifyLoader(engine)
+    loader.create_tables()
+    aggregator = ListeningAggregator(engine)
+    aggregator.create_tables()
+
+    cache = TrackMetadataCache(os.getenv("SPOTIFY_CACHE_PATH", DEFAULT_CACHE_PATH), offline=True)
+    archive = RawArchive(os.getenv("SPOTIFY_ARCHIVE_PATH", DEFAULT_ARCHIVE_PATH))
+
+    started = time.perf_counter()
+    plays = ArchiveReplay(archive, cache, aggregator=aggregator).run(loader, args.start, args.end)
+    print(f"Replayed {plays} plays from the archive in {time.perf_counter() - started:.2f}s")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,272 @@
+import argparse
+import contextlib
+import glob
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from spotify_token import SpotifyTokenManager, SpotifyConfig, HttpClient, RateLimiter, AsyncTokenStore, EnvFileTokenStore
+from spotify_etl import SpotifyETL, DEFAULT_MAX_WORKERS, DEFAULT_USER_ID, RECENT_TRACKS_COLUMNS, played_at_ms
+from spotify_cache import TrackMetadataCache, DEFAULT_CACHE_PATH
+from spotify_state import ExtractionState, DEFAULT_STATE_PATH
+from spotify_archive import RawArchive, DEFAULT_ARCHIVE_PATH
+from spotify_metrics import metrics_from_env
+
+# Default length of a backfill partition
+DEFAULT_PARTITION_SIZE = timedelta(days=1)
+
+# Default number of partitions processed at the same time
+DEFAULT_PARTITION_WORKERS = 4
+
+# Helper to split the [start, end) range into consecutive partitions of at most `size`
+def partition_range(start, end, size=DEFAULT_PARTITION_SIZE):
+    partitions = []
+    while start < end:
+        partitions.append((start, min(start + size, end)))
+        start += size
+    return partitions
+
+# Helper to name a partition in the checkpoints and reports
+def partition_name(start, end):
+    return f"{start.isoformat()}/{end.isoformat()}"
+
+# Helper to list the JSON files of the given dump files and folders
+def dump_paths(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            files.extend(sorted(glob.glob(os.path.join(path, "**", "*.json"), recursive=True)))
+        else:
+            files.append(path)
+    return files
+
+# Helper to read the play items of a raw recently played dump: a JSON file holding either a
+# recently played response ({"items": [...]}) or a list of its items
+def read_dump_items(path):
+    with open(path) as f:
+        data = json.load(f)
+    return data["items"] if isinstance(data, dict) else data
+
+# Class to read the plays of a partition from the recently played endpoint
+class ApiPlaySource:
+    def __init__(self, etl):
+        self.etl = etl
+
+    # Method to extract the plays after `after` and before `before` (Unix timestamps in milliseconds)
+    def extract(self, after, before):
+        pages = list(self.etl.iter_recently_played_pages(after, before))
+        if not pages:
+            return pd.DataFrame(columns=RECENT_TRACKS_COLUMNS)
+        return pd.concat(pages, ignore_index=True)
+
+# Class to read the plays of a partition from archived raw JSON dumps, without touching the network
+# The dumps are parsed once; only the four play columns are kept in memory.
+class DumpPlaySource:
+    def __init__(self, paths, etl):
+        files = dump_paths(paths)
+        items = []
+        for path in files:
+            items.extend(read_dump_items(path))
+
+        # Dumps of consecutive runs overlap, keep each play once
+        self.plays = etl.parse_recently_played(items).drop_duplicates(subset=["user_id", "played_at"], ignore_index=True)
+        self.played_at = played_at_ms(self.plays["played_at"]).to_numpy()
+        print(f"Read {len(self.plays)} plays from {len(files)} dump file(s)")
+
+    # Method to extract the plays after `after` and before `before` (Unix timestamps in milliseconds)
+    def extract(self, after, before):
+        in_window = (self.played_at > after) & (self.played_at < before)
+        return self.plays[in_window].reset_index(drop=True)
+
+# Class to rebuild the tables over a date range, e.g. after an outage or a schema change
+# The range is split into partitions that are extracted, enriched and bulk loaded in parallel. Each
+# finished partition is checkpointed in the extraction state, so an interrupted backfill resumes with
+# the partitions it hadn't finished. Partitions ending after the run started may still get plays and
+# aren't checkpointed. The incremental cursor of the regular runs isn't moved.
+# With an `aggregator`, the listening summaries of the whole range are refreshed once all partitions
+# are loaded, rather than per partition: concurrent partitions could share a day.
+class SpotifyBackfill:
+    def __init__(self, etl, loader, state, source=None, partition_size=DEFAULT_PARTITION_SIZE,
+                 max_workers=DEFAULT_PARTITION_WORKERS, aggregator=None):
+        self.etl = etl
+        self.loader = loader
+        self.aggregator = aggregator
+        self.state = state
+        self.source = source or ApiPlaySource(etl)
+        self.partition_size = partition_size
+        self.max_workers = max_workers
+
+        # SQLite has a single writer, so there the partitions are loaded one at a time
+        self.load_lock = threading.Lock() if loader.engine.dialect.name == "sqlite" else contextlib.nullcontext()
+
+    # Key of this listener's checkpoints in ExtractionState
+    @property
+    def checkpoint_key(self):
+        if self.etl.user_id == DEFAULT_USER_ID:
+            return "backfill"
+        return f"backfill:{self.etl.user_id}"
+
+    # Method to extract, enrich and load one partition, returns its report (plays and stage timings)
+    def run_partition(self, start, end):
+        started = time.perf_counter()
+
+        # Spotify's "after" is exclusive, so start one millisecond early to keep plays at the boundary
+        after = int(start.timestamp() * 1000) - 1
+        before = int(end.timestamp() * 1000)
+        tracks_df = self.source.extract(after, before)
+        extracted = time.perf_counter()
+
+        details_df = features_df = dimensions = observed_at = None
+        if not tracks_df.empty:
+            details_df, features_df = self.etl.spotify_enrichment_etl(tracks_df)
+            dimensions = self.etl.spotify_dimensions_etl(tracks_df)
+            # Offline, every popularity comes from the cache and was observed when the cache fetched it
+            observed_at = self.etl.observed_times(details_df)
+            self.etl.data_quality(tracks_df, 'recent_tracks', references={"track_details": details_df})
+        enriched = time.perf_counter()
+
+        if not tracks_df.empty:
+            with self.load_lock:
+                self.loader.load(tracks_df, details_df, features_df, bulk=True, dimensions=dimensions, observed_at=observed_at)
+        loaded = time.perf_counter()
+
+        return {
+            "plays": len(tracks_df),
+            "extract": round(extracted - started, 3),
+            "enrich": round(enriched - extracted, 3),
+            "load": round(loaded - enriched, 3),
+            "seconds": round(loaded - started, 3),
+        }
+
+    # Method to backfill the [start, end) range, returns the reports of the partitions finished by this run
+    def run(self, start, end):
+        partitions = partition_range(start, end, self.partition_size)
+        finished = self.state.get_partitions(self.checkpoint_key)
+        pending = [(s, e) for s, e in partitions if partition_name(s, e) not in finished]
+
+        if len(pending) < len(partitions):
+            print(f"Resuming backfill: {len(partitions) - len(pending)} of {len(partitions)} partition(s) already finished.")
+
+        reports = {}
+        failed = []
+        started = time.perf_counter()
+        # Plays can still be added to a window that hadn't ended when the run started
+        run_started = datetime.now(timezone.utc)
+        closed = {partition_name(s, e) for s, e in pending if e <= run_started}
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.run_partition, s, e): partition_name(s, e) for s, e in pending}
+
+            for future in as_completed(futures):
+                name = futures[future]
+                try:
+                    report = future.result()
+                except Exception as e:
+                    # Not checkpointed, the next run retries it
+                    print(f"Partition {name} failed:", str(e))
+                    failed.append(name)
+                    continue
+
+                if name in closed:
+                    self.state.complete_partition(name, report, self.checkpoint_key)
+                reports[name] = report
+                print(f"Partition {name}: {report['plays']} plays in {report['seconds']:.2f}s "
+                      f"(extract {report['extract']:.2f}s, enrich {report['enrich']:.2f}s, load {report['load']:.2f}s)"
+                      + ("" if name in closed else ", not checkpointed as it ends after the run started"))
+
+        plays = sum(report["plays"] for report in reports.values())
+        print(f"Backfilled {plays} plays over {len(reports)} partition(s) in {time.perf_counter() - started:.2f}s"
+              + (f", {len(failed)} partition(s) failed" if failed else "") + ".")
+
+        if self.aggregator is not None and reports:
+            last_day = (end - timedelta(milliseconds=1)).astimezone(timezone.utc).date().isoformat()
+            self.aggregator.rebuild(self.etl.user_id, start.astimezone(timezone.utc).date().isoformat(), last_day)
+
+        return reports
+
+# Helper to parse a command line date or datetime, read as UTC when it has no timezone
+def parse_datetime(value):
+    moment = datetime.fromisoformat(value)
+    return moment if moment.tzinfo else moment.replace(tzinfo=timezone.utc)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Backfill the Spotify tables over a date range.")
+    parser.add_argument("start", type=parse_datetime, help="start of the range (inclusive), e.g. 2024-01-01")
+    parser.add_argument("end", type=parse_datetime, help="end of the range (exclusive), e.g. 2024-02-01")
+    parser.add_argument("--partition-hours", type=float, default=DEFAULT_PARTITION_SIZE.total_seconds() / 3600,
+                        help="length of each partition in hours")
+    parser.add_argument("--workers", type=int, default=DEFAULT_PARTITION_WORKERS, help="partitions processed in parallel")
+    parser.add_argument("--dump", nargs="+", help="raw recently played JSON dumps (files or folders) to backfill from "
+                                                  "offline; track metadata then only comes from the cache")
+    args = parser.parse_args(argv)
+
+    # Only the command line backfill writes to the database, SpotifyBackfill gets its loader from the caller
+    from sqlalchemy import create_engine
+    from spotify_load import SpotifyLoader
+    from spotify_aggregate import ListeningAggregator
+
+    # Loading environment variables
+    load_dotenv()
+
+    # Stage timings and request metrics of the backfill, only recorded when an exporter is configured
+    metrics = metrics_from_env()
+
+    # Defining the connection to the database
+    engine = create_engine(os.getenv("POSTGRESQL_CONN"))
+    loader = SpotifyLoader(engine, metrics=metrics)
+    loader.create_tables()
+    aggregator = ListeningAggregator(engine, metrics=metrics)
+    aggregator.create_tables()
+
+    config = SpotifyConfig(
+        os.getenv("SPOTIFY_CLIENT_ID"),
+        os.getenv("SPOTIFY_CLIENT_SECRET"),
+        os.getenv("SPOTIFY_REFRESH_TOKEN"),
+        os.getenv("SPOTIFY_ACCESS_TOKEN"),
+        os.getenv("SPOTIFY_TOKEN_EXPIRATION"),
+        "https://accounts.spotify.com/api/token",
+        token_store=AsyncTokenStore(EnvFileTokenStore())
+    )
+    http_client = HttpClient(pool_size=DEFAULT_MAX_WORKERS, rate_limiter=RateLimiter(), metrics=metrics)
+
+    # Responses fetched from the API are archived like in the regular runs
+    archive = None
+    if not args.dump:
+        archive = RawArchive(os.getenv("SPOTIFY_ARCHIVE_PATH", DEFAULT_ARCHIVE_PATH), os.getenv("SPOTIFY_ARCHIVE_FORMAT", "jsonl"))
+
+    etl = SpotifyETL(
+        SpotifyTokenManager(config, http_client),
+        recent_tracks_url="https://api.spotify.com/v1/me/player/recently-played",
+        tracks_details_url="https://api.spotify.com/v1/tracks",
+        tracks_features_url="https://api.spotify.com/v1/audio-features",
+        http_client=http_client,
+        cache=TrackMetadataCache(os.getenv("SPOTIFY_CACHE_PATH", DEFAULT_CACHE_PATH), offline=bool(args.dump)),
+        archive=archive,
+        metrics=metrics
+    )
+
+    backfill = SpotifyBackfill(
+        etl,
+        loader,
+        ExtractionState(os.getenv("SPOTIFY_STATE_PATH", DEFAULT_STATE_PATH)),
+        source=DumpPlaySource(args.dump, etl) if args.dump else None,
+        partition_size=timedelta(hours=args.partition_hours),
+        max_workers=args.workers,
+        aggregator=aggregator
+    )
+    try:
+        backfill.run(args.start, args.end)
+    finally:
+        if archive is not None:
+            archive.close()
+        config.token_store.flush()
+        metrics.export()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+import json
+import sqlite3
+import threading
+import time
+
+# Default location of the cache database
+DEFAULT_CACHE_PATH = "spotify_cache.db"
+
+# Default maximum number of cached rows (details and features together) before LRU eviction
+DEFAULT_MAX_ENTRIES = 100_000
+
+# Default time, in seconds, a write waits for another process holding the cache file's lock
+DEFAULT_CACHE_TIMEOUT = 30.0
+
+# Default time-to-live, in seconds, of the fields that change over time. Fields without a TTL never expire.
+DEFAULT_FIELD_TTLS = {
+    "details": {"popularity": 24 * 60 * 60},
+    "features": {},
+    "links": {},
+    "artists": {"popularity": 24 * 60 * 60, "followers": 24 * 60 * 60},
+    "albums": {"popularity": 24 * 60 * 60},
+}
+
+# Class to cache track details and audio features rows in a local SQLite database
+# A cached row is fresh while all of its fields are: the row expires with its shortest field TTL,
+# so a volatile field like popularity forces a refetch while static features are kept forever.
+# Artist and album rows (see SpotifyETL.extract_dimensions) are cached the same way, under their own
+# kinds and keyed by their Spotify ID.
+# Several processes can share the file (e.g. the parallel tasks of the DAG): it is in WAL mode, so reads
+# don't wait for writes, and a write waits up to `timeout` seconds for another one to finish.
+class TrackMetadataCache:
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_entries=DEFAULT_MAX_ENTRIES, field_ttls=None, offline=False,
+                 timeout=DEFAULT_CACHE_TIMEOUT):
+        self.path = path
+        self.max_entries = max_entries
+        self.field_ttls = DEFAULT_FIELD_TTLS if field_ttls is None else field_ttls
+        # In offline mode expired rows are still served and nothing should be fetched from the API
+        self.offline = offline
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(path, timeout=timeout, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS track_metadata(
+            kind TEXT NOT NULL,
+            track_id TEXT NOT NULL,
+            data TEXT NOT NULL,
+            fetched_at REAL NOT NULL,
+            last_used REAL NOT NULL,
+            PRIMARY KEY (kind, track_id)
+        )
+        """)
+        self.connection.execute("CREATE INDEX IF NOT EXISTS track_metadata_last_used ON track_metadata(last_used)")
+        self.connection.commit()
+
+    # Method to compute how long a row of the given kind stays fresh (None means forever)
+    def row_ttl(self, kind, row):
+        ttls = [ttl for field, ttl in self.field_ttls.get(kind, {}).items() if field in row]
+        return min(ttls) if ttls else None
+
+    # Method to get the cached rows for the given track IDs, as a {track_id: row} dictionary
+    def get_many(self, kind, track_ids):
+        track_ids = list(track_ids)
+        now = time.time()
+        found = {}
+
+        with self._lock:
+            # SQLite limits the number of bound parameters, so look IDs up in chunks
+            for start in range(0, len(track_ids), 500):
+                chunk = track_ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT track_id, data, fetched_at FROM track_metadata WHERE kind = ? AND track_id IN ({placeholders})",
+                    [kind, *chunk]
+                ).fetchall()
+
+                for track_id, data, fetched_at in rows:
+                    row = json.loads(data)
+                    ttl = self.row_ttl(kind, row)
+                    if ttl is not None and now - fetched_at > ttl and not self.offline:
+                        self.expired += 1
+                        continue
+                    found[track_id] = row
+
+            # Mark the rows served as recently used
+            self.connection.executemany(
+                "UPDATE track_metadata SET last_used = ? WHERE kind = ? AND track_id = ?",
+                [(now, kind, track_id) for track_id in found]
+            )
+            self.connection.commit()
+
+            self.hits += len(found)
+            self.misses += len(track_ids) - len(found)
+
+        return found
+
+    # Method to get when the cached rows of the given IDs were fetched, as a {track_id: Unix time} dictionary
+    # Expired rows are included, their fetch time is still known; the rows aren't marked as used
+    def fetched_times(self, kind, track_ids):
+        track_ids = list(track_ids)
+        times = {}
+
+        with self._lock:
+            for start in range(0, len(track_ids), 500):
+                chunk = track_ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                times.update(self.connection.execute(
+                    f"SELECT track_id, fetched_at FROM track_metadata WHERE kind = ? AND track_id IN ({placeholders})",
+                    [kind, *chunk]
+                ).fetchall())
+
+        return times
+
+    # Method to store freshly fetched rows, evicting the least recently used rows above max_entries
+    def put_many(self, kind, rows, key="track_id"):
+        self.put_serialized(kind, [row[key] for row in rows], [json.dumps(row) for row in rows])
+
+    # Method to store freshly fetched rows given as a DataFrame, serialized without going through row dictionaries
+    def put_frame(self, kind, df, key="track_id"):
+        if df.empty:
+            return
+        self.put_serialized(kind, df[key].tolist(), df.to_json(orient="records", lines=True).splitlines())
+
+    # Method to store rows already serialized to JSON, evicting the least recently used rows above max_entries
+    def put_serialized(self, kind, track_ids, data):
+        now = time.time()
+
+        with self._lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO track_metadata(kind, track_id, data, fetched_at, last_used) VALUES (?, ?, ?, ?, ?)",
+                [(kind, track_id, row_data, now, now) for track_id, row_data in zip(track_ids, data)]
+            )
+            self.connection.execute(
+                """
+                DELETE FROM track_metadata WHERE rowid IN (
+                    SELECT rowid FROM track_metadata ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (self.max_entries,)
+            )
+            self.connection.commit()
+
+    # Method to get the hit/miss counters
+    def stats(self):
+        with self._lock:
+            size = self.connection.execute("SELECT COUNT(*) FROM track_metadata").fetchone()[0]
+        return {"hits": self.hits, "misses": self.misses, "expired": self.expired, "size": size}
+
+    def close(self):
+        self.connection.close()
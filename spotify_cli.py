@@ -0,0 +1,132 @@
+# Command line entry point of the ETL: python spotify_cli.py <command> [options]
+#
+#   extract    extract the tracks played since the last load into the run's staging folder
+#   enrich     extract the details, audio features and artists/albums of the staged tracks
+#   load       create the tables if needed, then load the staged run
+#   run        every stage of a run, in order
+#   backfill   rebuild the tables over a date range, see spotify_backfill.py
+#   bench      run one of the benchmarks
+#
+# Only the standard library is imported at start up. The stages (spotify_stages.py) import pandas, SQLAlchemy
+# and the Spotify client when they run, so `--help`, `--dry-run` and mistyped options answer right away.
+import argparse
+import os
+import sys
+
+from spotify_stages import STAGES, register_stage, run_stage
+
+# Run ID of the commands, so `extract`, `enrich` and `load` run one after the other find each other's staging files
+DEFAULT_RUN_ID = "cli"
+
+# Stages run by each command, in order (None runs every registered stage)
+COMMAND_STAGES = {
+    "extract": ["extract"],
+    "enrich": ["details", "features", "dimensions"],
+    "load": ["create_tables", "load"],
+    "run": None,
+}
+
+# Folder of the benchmark scripts run by `bench`
+BENCHMARKS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks")
+
+# Helper to parse a --stage option, NAME=module:function
+def stage_option(value):
+    name, _, target = value.partition("=")
+    if not name or ":" not in target:
+        raise argparse.ArgumentTypeError(f"expected NAME=module:function, got {value!r}")
+    return name, target
+
+# Helper to list the benchmarks, by the name `bench` takes (bench_pipeline.py is "pipeline")
+def benchmark_names():
+    return sorted(name[len("bench_"):-len(".py")] for name in os.listdir(BENCHMARKS_PATH)
+                  if name.startswith("bench_") and name.endswith(".py"))
+
+# Helper to create the engine of the stages writing to the database, from POSTGRESQL_CONN
+def database_engine():
+    from dotenv import load_dotenv
+    from sqlalchemy import create_engine
+
+    load_dotenv()
+    return create_engine(os.getenv("POSTGRESQL_CONN"))
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="spotify_cli.py", description="Run the Spotify ETL, a stage at a time or whole.")
+    commands = parser.add_subparsers(dest="command", required=True, metavar="command")
+
+    helps = {
+        "extract": "extract the tracks played since the last load",
+        "enrich": "extract the details, audio features, artists and albums of the extracted tracks",
+        "load": "load the extracted run into the database",
+        "run": "run every stage: extract, enrich and load",
+    }
+    for command, summary in helps.items():
+        stages = commands.add_parser(command, help=summary, description=f"{summary[0].upper()}{summary[1:]}.")
+        stages.add_argument("--run-id", default=DEFAULT_RUN_ID, help=f"ID of the run, naming its staging folder (default: {DEFAULT_RUN_ID})")
+        stages.add_argument("--skip", action="append", default=[], metavar="STAGE", help="don't run this stage (repeatable)")
+        stages.add_argument("--stage", action="append", default=[], type=stage_option, metavar="NAME=module:function",
+                            help="run this function as the stage, or as an extra stage after the others (repeatable)")
+        stages.add_argument("--dry-run", action="store_true", help="print the stages and their functions without running them")
+
+    # Their options are handed over untouched to spotify_backfill.py and the benchmark
+    commands.add_parser("backfill", add_help=False, help="rebuild the tables over a date range (see backfill --help)")
+    commands.add_parser("bench", add_help=False, help=f"run a benchmark: {', '.join(benchmark_names())}")
+
+    return parser
+
+# Helper to run the stages of a command
+def run_stages(command, args):
+    names = list(COMMAND_STAGES[command] or STAGES)
+    for name, target in args.stage:
+        if name not in STAGES:
+            names.append(name)
+        register_stage(name, target)
+
+    unknown = set(args.skip) - set(STAGES)
+    if unknown:
+        raise SystemExit(f"Unknown stage(s): {', '.join(sorted(unknown))}. Stages: {', '.join(STAGES)}")
+    names = [name for name in names if name not in args.skip]
+
+    if args.dry_run:
+        for name in names:
+            print(f"{name}: {STAGES[name]['target']}({', '.join(STAGES[name]['args'])})")
+        return
+
+    # The database is only connected to when one of the stages writes to it
+    engine = database_engine() if any("engine" in STAGES[name]["args"] for name in names) else None
+    for name in names:
+        print(f"Stage {name} (run {args.run_id})")
+        run_stage(name, args.run_id, engine)
+
+# Helper to run a benchmark script as if it was started on its own
+def run_benchmark(argv):
+    if not argv or argv[0].startswith("-"):
+        print(f"usage: spotify_cli.py bench NAME [options]\nbenchmarks: {', '.join(benchmark_names())}")
+        return
+    if argv[0] not in benchmark_names():
+        raise SystemExit(f"Unknown benchmark {argv[0]!r}. Benchmarks: {', '.join(benchmark_names())}")
+
+    import runpy
+
+    # Like a script started on its own, the benchmark imports its helpers (fake_data, mock_spotify) from its folder
+    path = os.path.join(BENCHMARKS_PATH, f"bench_{argv[0]}.py")
+    sys.argv = [path, *argv[1:]]
+    sys.path.insert(0, BENCHMARKS_PATH)
+    runpy.run_path(path, run_name="__main__")
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    parser = build_parser()
+    args, extra = parser.parse_known_args(argv)
+
+    if args.command == "backfill":
+        from spotify_backfill import main as backfill_main
+        backfill_main(argv[1:])
+    elif args.command == "bench":
+        run_benchmark(argv[1:])
+    elif extra:
+        parser.error(f"unrecognized arguments: {' '.join(extra)}")
+    else:
+        run_stages(args.command, args)
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,12 @@
 import datetime as dt
 import os
-import pandas as pd
-from sqlalchemy import create_engine
-from dotenv import load_dotenv
 
 from airflow import DAG
 from airflow.operators.python_operator import PythonOperator
 from airflow.hooks.base_hook import BaseHook
-from airflow.providers.postgres.operators.postgres import PostgresOperator
 
-from spotify_token import SpotifyTokenManager, SpotifyConfig, HttpClient
-from spotify_etl import SpotifyETL
+# The stages (spotify_tasks.py) are imported when a task runs, so parsing this file doesn't import pandas or SQLAlchemy
+from spotify_stages import run_stage
 
 default_args = {
     'owner': 'airflow',
@@ -30,117 +26,73 @@ dag = DAG(
     schedule_interval=dt.timedelta(minutes=60),
 )
 
-def ETL():
-    # Loading environment variables
-    load_dotenv()
-    
-    # Defining the connection to the database
+# Helper to create the database engine from the Airflow connection
+# SPOTIFY_DB_URL replaces the connection, e.g. with a SQLite file to run dag.test() offline
+def spotify_engine():
+    from sqlalchemy import create_engine
+
+    if os.getenv("SPOTIFY_DB_URL"):
+        return create_engine(os.getenv("SPOTIFY_DB_URL"))
+
     conn = BaseHook.get_connection('elephant_sql')
-    engine = create_engine(f'postgresql://{conn.login}:{conn.password}@{conn.host}/{conn.schema}')
-    
-    # Running the ETL functions
-    print("Started")
-
-    # Create a SpotifyConfig object with configuration values from environment variables
-    config = SpotifyConfig(
-        os.getenv("SPOTIFY_CLIENT_ID"),
-        os.getenv("SPOTIFY_CLIENT_SECRET"),
-        os.getenv("SPOTIFY_REFRESH_TOKEN"),
-        os.getenv("SPOTIFY_ACCESS_TOKEN"),
-        os.getenv("SPOTIFY_TOKEN_EXPIRATION"),
-        "https://accounts.spotify.com/api/token"
+    return create_engine(f'postgresql://{conn.login}:{conn.password}@{conn.host}/{conn.schema}')
+
+def create_tables():
+    run_stage("create_tables", engine=spotify_engine())
+
+def load(run_id):
+    run_stage("load", run_id, spotify_engine())
+
+# The tasks hand their DataFrames over through files in a per-run staging folder (see spotify_tasks.py),
+# only the run_id template reaches them, nothing is pushed to XCom
+with dag:
+    # Task to create the tables, in one transaction and only if they don't exist
+    create_tables_op = PythonOperator(
+        task_id='create_tables',
+        python_callable=create_tables,
+    )
+
+    # Task to extract the tracks played since the last successful load
+    extract_tracks_op = PythonOperator(
+        task_id='extract_recent_tracks',
+        python_callable=run_stage,
+        op_kwargs={'name': 'extract', 'run_id': '{{ run_id }}'},
     )
 
-    # Create a SpotifyTokenManager object with the configuration and HTTP client
-    token_manager = SpotifyTokenManager(config, HttpClient())
-
-    # Create a SpotifyETL object with token manager and endpoints
-    etl = SpotifyETL(
-        token_manager,
-        recent_tracks_url="https://api.spotify.com/v1/me/player/recently-played", 
-        tracks_details_url="https://api.spotify.com/v1/tracks", 
-        tracks_features_url="https://api.spotify.com/v1/audio-features"
-        )
-
-    # Extracting the tracks
-    tracks_df = etl.spotify_tracks_etl()
-    tracks_df.to_sql('recent_tracks', engine, if_exists='replace')
-
-    # Extracting the details and features
-    if tracks_df is not None:
-        details_df = etl.spotify_details_etl(tracks_df)
-        details_df.to_sql('track_details', engine, if_exists='replace')
-
-        features_df = etl.spotify_features_etl(tracks_df)
-        features_df.to_sql('track_features', engine, if_exists='replace')
-
-    # Print the final message
-    print("Database updated successfully!")
-
-with dag:    
-    # Task to create recent_tracks table on PostgreSQL database
-    create_tracks_table= PostgresOperator(
-        task_id='create_tracks_table',
-        postgres_conn_id='elephant_sql',
-        sql="""
-            CREATE TABLE IF NOT EXISTS recent_tracks(
-            track_id VARCHAR(200) PRIMARY KEY,
-            played_at VARCHAR(200),
-            timestamp VARCHAR(200),
-            FOREIGN KEY (track_id) REFERENCES recent_tracks(track_id)
-        )
-        """
+    # Tasks to extract the track details and audio features, in parallel
+    extract_details_op = PythonOperator(
+        task_id='extract_track_details',
+        python_callable=run_stage,
+        op_kwargs={'name': 'details', 'run_id': '{{ run_id }}'},
     )
 
-    # Task to create track_details table on PostgreSQL database
-    create_details_table= PostgresOperator(
-        task_id='create_details_table',
-        postgres_conn_id='elephant_sql',
-        sql="""
-            CREATE TABLE IF NOT EXISTS track_details(
-            track_id VARCHAR(200) PRIMARY KEY,
-            track_name VARCHAR(200),
-            artist_name VARCHAR(200),
-            album_name VARCHAR(200),
-            release_date VARCHAR(200),
-            length INTEGER,
-            popularity INTEGER,
-            explicit BOOLEAN,
-            type VARCHAR(50)
-        )
-        """
+    extract_features_op = PythonOperator(
+        task_id='extract_track_features',
+        python_callable=run_stage,
+        op_kwargs={'name': 'features', 'run_id': '{{ run_id }}'},
     )
 
-    # Task to create track_features table on PostgreSQL database
-    create_features_table= PostgresOperator(
-        task_id='create_features_table',
-        postgres_conn_id='elephant_sql',
-        sql="""
-            CREATE TABLE IF NOT EXISTS track_features(
-            track_id VARCHAR(200) PRIMARY KEY,
-            danceability FLOAT,
-            duration_ms INTEGER,
-            energy FLOAT,
-            acousticness FLOAT,
-            instrumentalness FLOAT,
-            key INTEGER,
-            liveness FLOAT,
-            loudness FLOAT,
-            mode INTEGER,
-            speechiness FLOAT,
-            tempo FLOAT,
-            time_signature INTEGER,
-            valence FLOAT
-        )
-        """
+    # Task to extract the artists and albums of the tracks, once their details are fetched
+    extract_dimensions_op = PythonOperator(
+        task_id='extract_dimensions',
+        python_callable=run_stage,
+        op_kwargs={'name': 'dimensions', 'run_id': '{{ run_id }}'},
     )
 
-    # Task to run Python ETL
-    run_etl = PythonOperator(
-        task_id='spotify_etl',
-        python_callable=ETL,
-        dag=dag,
+    # Task to load the tables, refresh the listening summaries and move the extraction cursor
+    load_op = PythonOperator(
+        task_id='load',
+        python_callable=load,
+        op_kwargs={'run_id': '{{ run_id }}'},
     )
 
     # Task execution order
-    create_tracks_table >> create_details_table >> create_features_table >> run_etl
\ No newline at end of file
+    create_tables_op >> extract_tracks_op >> [extract_details_op, extract_features_op]
+    extract_details_op >> extract_dimensions_op
+    [extract_features_op, extract_dimensions_op] >> load_op
+
+# Run the whole DAG once in-process, e.g. offline against the mock API (python benchmarks/mock_spotify.py) and a SQLite file:
+# SPOTIFY_API_URL=http://127.0.0.1:8000/v1 SPOTIFY_TOKEN_URL=http://127.0.0.1:8000/api/token \
+# SPOTIFY_DB_URL=sqlite:///spotify.db python spotify_dag.py
+if __name__ == "__main__":
+    dag.test()
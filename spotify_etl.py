@@ -1,20 +1,123 @@
 # Import necessary libraries
 from urllib.parse import parse_qs, urlparse
+from concurrent.futures import ThreadPoolExecutor
+import threading
 import pandas as pd
 from datetime import datetime, timedelta
-from sqlalchemy import create_engine
 import os
 from dotenv import load_dotenv
-from spotify_token import SpotifyTokenManager, SpotifyConfig, HttpClient
+from spotify_token import SpotifyTokenManager, SpotifyConfig, HttpClient, RateLimiter, AuthorizedHttpClient, AsyncTokenStore, EnvFileTokenStore
+from spotify_cache import TrackMetadataCache, DEFAULT_CACHE_PATH
+from spotify_quality import DataQualityChecker
+from spotify_state import ExtractionState, DEFAULT_STATE_PATH
+from spotify_archive import RawArchive, DEFAULT_ARCHIVE_PATH
+from spotify_metrics import NULL_METRICS, metrics_from_env, timed_stage
+from spotify_parse import (loads, typed_frame, concat_columns, parse_recently_played_items, parse_tracks, parse_audio_features,
+                           parse_track_links, link_frames, parse_artists, parse_albums, fetch_times)
+from spotify_schema import TRACK_DETAILS_DTYPES, TRACK_FEATURES_DTYPES, ARTISTS_DTYPES, ALBUMS_DTYPES
+
+# Maximum number of IDs accepted by Spotify's multi-ID /v1/tracks endpoint
+TRACKS_BATCH_SIZE = 50
+
+# Maximum number of IDs accepted by Spotify's multi-ID /v1/audio-features endpoint
+AUDIO_FEATURES_BATCH_SIZE = 100
+
+# Maximum number of IDs accepted by Spotify's multi-ID /v1/artists and /v1/albums endpoints
+ARTISTS_BATCH_SIZE = 50
+ALBUMS_BATCH_SIZE = 20
+
+# Default number of concurrent requests used when enriching tracks with details and features
+DEFAULT_MAX_WORKERS = 8
+
+# Maximum number of items per page accepted by Spotify's recently played endpoint
+RECENTLY_PLAYED_PAGE_SIZE = 50
+
+# Column order of the recently played tracks DataFrame
+RECENT_TRACKS_COLUMNS = ["track_id", "played_at", "timestamp", "user_id"]
+
+# Listener the plays are attributed to when a single account is extracted
+DEFAULT_USER_ID = "default"
+
+# Column order of the track details DataFrame
+TRACK_DETAILS_COLUMNS = [
+    "track_id",
+    "track_name",
+    "artist_name",
+    # "artist_genres",
+    "album_name",
+    "release_date",
+    "length",
+    "popularity",
+    "explicit",
+    "type"
+]
+
+# Column order of the track features DataFrame
+TRACK_FEATURES_COLUMNS = [
+    "track_id",
+    "danceability",
+    "duration_ms",
+    "energy",
+    "acousticness",
+    "instrumentalness",
+    "key",
+    "liveness",
+    "loudness",
+    "mode",
+    "speechiness",
+    "tempo",
+    "time_signature",
+    "valence"
+]
+
+# Helper to split a sequence of IDs into lists of at most `size` items
+def chunked(ids, size):
+    ids = list(ids)
+    for start in range(0, len(ids), size):
+        yield ids[start:start + size]
+
+# Helper to convert played_at strings into Unix timestamps in milliseconds
+def played_at_ms(played_at):
+    return pd.to_datetime(played_at, utc=True, format="ISO8601").dt.as_unit("ms").astype("int64")
+
+# Helper to get the key of a listener's extraction cursor in ExtractionState
+def cursor_key(user_id):
+    if user_id == DEFAULT_USER_ID:
+        return "recently_played"
+    return f"recently_played:{user_id}"
 
 # Class for ETL (Extract, Transform, Load) operations on Spotify data
 class SpotifyETL:
-    def __init__(self, token_manager, recent_tracks_url, tracks_details_url, tracks_features_url):
+    def __init__(self, token_manager, recent_tracks_url, tracks_details_url, tracks_features_url, max_workers=DEFAULT_MAX_WORKERS, http_client=None, cache=None, quality_checker=None, user_id=DEFAULT_USER_ID, account_limiter=None, archive=None, metrics=None, artists_url=None, albums_url=None):
         self.token_manager = token_manager
-        self.http_client = HttpClient()
+        self.user_id = user_id
+        # Optional RunMetrics timing the stages of the run, see spotify_metrics.py
+        self.metrics = metrics or NULL_METRICS
+        # Size the connection pool so every enrichment worker can keep its own connection alive
+        self.http_client = http_client or HttpClient(pool_size=max_workers, metrics=self.metrics)
+        # API requests always carry the current token and are replayed once after a 401
+        self.api_client = AuthorizedHttpClient(self.http_client, token_manager, account_limiter)
         self.recent_tracks_url = recent_tracks_url
         self.tracks_details_url = tracks_details_url
         self.tracks_features_url = tracks_features_url
+        # The artists and albums endpoints default to the siblings of the tracks endpoint
+        api_url = tracks_details_url.rsplit("/", 1)[0] if tracks_details_url else None
+        self.artists_url = artists_url or (api_url and f"{api_url}/artists")
+        self.albums_url = albums_url or (api_url and f"{api_url}/albums")
+        self.max_workers = max_workers
+        self.cache = cache
+        # Optional RawArchive keeping the raw API responses, see spotify_archive.py
+        self.archive = archive
+        self.quality_checker = quality_checker or DataQualityChecker()
+        # Album and artist IDs of the tracks fetched by the details requests, for the dimensions stage
+        self.track_links = {}
+        self.unsaved_links = []
+        self._links_lock = threading.Lock()
+
+    # Key of this listener's extraction cursor in ExtractionState
+    @property
+    def cursor_key(self):
+        return cursor_key(self.user_id)
 
     # Method to retrieve Spotify API headers with a valid access token
     def get_spotify_headers(self):
@@ -32,21 +135,157 @@ class SpotifyETL:
 
         return headers
 
-    # Method to extract recently played tracks
-    def extract_recently_played_tracks(self):
+    # Method to keep a raw API response in the archive, if there is one
+    def archive_response(self, endpoint, url, data):
+        if self.archive is not None:
+            self.archive.write(endpoint, url, data, self.user_id)
+
+    # Method to turn one page of recently played items from the Spotify API into a small DataFrame
+    def parse_recently_played(self, items):
+        return parse_recently_played_items(items, self.user_id)
+
+    # Generator yielding the recently played tracks one page at a time, as small DataFrames
+    # Each raw page is dropped as soon as it is parsed, so memory stays flat whatever the number of pages.
+    # `after` is a Unix timestamp in milliseconds (e.g. the cursor stored by ExtractionState),
+    # without it the last 24 hours are extracted. With `before` (also in milliseconds) the extraction
+    # stops at the first play at or after it. Raises an exception if a page can't be fetched.
+    def iter_recently_played_pages(self, after=None, before=None):
         headers = self.get_spotify_headers()
-        
-        today = datetime.now()
-        yesterday = today - timedelta(days=1)
-        yesterday_unix_timestamp = int(yesterday.timestamp()) * 1000
 
-        # Initialize an empty list to store all tracks
-        all_tracks = []
+        if after is None:
+            today = datetime.now()
+            yesterday = today - timedelta(days=1)
+            after = int(yesterday.timestamp()) * 1000
 
         while True:
-            # Download tracks for the current page
-            url = f"{self.recent_tracks_url}?after={yesterday_unix_timestamp}"
-            r = self.http_client.get(url, headers=headers)
+            # Time the request and parsing of the page, not the consumer of the yielded DataFrame
+            with self.metrics.stage("extract"):
+                # Download tracks for the current page
+                url = f"{self.recent_tracks_url}?limit={RECENTLY_PLAYED_PAGE_SIZE}&after={after}"
+                r = self.api_client.get(url, headers=headers)
+
+                if r.status_code != 200:
+                    raise Exception(f"Failed to fetch data from Spotify API. Status code: {r.status_code}")
+
+                try:
+                    data = loads(r.content)
+                    self.archive_response("recently-played", url, data)
+                    tracks = data["items"]
+
+                    # If there are no more tracks, stop
+                    if not tracks:
+                        return
+
+                    page_df = self.parse_recently_played(tracks)
+
+                    # Get the URL for the next page, if available
+                    next_page_url = data.get("next")
+
+                    # Drop the plays past the end of the requested window and stop there
+                    if before is not None:
+                        in_window = played_at_ms(page_df["played_at"]) < before
+                        if not in_window.all():
+                            page_df = page_df[in_window.to_numpy()].reset_index(drop=True)
+                            next_page_url = None
+
+                    # Parse the "after" parameter from the next page URL to use in the next request
+                    if next_page_url:
+                        next_page_params = parse_qs(urlparse(next_page_url).query)
+                        after = next_page_params.get("after", [])[0]
+
+                except Exception as e:
+                    raise Exception(f"Error while processing Spotify API response: {e}") from e
+
+            if not page_df.empty:
+                self.metrics.count("extract", "rows", len(page_df))
+                yield page_df
+
+            # If there's no next page, stop
+            if not next_page_url:
+                return
+
+    # Method to extract recently played tracks into a single DataFrame
+    def extract_recently_played_tracks(self, after=None):
+        try:
+            pages = list(self.iter_recently_played_pages(after))
+        except Exception as e:
+            print(str(e))
+            return None  # Return None to indicate an error.
+
+        if pages:
+            track_df = pd.concat(pages, ignore_index=True)
+        else:
+            track_df = pd.DataFrame(columns=RECENT_TRACKS_COLUMNS)
+
+        print("1/3: Recently Played Tracks Data Extraction Successful!")
+
+        return track_df
+
+    # Method to get when the details of the tracks were fetched from the API, as UTC times indexed by track ID
+    # Details served by the cache were fetched by an earlier run, whose popularity the load mustn't record as
+    # a change seen now (see SpotifyLoader.load). Returns None without a cache: every row was fetched now.
+    def observed_times(self, details_df):
+        if self.cache is None:
+            return None
+        return fetch_times(self.cache.fetched_times("details", details_df["track_id"]))
+
+    # Method to split track IDs into the rows already in the metadata cache and the IDs to fetch from the API
+    def lookup_cached(self, kind, track_ids):
+        if self.cache is None:
+            return {}, list(track_ids)
+
+        cached = self.cache.get_many(kind, track_ids)
+        to_fetch = [track_id for track_id in track_ids if track_id not in cached]
+        self.metrics.count(kind, "cache_hits", len(cached))
+        self.metrics.count(kind, "cache_misses", len(to_fetch))
+
+        # With an offline cache nothing reaches the API, uncached tracks are just left out
+        if self.cache.offline:
+            if to_fetch:
+                print(f"{len(to_fetch)} track(s) without cached {kind} skipped (offline cache).")
+            to_fetch = []
+
+        return cached, to_fetch
+
+    # Method to store freshly fetched rows in the metadata cache and merge them with the cached ones
+    # `key` is the ID column of the rows, track_id for details and features
+    def merge_cached(self, kind, track_ids, cached, fetched_df, key="track_id"):
+        if self.cache is None:
+            return fetched_df
+
+        self.cache.put_frame(kind, fetched_df, key)
+        if not cached:
+            return fetched_df
+
+        # Keep the rows in track_ids order whether they came from the cache or the API
+        merged_df = pd.concat([pd.DataFrame(list(cached.values())), fetched_df], ignore_index=True)
+        position = {track_id: i for i, track_id in enumerate(track_ids)}
+        return merged_df.sort_values(key, key=lambda ids: ids.map(position), ignore_index=True)
+
+    # Method to turn a track object from the Spotify API into a track details row
+    def parse_track_details(self, track_id, track_data):
+        return {
+            "track_id": track_id,
+            "track_name": track_data["name"],
+            "artist_name": track_data["artists"][0]["name"], #This is the first artist in the list
+            # "artist_genres": ", ".join(track_data["artists"][0]["genres"]),
+            "album_name": track_data["album"]["name"],
+            "release_date": track_data["album"]["release_date"],
+            "length": track_data["duration_ms"],
+            "popularity": track_data["popularity"],
+            "explicit": track_data["explicit"],
+            "type": track_data["type"]
+        }
+
+    # Method to fetch track details one request per track
+    def fetch_track_details(self, track_ids, headers):
+        # Initialize a list to store track details
+        track_details_list = []
+
+        for track_id in track_ids:
+            # Send a request to the Spotify API to get track details for the current track_id
+            url = f"{self.tracks_details_url}/{track_id}"
+            r = self.api_client.get(url, headers=headers)
 
             if r.status_code != 200:
                 print("Failed to fetch data from Spotify API. Status code:", r.status_code)
@@ -54,194 +293,425 @@ class SpotifyETL:
 
             try:
                 data = r.json()
-                tracks = data["items"]
+                self.archive_response("tracks", url, data)
+                track_details_list.append(self.parse_track_details(track_id, data))
+                self.keep_track_links(parse_track_links([track_id], [data]))
 
-                # If there are no more tracks, break out of the loop
-                if not tracks:
-                    break
+            except Exception as e:
+                print("Error while processing Spotify API response:", str(e))
+                return None  # Return None to indicate an error.
 
-                # Append tracks to the all_tracks list
-                all_tracks.extend(tracks)
+        return pd.DataFrame(track_details_list, columns=TRACK_DETAILS_COLUMNS)
 
-                # Get the URL for the next page, if available
-                next_page_url = data.get("next")
+    # Method to fetch the details of one batch of tracks through the multi-ID endpoint (?ids=a,b,c)
+    # Returns the parsed column arrays and the IDs Spotify didn't return, or None if the request failed
+    def fetch_track_details_batch(self, batch, headers):
+        # Send a single request to the Spotify API for the whole batch
+        url = f"{self.tracks_details_url}?ids={','.join(batch)}"
+        r = self.api_client.get(url, headers=headers)
 
-                # If there's no next page, break out of the loop
-                if not next_page_url:
-                    break
+        if r.status_code != 200:
+            print("Failed to fetch data from Spotify API. Status code:", r.status_code)
+            return None  # Return None to indicate an error.
 
-                # Parse the "after" parameter from the next page URL to use in the next request
-                next_page_params = parse_qs(urlparse(next_page_url).query)
-                after_timestamp = next_page_params.get("after", [])[0]
+        try:
+            data = loads(r.content)
+            self.archive_response("tracks", url, data)
 
-                # Update the timestamp for the next page request
-                yesterday_unix_timestamp = after_timestamp
+            # Spotify answers in request order and uses null for unknown IDs
+            result = parse_tracks(batch, data["tracks"])
+            self.keep_track_links(parse_track_links(batch, data["tracks"]))
+            return result
 
-            except Exception as e:
-                print("Error while processing Spotify API response:", str(e))
-                return None  # Return None to indicate an error.
+        except Exception as e:
+            print("Error while processing Spotify API response:", str(e))
+            return None  # Return None to indicate an error.
 
-        # Extract relevant data from all_tracks
-        tracks_ids = []
-        played_at_list = []
-        timestamps = []
-
-        for track in all_tracks:
-            tracks_ids.append(track["track"]["id"])
-            played_at_list.append(track["played_at"])
-            timestamps.append(track["played_at"][0:10])
-
-        # Prepare a dictionary in order to turn it into a pandas dataframe below
-        track_dict = {
-            "track_id": tracks_ids,
-            "played_at": played_at_list,
-            "timestamp": timestamps
-        }
-        track_df = pd.DataFrame(track_dict, columns=["track_id", "played_at", "timestamp"])
+    # Method to fetch track details in batches through the multi-ID endpoint
+    def fetch_track_details_batched(self, track_ids, headers, batch_size=TRACKS_BATCH_SIZE):
+        results = [self.fetch_track_details_batch(batch, headers) for batch in chunked(track_ids, batch_size)]
+        return self.combine_track_details(results)
 
-        print("1/3: Recently Played Tracks Data Extraction Successful!")
+    # Method to merge per-batch track details results, in batch order
+    def combine_track_details(self, results):
+        # Collect the batch columns and the IDs Spotify didn't return
+        batches = []
+        missing_ids = []
 
-        return track_df
+        for result in results:
+            if result is None:
+                return None  # Any failed batch fails the whole extraction, as with per-track requests
+
+            columns, missing = result
+            batches.append(columns)
+            missing_ids.extend(missing)
+
+        if missing_ids:
+            print(f"{len(missing_ids)} track(s) not returned by the Spotify API:", ", ".join(missing_ids))
+
+        return concat_columns(batches, TRACK_DETAILS_DTYPES)
+
+    # Method to build the track details DataFrame with its fixed column order and types
+    # Accepts a DataFrame or a list of row dictionaries (e.g. cached or archived rows)
+    def build_track_details_df(self, track_details):
+        track_details_df = typed_frame(track_details, TRACK_DETAILS_DTYPES)
+
+        print("2/3: Track Details Extraction Successful!")
+
+        return track_details_df
 
     # Method to extract track details
-    def extract_track_details(self, track_df):
+    @timed_stage("details")
+    def extract_track_details(self, track_df, batched=True):
         if track_df is None:
             return None
 
-        headers = self.get_spotify_headers()
-
         # Extract unique track IDs from the DataFrame
         track_ids = track_df["track_id"].unique()
 
-        # Initialize a list to store track details
-        track_details_list = []
+        # Only the tracks missing from the metadata cache are fetched from the API
+        cached, to_fetch = self.lookup_cached("details", track_ids)
+        headers = self.get_spotify_headers() if to_fetch else None
+
+        if batched:
+            track_details_df = self.fetch_track_details_batched(to_fetch, headers)
+        else:
+            track_details_df = self.fetch_track_details(to_fetch, headers)
+
+        if track_details_df is None:
+            return None
+
+        track_details_df = self.merge_cached("details", track_ids, cached, track_details_df)
+        self.save_track_links()
+
+        return self.build_track_details_df(track_details_df)
+
+    # Method to turn an audio features object from the Spotify API into a track features row
+    def parse_track_features(self, track_id, track_features_data):
+        return {
+            "track_id": track_id,
+            "danceability": track_features_data["danceability"],
+            "duration_ms": track_features_data["duration_ms"],
+            "energy": track_features_data["energy"],
+            "acousticness": track_features_data["acousticness"],
+            "instrumentalness": track_features_data["instrumentalness"],
+            "key": track_features_data["key"],
+            "liveness": track_features_data["liveness"],
+            "loudness": track_features_data["loudness"],
+            "mode": track_features_data["mode"],
+            "speechiness": track_features_data["speechiness"],
+            "tempo": track_features_data["tempo"],
+            "time_signature": track_features_data["time_signature"],
+            "valence": track_features_data["valence"]
+        }
+
+    # Method to fetch track features one request per track
+    def fetch_track_features(self, track_ids, headers):
+        # Initialize a list to store track features
+        track_features_list = []
 
         for track_id in track_ids:
-            # Send a request to the Spotify API to get track details for the current track_id
-            url = f"{self.tracks_details_url}/{track_id}"
-            r = self.http_client.get(url, headers=headers)
+            # Send a request to the Spotify API to get track features for the current track_id
+            url = f"{self.tracks_features_url}/{track_id}"
+            r = self.api_client.get(url, headers=headers)
 
             if r.status_code != 200:
                 print("Failed to fetch data from Spotify API. Status code:", r.status_code)
                 return None  # Return None to indicate an error.
-            
-            try: 
-                track_data = r.json() 
-
-                # Extract relevant details from the track_data
-                track_details = {
-                    "track_id": track_id,
-                    "track_name": track_data["name"],
-                    "artist_name": track_data["artists"][0]["name"], #This is the first artist in the list
-                    # "artist_genres": ", ".join(track_data["artists"][0]["genres"]),
-                    "album_name": track_data["album"]["name"],
-                    "release_date": track_data["album"]["release_date"],
-                    "length": track_data["duration_ms"],
-                    "popularity": track_data["popularity"],
-                    "explicit": track_data["explicit"],
-                    "type": track_data["type"]
-                }
-                
-                track_details_list.append(track_details)
+
+            try:
+                data = r.json()
+                self.archive_response("audio-features", url, data)
+                track_features_list.append(self.parse_track_features(track_id, data))
 
             except Exception as e:
                 print("Error while processing Spotify API response:", str(e))
                 return None  # Return None to indicate an error.
 
-        # Specify the column order for the DataFrame
-        columns = [
-            "track_id",
-            "track_name",
-            "artist_name",
-            # "artist_genres",
-            "album_name",
-            "release_date",
-            "length",
-            "popularity",
-            "explicit",
-            "type"
-        ]
-
-        # Convert the list of dictionaries to a DataFrame with the specified column order
-        track_details_df = pd.DataFrame(track_details_list, columns=columns)
+        return pd.DataFrame(track_features_list, columns=TRACK_FEATURES_COLUMNS)
+
+    # Method to fetch the features of one batch of tracks through the multi-ID endpoint (?ids=a,b,c)
+    # Returns the parsed column arrays and the IDs without features (null entries of the response), or None
+    # if the request failed: a failed request isn't a track without features
+    def fetch_track_features_batch(self, batch, headers):
+        # Send a single request to the Spotify API for the whole batch
+        url = f"{self.tracks_features_url}?ids={','.join(batch)}"
+        r = self.api_client.get(url, headers=headers)
+
+        if r.status_code != 200:
+            print("Failed to fetch data from Spotify API. Status code:", r.status_code)
+            return None  # Return None to indicate an error.
+
+        try:
+            data = loads(r.content)
+            self.archive_response("audio-features", url, data)
+            audio_features = data["audio_features"]
+
+        except Exception as e:
+            print("Error while processing Spotify API response:", str(e))
+            return None  # Return None to indicate an error.
+
+        # Spotify answers in request order and uses null for tracks without features
+        return parse_audio_features(batch, audio_features)
+
+    # Method to fetch track features in batches through the multi-ID endpoint
+    # Returns the features DataFrame and the IDs of the tracks Spotify has no features for, or None on failure
+    def fetch_track_features_batched(self, track_ids, headers, batch_size=AUDIO_FEATURES_BATCH_SIZE):
+        results = [self.fetch_track_features_batch(batch, headers) for batch in chunked(track_ids, batch_size)]
+        return self.combine_track_features(results)
+
+    # Method to merge per-batch track features results, in batch order
+    # Returns the features DataFrame and the IDs without features, or None if a batch failed. Nothing is kept
+    # on the instance: the partitions of a backfill share one SpotifyETL across threads.
+    def combine_track_features(self, results):
+        # Collect the batch columns and the IDs without features
+        batches = []
+        missing_ids = []
+
+        for result in results:
+            if result is None:
+                return None  # Any failed batch fails the whole extraction, as with the details
+
+            columns, missing = result
+            if columns:
+                batches.append(columns)
+            missing_ids.extend(missing)
+
+        if missing_ids:
+            print(f"{len(missing_ids)} track(s) without audio features:", ", ".join(missing_ids))
+
+        return concat_columns(batches, TRACK_FEATURES_DTYPES), missing_ids
+
+    # Method to build the track features DataFrame with its fixed column order and types
+    # Accepts a DataFrame or a list of row dictionaries (e.g. cached or archived rows)
+    def build_track_features_df(self, track_features):
+        track_features_df = typed_frame(track_features, TRACK_FEATURES_DTYPES)
 
-        print("2/3: Track Details Extraction Successful!")
+        print("3/3: Track Features Extraction Successful!")
 
-        return track_details_df
+        return track_features_df
 
     # Method to extract track features
-    def extract_track_features(self, track_df):
+    @timed_stage("features")
+    def extract_track_features(self, track_df, batched=True):
         if track_df is None:
             return None
 
-        headers = self.get_spotify_headers()
-
         # Extract unique track IDs from the DataFrame
         track_ids = track_df["track_id"].unique()
 
-        # Initialize a list to store track details
-        track_features_list = []
+        # Only the tracks missing from the metadata cache are fetched from the API
+        cached, to_fetch = self.lookup_cached("features", track_ids)
+        headers = self.get_spotify_headers() if to_fetch else None
 
-        for track_id in track_ids:
-            # Send a request to the Spotify API to get track details for the current track_id
-            url = f"{self.tracks_features_url}/{track_id}"
-            r = self.http_client.get(url, headers=headers)
+        if batched:
+            result = self.fetch_track_features_batched(to_fetch, headers)
+            track_features_df = result[0] if result is not None else None
+        else:
+            track_features_df = self.fetch_track_features(to_fetch, headers)
 
-            if r.status_code != 200:
-                print("Failed to fetch data from Spotify API. Status code:", r.status_code)
-                return None  # Return None to indicate an error.
-            
-            try: 
-                track_features_data = r.json() 
-
-                # Extract relevant features from the track_features_data
-                track_features = {
-                    "track_id": track_id,
-                    "danceability": track_features_data["danceability"],
-                    "duration_ms": track_features_data["duration_ms"],
-                    "energy": track_features_data["energy"],
-                    "acousticness": track_features_data["acousticness"],
-                    "instrumentalness": track_features_data["instrumentalness"],
-                    "key": track_features_data["key"],
-                    "liveness": track_features_data["liveness"],
-                    "loudness": track_features_data["loudness"],
-                    "mode": track_features_data["mode"],
-                    "speechiness": track_features_data["speechiness"],
-                    "tempo": track_features_data["tempo"],
-                    "time_signature": track_features_data["time_signature"],
-                    "valence": track_features_data["valence"]
-                }
-
-                track_features_list.append(track_features)
+        if track_features_df is None:
+            return None
 
-            except Exception as e:
-                print("Error while processing Spotify API response:", str(e))
-                return None  # Return None to indicate an error.
+        track_features_df = self.merge_cached("features", track_ids, cached, track_features_df)
 
-        # Specify the column order for the DataFrame
-        columns = [
-            "track_id",
-            "danceability",
-            "duration_ms",
-            "energy",
-            "acousticness",
-            "instrumentalness",
-            "key",
-            "liveness",
-            "loudness",
-            "mode",
-            "speechiness",
-            "tempo",
-            "time_signature",
-            "valence"
-        ]
-
-        # Convert the list of dictionaries to a DataFrame with the specified column order
-        track_features_df = pd.DataFrame(track_features_list, columns=columns)
+        return self.build_track_features_df(track_features_df)
 
-        print("3/3: Track Features Extraction Successful!")
+    # Method to extract track details and features concurrently
+    # Every details and features batch is submitted to one bounded thread pool, so the run takes
+    # about as long as the slowest requests instead of the sum of all of them. Results are read
+    # back in submission order, which keeps the DataFrames' row order deterministic.
+    @timed_stage("enrich")
+    def extract_track_enrichment(self, track_df):
+        if track_df is None:
+            return None, None
 
-        return track_features_df
+        # Extract unique track IDs from the DataFrame
+        track_ids = track_df["track_id"].unique()
+
+        # Only the tracks missing from the metadata cache are fetched from the API
+        cached_details, details_to_fetch = self.lookup_cached("details", track_ids)
+        cached_features, features_to_fetch = self.lookup_cached("features", track_ids)
+        headers = self.get_spotify_headers() if details_to_fetch or features_to_fetch else None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            details_futures = [
+                executor.submit(self.fetch_track_details_batch, batch, headers)
+                for batch in chunked(details_to_fetch, TRACKS_BATCH_SIZE)
+            ]
+            features_futures = [
+                executor.submit(self.fetch_track_features_batch, batch, headers)
+                for batch in chunked(features_to_fetch, AUDIO_FEATURES_BATCH_SIZE)
+            ]
+
+            track_details_df = self.combine_track_details([f.result() for f in details_futures])
+            features_result = self.combine_track_features([f.result() for f in features_futures])
+            track_features_df = features_result[0] if features_result is not None else None
+
+        if track_details_df is not None:
+            track_details_df = self.merge_cached("details", track_ids, cached_details, track_details_df)
+            track_details_df = self.build_track_details_df(track_details_df)
+        self.save_track_links()
+
+        if track_features_df is not None:
+            track_features_df = self.merge_cached("features", track_ids, cached_features, track_features_df)
+            track_features_df = self.build_track_features_df(track_features_df)
+
+        return track_details_df, track_features_df
+
+    # Method to remember the album and artist IDs of freshly fetched tracks (see parse_track_links)
+    # Called from the enrichment workers, hence the lock
+    def keep_track_links(self, links):
+        with self._links_lock:
+            for link in links:
+                self.track_links[link["track_id"]] = link
+            self.unsaved_links.extend(links)
+
+    # Method to store the links kept since the last call in the metadata cache, so a later run whose
+    # track details all come from the cache still knows the artists and albums of its tracks
+    def save_track_links(self):
+        with self._links_lock:
+            links, self.unsaved_links = self.unsaved_links, []
+
+        if self.cache is not None and links:
+            self.cache.put_many("links", links)
+
+    # Method to fetch the album and artist IDs of one batch of tracks through the multi-ID /v1/tracks endpoint
+    # Only needed for tracks whose details came from the cache before their links were cached
+    def fetch_track_links_batch(self, batch, headers):
+        url = f"{self.tracks_details_url}?ids={','.join(batch)}"
+        r = self.api_client.get(url, headers=headers)
+
+        if r.status_code != 200:
+            print("Failed to fetch data from Spotify API. Status code:", r.status_code)
+            return None  # Return None to indicate an error.
+
+        try:
+            data = loads(r.content)
+            self.archive_response("tracks", url, data)
+            return parse_track_links(batch, data["tracks"])
+
+        except Exception as e:
+            print("Error while processing Spotify API response:", str(e))
+            return None  # Return None to indicate an error.
+
+    # Method to get the album and artist IDs of tracks: from the details fetched in this run first,
+    # then from the metadata cache, and only then from the API
+    def lookup_track_links(self, track_ids):
+        with self._links_lock:
+            links = {track_id: self.track_links[track_id] for track_id in track_ids if track_id in self.track_links}
+
+        remaining = [track_id for track_id in track_ids if track_id not in links]
+        if remaining and self.cache is not None:
+            cached, remaining = self.lookup_cached("links", remaining)
+            links.update(cached)
+
+        if remaining:
+            headers = self.get_spotify_headers()
+            for batch in chunked(remaining, TRACKS_BATCH_SIZE):
+                fetched = self.fetch_track_links_batch(batch, headers)
+                if fetched is None:
+                    return None
+                self.keep_track_links(fetched)
+                links.update((link["track_id"], link) for link in fetched)
+            self.save_track_links()
+
+        # Keep the links in track_ids order, tracks Spotify didn't return are left out
+        return [links[track_id] for track_id in track_ids if track_id in links]
+
+    # Method to fetch one batch of artists or albums through their multi-ID endpoint (?ids=a,b,c)
+    # Returns the parsed column arrays and the IDs Spotify didn't return, or None if the request failed
+    def fetch_dimension_batch(self, kind, batch, headers):
+        url = f"{self.artists_url if kind == 'artists' else self.albums_url}?ids={','.join(batch)}"
+        r = self.api_client.get(url, headers=headers)
+
+        if r.status_code != 200:
+            print("Failed to fetch data from Spotify API. Status code:", r.status_code)
+            return None  # Return None to indicate an error.
+
+        try:
+            data = loads(r.content)
+            self.archive_response(kind, url, data)
+
+            # Spotify answers in request order and uses null for unknown IDs
+            if kind == "artists":
+                return parse_artists(batch, data["artists"])
+            return parse_albums(batch, data["albums"])
+
+        except Exception as e:
+            print("Error while processing Spotify API response:", str(e))
+            return None  # Return None to indicate an error.
+
+    # Method to merge per-batch artists or albums results, in batch order
+    def combine_dimension(self, kind, results):
+        batches = []
+        missing_ids = []
+
+        for result in results:
+            if result is None:
+                return None  # Any failed batch fails the whole dimension
+
+            columns, missing = result
+            batches.append(columns)
+            missing_ids.extend(missing)
+
+        if missing_ids:
+            print(f"{len(missing_ids)} {kind} not returned by the Spotify API:", ", ".join(missing_ids))
+
+        return concat_columns(batches, ARTISTS_DTYPES if kind == "artists" else ALBUMS_DTYPES)
+
+    # Method to extract the artist and album dimensions of the tracks
+    # Requests scale with the distinct artists and albums, not with the plays: their IDs are collected
+    # from the track payloads the details stage already fetched, the cached ones are skipped, and the
+    # rest is fetched 50 artists / 20 albums per request, both endpoints concurrently.
+    # Returns the artists, albums, track_artists and track_albums DataFrames, or None on failure.
+    @timed_stage("dimensions")
+    def extract_dimensions(self, track_df):
+        if track_df is None:
+            return None
+
+        track_ids = track_df["track_id"].unique()
+        links = self.lookup_track_links(track_ids)
+        if links is None:
+            return None
+
+        track_artists_df, track_albums_df = link_frames(links)
+        artist_ids = track_artists_df["artist_id"].unique()
+        album_ids = track_albums_df["album_id"].unique()
+
+        # Only the artists and albums missing from the metadata cache are fetched from the API
+        cached_artists, artists_to_fetch = self.lookup_cached("artists", artist_ids)
+        cached_albums, albums_to_fetch = self.lookup_cached("albums", album_ids)
+        headers = self.get_spotify_headers() if artists_to_fetch or albums_to_fetch else None
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            artists_futures = [
+                executor.submit(self.fetch_dimension_batch, "artists", batch, headers)
+                for batch in chunked(artists_to_fetch, ARTISTS_BATCH_SIZE)
+            ]
+            albums_futures = [
+                executor.submit(self.fetch_dimension_batch, "albums", batch, headers)
+                for batch in chunked(albums_to_fetch, ALBUMS_BATCH_SIZE)
+            ]
+
+            artists_df = self.combine_dimension("artists", [f.result() for f in artists_futures])
+            albums_df = self.combine_dimension("albums", [f.result() for f in albums_futures])
+
+        if artists_df is None or albums_df is None:
+            return None
+
+        artists_df = self.merge_cached("artists", artist_ids, cached_artists, artists_df, key="artist_id")
+        albums_df = self.merge_cached("albums", album_ids, cached_albums, albums_df, key="album_id")
+
+        print(f"Dimensions Extraction Successful! {len(artist_ids)} artist(s) and {len(album_ids)} album(s), "
+              f"{len(artists_to_fetch) + len(albums_to_fetch)} fetched from the API.")
+
+        return {
+            "artists": typed_frame(artists_df, ARTISTS_DTYPES),
+            "albums": typed_frame(albums_df, ALBUMS_DTYPES),
+            "track_artists": track_artists_df,
+            "track_albums": track_albums_df,
+        }
 
     # Method to transform data (not currently used in the code)
     def transform_data(self, track_details_df):
@@ -257,51 +727,119 @@ class SpotifyETL:
         return track_details_df
 
     # Method to perform data quality checks
-    def data_quality(self, load_df, primary_key_column):
-        # Checking Whether the DataFrame is empty
-        if load_df.empty:
-            print('DataFrame is empty.')
-            return False
-
-        # Enforcing Primary Keys since we don't need duplicates
-        if pd.Series(load_df[primary_key_column]).is_unique:
-            pass
-        else:
-            # Raise an exception if primary key constraint is violated
-            raise Exception("Primary Key Exception, Data Might Contain Duplicates")
-
-        # Checking for Nulls in our data frame
-        if load_df.isnull().values.any():
-            raise Exception("Null Values Found")
-
-        print("Data Quality Checks Passed!")
+    # Runs the vectorized rules of the table (keys, nulls, DDL types, ranges, references) and raises
+    # a DataQualityError listing the offending rows of every failed check (see DataQualityChecker.validate)
+    @timed_stage("quality")
+    def data_quality(self, load_df, table_name, references=None, allow_empty=False):
+        return self.quality_checker.validate(load_df, table_name, references, allow_empty)
 
     # Method for the Spotify ETL process to extract recently played tracks
-    def spotify_tracks_etl(self):
-        tracks_df = self.extract_recently_played_tracks()
-        self.data_quality(tracks_df, 'played_at')
+    def spotify_tracks_etl(self, after=None):
+        tracks_df = self.extract_recently_played_tracks(after)
+        # No new plays since the last run is an empty DataFrame, not a failure
+        self.data_quality(tracks_df, 'recent_tracks', allow_empty=True)
         return tracks_df
 
     # Method for the Spotify ETL process to extract track details
     def spotify_details_etl(self, tracks_df):
         track_details_df = self.extract_track_details(tracks_df)
-        self.data_quality(track_details_df, 'track_id')
+        if track_details_df is None:
+            raise Exception("Track details extraction failed")
+        self.data_quality(track_details_df, 'track_details')
         #track_details_df = self.transform_data(track_details_df)
         return track_details_df
 
     # Method for the Spotify ETL process to extract track features
+    # Raises when a features request failed, so the plays aren't loaded (and the cursor moved past them)
+    # without the features of their tracks
     def spotify_features_etl(self, tracks_df):
         track_features_df = self.extract_track_features(tracks_df)
-        self.data_quality(track_features_df, 'track_id')
+        if track_features_df is None:
+            raise Exception("Track features extraction failed")
+        # Tracks without audio features are left out (see combine_track_features), possibly all of them
+        self.data_quality(track_features_df, 'track_features', allow_empty=True)
         print("ETL Process Completed Successfully!")
         return track_features_df
 
+    # Method for the Spotify ETL process to extract track details and features concurrently
+    # Raises when the details or features couldn't be extracted: loading the plays without them, then
+    # moving the cursor past the plays, would lose the details or features of those tracks for good
+    def spotify_enrichment_etl(self, tracks_df):
+        track_details_df, track_features_df = self.extract_track_enrichment(tracks_df)
+        if track_details_df is None:
+            raise Exception("Track details extraction failed")
+        if track_features_df is None:
+            raise Exception("Track features extraction failed")
+        self.data_quality(track_details_df, 'track_details')
+        self.data_quality(track_features_df, 'track_features', allow_empty=True)
+        print("ETL Process Completed Successfully!")
+        return track_details_df, track_features_df
+
+    # Method for the Spotify ETL process to extract the artist and album dimensions of the tracks
+    # Returns None when they couldn't be extracted: the dimensions are then skipped, the run doesn't fail
+    def spotify_dimensions_etl(self, tracks_df):
+        dimensions = self.extract_dimensions(tracks_df)
+        if dimensions is None:
+            print("Dimensions extraction failed, the artists and albums are skipped.")
+            return None
+
+        # Tracks Spotify didn't return have no artists or albums, possibly none of the page's
+        self.data_quality(dimensions["artists"], 'artists', allow_empty=True)
+        self.data_quality(dimensions["albums"], 'albums', allow_empty=True)
+        self.data_quality(dimensions["track_artists"], 'track_artists', references={"artists": dimensions["artists"]}, allow_empty=True)
+        self.data_quality(dimensions["track_albums"], 'track_albums', references={"albums": dimensions["albums"]}, allow_empty=True)
+        return dimensions
+
+    # Method for the streaming Spotify ETL process: each page of recently played tracks is checked,
+    # enriched and loaded as soon as it arrives, and the extraction cursor is advanced once all pages
+    # are loaded. Returns the number of plays loaded.
+    # With an `aggregator` (see spotify_aggregate.py), the listening summaries of each page's days are
+    # refreshed right after the page is loaded.
+    def spotify_streaming_etl(self, loader, state, aggregator=None):
+        plays = 0
+        latest = None
+
+        for tracks_df in self.iter_recently_played_pages(state.get_after(self.cursor_key)):
+            details_df, features_df = self.spotify_enrichment_etl(tracks_df)
+            dimensions = self.spotify_dimensions_etl(tracks_df)
+            self.data_quality(tracks_df, 'recent_tracks', references={"track_details": details_df})
+            loader.load(tracks_df, details_df, features_df, dimensions=dimensions, observed_at=self.observed_times(details_df))
+            if aggregator is not None:
+                aggregator.update(tracks_df)
+
+            # Keep track of the latest play across pages without holding on to them
+            plays += len(tracks_df)
+            page_latest = tracks_df["played_at"].max()
+            latest = page_latest if latest is None else max(latest, page_latest)
+
+        if plays == 0:
+            print("No new tracks played since the last run.")
+            return 0
+
+        # Pages are loaded with idempotent upserts, so if the run fails midway the next one
+        # safely starts again from the previous cursor
+        state.advance(pd.DataFrame({"played_at": [latest.isoformat()]}), self.cursor_key)
+
+        return plays
+
 def main():
+    # Only the command line run writes to the database: the stages extracting with SpotifyETL don't import SQLAlchemy
+    from sqlalchemy import create_engine
+    from spotify_load import SpotifyLoader
+    from spotify_aggregate import ListeningAggregator
+
     # Loading environment variables
     load_dotenv()
 
+    # Stage timings and request metrics of the run, only recorded when an exporter is configured
+    metrics = metrics_from_env()
+
     # Defining the connection to the database
     engine = create_engine(os.getenv("POSTGRESQL_CONN"))
+    loader = SpotifyLoader(engine, metrics=metrics)
+    loader.create_tables()
+    aggregator = ListeningAggregator(engine, metrics=metrics)
+    aggregator.create_tables()
 
     # Running the ETL functions
     print("Started")
@@ -313,34 +851,49 @@ def main():
         os.getenv("SPOTIFY_REFRESH_TOKEN"),
         os.getenv("SPOTIFY_ACCESS_TOKEN"),
         os.getenv("SPOTIFY_TOKEN_EXPIRATION"),
-        "https://accounts.spotify.com/api/token"
+        "https://accounts.spotify.com/api/token",
+        token_store=AsyncTokenStore(EnvFileTokenStore())
     )
 
+    # Keep the raw API responses, so the tables can be rebuilt later without calling the API again
+    archive = RawArchive(os.getenv("SPOTIFY_ARCHIVE_PATH", DEFAULT_ARCHIVE_PATH), os.getenv("SPOTIFY_ARCHIVE_FORMAT", "jsonl"))
+
+    # One HTTP client for the token and API requests, so they all share the per-endpoint rate limits
+    http_client = HttpClient(pool_size=DEFAULT_MAX_WORKERS, rate_limiter=RateLimiter(), metrics=metrics)
+
     # Create a SpotifyTokenManager object with the configuration and HTTP client
-    token_manager = SpotifyTokenManager(config, HttpClient())
+    token_manager = SpotifyTokenManager(config, http_client)
 
     # Create a SpotifyETL object with token manager and endpoints
     etl = SpotifyETL(
         token_manager,
         recent_tracks_url="https://api.spotify.com/v1/me/player/recently-played", 
         tracks_details_url="https://api.spotify.com/v1/tracks", 
-        tracks_features_url="https://api.spotify.com/v1/audio-features"
+        tracks_features_url="https://api.spotify.com/v1/audio-features",
+        http_client=http_client,
+        cache=TrackMetadataCache(os.getenv("SPOTIFY_CACHE_PATH", DEFAULT_CACHE_PATH)),
+        archive=archive,
+        metrics=metrics
         )
 
-    # Extracting the tracks
-    tracks_df = etl.spotify_tracks_etl()
-    tracks_df.to_sql('recent_tracks', engine, if_exists='replace')
-
-    # Extracting the details and features
-    if tracks_df is not None:
-        details_df = etl.spotify_details_etl(tracks_df)
-        details_df.to_sql('track_details', engine, if_exists='replace')
-
-        features_df = etl.spotify_features_etl(tracks_df)
-        features_df.to_sql('track_features', engine, if_exists='replace')
+    # Extracting only the tracks played since the last successful load, page by page:
+    # each page is enriched and upserted into the keyed tables as soon as it arrives
+    state = ExtractionState(os.getenv("SPOTIFY_STATE_PATH", DEFAULT_STATE_PATH))
+    try:
+        plays = etl.spotify_streaming_etl(loader, state, aggregator)
+    finally:
+        archive.close()
+        config.token_store.flush()
+        metrics.export()
+
+    # Print the time spent waiting for the rate limiter, per endpoint family
+    for family, counters in http_client.rate_limiter.stats().items():
+        if counters["waited"] or counters["throttled"]:
+            print(f"Rate limited {family}: waited {counters['waited']:.2f}s over {counters['requests']} request(s), {counters['throttled']} throttled response(s)")
 
     # Print the final message
-    print("Database updated successfully!")
+    if plays:
+        print("Database updated successfully!")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,225 @@
+import io
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from sqlalchemy import bindparam, text
+from sqlalchemy.dialects import postgresql, sqlite
+
+from spotify_metrics import NULL_METRICS, timed_stage
+from spotify_schema import HISTORIES, TABLES, sql_table
+
+# Number of rows sent per INSERT statement
+UPSERT_CHUNK_SIZE = 10_000
+
+# Number of keys per query reading the latest rows of a history table
+HISTORY_LOOKUP_CHUNK_SIZE = 1_000
+
+# Helper to hash the given columns of each row into a signed 64-bit fingerprint (a BIGINT), after casting
+# them to the types they are hashed as
+def row_fingerprints(df, columns):
+    return pd.util.hash_pandas_object(df[list(columns)].astype(columns), index=False).to_numpy().view("int64")
+
+# Helper to get the observation time of each key, as UTC times to the microsecond (what the database keeps)
+# `observed_at` is a datetime, or a Series of times indexed by key; keys missing from the Series are observed now
+def observation_times(keys, observed_at):
+    if isinstance(observed_at, pd.Series):
+        observed = pd.Series(pd.to_datetime(observed_at.reindex(keys).to_numpy(), utc=True), index=keys.index)
+        observed = observed.fillna(pd.Timestamp.now(tz=timezone.utc))
+    else:
+        observed = pd.Series(pd.Timestamp(observed_at).tz_convert(timezone.utc), index=keys.index)
+    return observed.astype("datetime64[us, UTC]").dt.floor("us")
+
+# Helper to convert a DataFrame into a list of row dictionaries with plain Python values and None for nulls
+def dataframe_records(df):
+    # float32 values go through their shortest text form, so 0.123 is sent as 0.123 and not 0.12300000339746475
+    float32_columns = df.columns[(df.dtypes == "float32").to_numpy()]
+    if len(float32_columns):
+        df = df.astype({column: str for column in float32_columns}).astype({column: "float64" for column in float32_columns})
+    df = df.astype(object)
+    return df.where(df.notna(), None).to_dict("records")
+
+# Class to load the ETL DataFrames into the database with bulk upserts
+# Rows go in with INSERT ... ON CONFLICT on the tables' primary keys, so the tables keep their history
+# and keys, and the cost of a run grows with the number of new rows instead of the size of the tables.
+class SpotifyLoader:
+    def __init__(self, engine, chunk_size=UPSERT_CHUNK_SIZE, metrics=None):
+        self.engine = engine
+        self.chunk_size = chunk_size
+        # Optional RunMetrics timing the loads and counting the rows written, see spotify_metrics.py
+        self.metrics = metrics or NULL_METRICS
+
+    # Method to create the tables and their indexes if they don't exist yet
+    def create_tables(self):
+        with self.engine.begin() as connection:
+            for table in TABLES.values():
+                connection.execute(text(table["ddl"]))
+                for index in table.get("indexes", []):
+                    connection.execute(text(index))
+
+    # Method to build the dialect-specific INSERT statement of a table
+    def insert_statement(self, table):
+        if self.engine.dialect.name == "postgresql":
+            return postgresql.insert(table)
+        if self.engine.dialect.name == "sqlite":
+            return sqlite.insert(table)
+        raise ValueError(f"Upserts are not supported on {self.engine.dialect.name} databases")
+
+    # Method to upsert a DataFrame into a table within an open transaction, returns the number of rows sent
+    # A key repeated within the DataFrame is written once, with its last row, whether the table updates
+    # existing rows or keeps them. With insert_only=True existing rows are kept in every table.
+    def upsert(self, connection, table_name, df, insert_only=False):
+        if df is None or df.empty:
+            return 0
+
+        settings = TABLES[table_name]
+        df = df.drop_duplicates(settings["key"], keep="last")
+        statement = self.insert_statement(sql_table(settings["ddl"]))
+
+        if settings["update"] and not insert_only:
+            columns = [column for column in df.columns if column not in settings["key"]]
+            statement = statement.on_conflict_do_update(
+                index_elements=settings["key"],
+                set_={column: statement.excluded[column] for column in columns}
+            )
+        else:
+            statement = statement.on_conflict_do_nothing(index_elements=settings["key"])
+
+        records = dataframe_records(df)
+        for start in range(0, len(records), self.chunk_size):
+            connection.execute(statement, records[start:start + self.chunk_size])
+
+        return len(records)
+
+    # Method to bulk load a DataFrame into a table within an open transaction, returns the number of rows sent
+    # On PostgreSQL the rows are streamed with COPY FROM STDIN into a temporary staging table and merged
+    # into the target table with a single INSERT ... SELECT ... ON CONFLICT. Other databases fall back to
+    # the multi-row upserts of `upsert`.
+    def copy_upsert(self, connection, table_name, df, insert_only=False):
+        if df is None or df.empty:
+            return 0
+
+        if self.engine.dialect.name != "postgresql":
+            return self.upsert(connection, table_name, df, insert_only)
+
+        settings = TABLES[table_name]
+        staging_name = f"staging_{table_name}"
+        columns = ", ".join(df.columns)
+        key = ", ".join(settings["key"])
+
+        # The staging table only lives until the end of the transaction. staging_seq numbers the rows in
+        # DataFrame order, so a repeated key keeps its last row as with `upsert`
+        connection.execute(text(
+            f"CREATE TEMP TABLE {staging_name} (LIKE {table_name} INCLUDING DEFAULTS, staging_seq BIGSERIAL) ON COMMIT DROP"
+        ))
+
+        # Serialize the DataFrame to an in-memory CSV buffer and stream it through COPY
+        buffer = io.StringIO()
+        df.to_csv(buffer, index=False, header=False)
+        buffer.seek(0)
+
+        cursor = connection.connection.cursor()
+        try:
+            cursor.copy_expert(f"COPY {staging_name} ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+        finally:
+            cursor.close()
+
+        if settings["update"] and not insert_only:
+            updates = ", ".join(f"{column} = EXCLUDED.{column}" for column in df.columns if column not in settings["key"])
+            conflict = f"ON CONFLICT ({key}) DO UPDATE SET {updates}"
+        else:
+            conflict = f"ON CONFLICT ({key}) DO NOTHING"
+
+        # DISTINCT ON keeps a single row per key, the last one, ON CONFLICT can't affect the same row twice
+        # in one statement
+        connection.execute(text(
+            f"INSERT INTO {table_name} ({columns}) "
+            f"SELECT DISTINCT ON ({key}) {columns} FROM {staging_name} "
+            f"ORDER BY {key}, staging_seq DESC "
+            f"{conflict}"
+        ))
+
+        return len(df)
+
+    # Method to read the key, fingerprint and valid_from of the latest row of the given keys in a history table
+    # The latest row of a key is found through the (key, valid_from) primary key, keys without rows are left out.
+    def latest_fingerprints(self, connection, history_name, keys):
+        key = HISTORIES[history_name]["key"]
+        statement = text(
+            f"SELECT h.{key}, h.fingerprint, h.valid_from FROM {history_name} h WHERE h.{key} IN :keys "
+            f"AND h.valid_from = (SELECT MAX(valid_from) FROM {history_name} WHERE {key} = h.{key})"
+        ).bindparams(bindparam("keys", expanding=True))
+
+        latest = []
+        for start in range(0, len(keys), HISTORY_LOOKUP_CHUNK_SIZE):
+            latest.extend(tuple(row) for row in connection.execute(statement, {"keys": keys[start:start + HISTORY_LOOKUP_CHUNK_SIZE]}))
+        return latest
+
+    # Method to find the rows of a DataFrame whose tracked values changed since the latest row of their key
+    # in a history table, or that have no row yet. Returns them as rows of the history table, valid from
+    # the time their values were observed. The values are compared through their fingerprints, one
+    # vectorized lookup of (key, fingerprint) pairs, so unchanged rows cost no write.
+    # `observed_at` is a datetime, or a Series of times indexed by key (see load). A row observed before
+    # the latest row of its key is stale, e.g. an archived or cached value reloaded later, and is skipped.
+    def changed_rows(self, connection, history_name, df, observed_at):
+        settings = HISTORIES[history_name]
+        key, columns = settings["key"], settings["columns"]
+        current = df[[key, *columns]].drop_duplicates(key, keep="last")
+        fingerprints = row_fingerprints(current, columns)
+        observed = observation_times(current[key], observed_at)
+
+        latest = self.latest_fingerprints(connection, history_name, current[key].tolist())
+        changed = ~pd.MultiIndex.from_arrays([current[key], fingerprints]).isin([row[:2] for row in latest])
+
+        # Times are compared in microseconds since the epoch. SQLite returns valid_from as text, PostgreSQL
+        # as datetimes; keys without rows get NaN and their values are always new
+        latest_from = pd.to_datetime([row[2] for row in latest], utc=True, format="ISO8601").as_unit("us").asi8
+        previous = pd.Series(latest_from, index=[row[0] for row in latest], dtype="int64").reindex(current[key]).to_numpy(dtype="float64")
+        newer = np.isnan(previous) | (pd.DatetimeIndex(observed).asi8 > previous)
+        if (changed & ~newer).any():
+            print(f"Skipped {(changed & ~newer).sum()} {history_name} change(s) observed before the latest recorded value.")
+
+        keep = changed & newer
+        changes = current[keep].assign(valid_from=observed[keep], fingerprint=fingerprints[keep])
+        return changes[[key, "valid_from", *columns, "fingerprint"]]
+
+    # Method to load a run's DataFrames in a single transaction: either every table is updated or none
+    # Use bulk=True for large backfills, it goes through COPY on PostgreSQL (see copy_upsert)
+    # `dimensions` maps the artists, albums, track_artists and track_albums tables to their DataFrames
+    # (see SpotifyETL.extract_dimensions); they are loaded in the same transaction.
+    # The changes of the tracked values (see HISTORIES) are appended to their history tables, e.g. a row of
+    # track_popularity_history for each track whose popularity differs from its latest recorded value.
+    # With insert_only=True rows already in the tables are never updated, e.g. when reloading older data
+    # that mustn't overwrite what later runs loaded (see ArchiveReplay).
+    # `observed_at` is when the tracked values were fetched from the API: a datetime, or a Series of times
+    # indexed by key for values fetched at different times (e.g. served by the cache, see
+    # SpotifyETL.observed_times). None, like keys missing from the Series, means now.
+    @timed_stage("load")
+    def load(self, tracks_df, details_df, features_df, bulk=False, dimensions=None, insert_only=False, observed_at=None):
+        write = self.copy_upsert if bulk else self.upsert
+        frames = {"recent_tracks": tracks_df, "track_details": details_df, "track_features": features_df, **(dimensions or {})}
+        if observed_at is None:
+            observed_at = datetime.now(timezone.utc)
+
+        with self.engine.begin() as connection:
+            # Changes are found against the values recorded before this run, before any table is written
+            changes = {
+                history_name: self.changed_rows(connection, history_name, frames[settings["source"]], observed_at)
+                for history_name, settings in HISTORIES.items()
+                if frames.get(settings["source"]) is not None and not frames[settings["source"]].empty
+            }
+
+            tracks_rows = write(connection, "recent_tracks", tracks_df, insert_only)
+            details_rows = write(connection, "track_details", details_df, insert_only)
+            features_rows = write(connection, "track_features", features_df, insert_only)
+            dimension_rows = {table_name: write(connection, table_name, df, insert_only) for table_name, df in (dimensions or {}).items()}
+            history_rows = {history_name: self.upsert(connection, history_name, df) for history_name, df in changes.items()}
+
+        self.metrics.count("load", "rows_written", tracks_rows + details_rows + features_rows + sum(dimension_rows.values())
+                           + sum(history_rows.values()))
+        self.metrics.count("load", "history_rows", sum(history_rows.values()))
+        print(f"Loaded {tracks_rows} plays, {details_rows} track details and {features_rows} track features.")
+        if dimension_rows:
+            print("Loaded " + ", ".join(f"{rows} {table_name} row(s)" for table_name, rows in dimension_rows.items()) + ".")
+        if history_rows:
+            print("Recorded " + ", ".join(f"{rows} {history_name} change(s)" for history_name, rows in history_rows.items()) + ".")
@@ -0,0 +1,291 @@
+import contextlib
+import functools
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+
+# Upper bounds in seconds of the request latency histogram buckets (the last bucket is unbounded)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Stage of the run the requests of each endpoint family belong to
+ENDPOINT_STAGES = {"recently-played": "extract", "tracks": "details", "audio-features": "features", "artists": "artists",
+                   "albums": "albums", "token": "token"}
+
+# Prefix of the exported metric names
+METRICS_PREFIX = "spotify_etl"
+
+# Port of the StatsD exporter when SPOTIFY_METRICS_STATSD names a host only
+DEFAULT_STATSD_PORT = 8125
+
+# Class recording nothing, the default of every instrumented object
+# Its methods return right away, so a run without metrics pays one empty method call per event.
+class NullMetrics:
+    enabled = False
+
+    def stage(self, name):
+        return contextlib.nullcontext()
+
+    def record_request(self, endpoint, seconds, size, status, retry):
+        pass
+
+    def count(self, stage, name, value=1):
+        pass
+
+    def report(self):
+        return {}
+
+    def export(self):
+        pass
+
+NULL_METRICS = NullMetrics()
+
+# Decorator timing a method as a stage of the run, through the `metrics` attribute of its object
+def timed_stage(name):
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.metrics.enabled:
+                return method(self, *args, **kwargs)
+            with self.metrics.stage(name):
+                return method(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+# Class recording the metrics of one run
+# Stages (extract, details, features, quality, load) are timed with `stage`; when a stage runs several
+# times, e.g. once per page in the streaming ETL, its wall time and number of calls add up. Requests are
+# recorded per endpoint family (requests, bytes received, retries, errors and a latency histogram) and
+# attributed to a stage through ENDPOINT_STAGES. Other counters (cache hits, rows written) are recorded
+# per stage with `count`. Everything is thread safe, the enrichment workers record concurrently.
+class RunMetrics:
+    enabled = True
+
+    def __init__(self, run_id=None, exporters=()):
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.exporters = list(exporters)
+        self.started_at = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.endpoints = {}
+        self._lock = threading.Lock()
+
+    # Context manager timing one execution of a stage
+    @contextlib.contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            with self._lock:
+                stage = self.stages.setdefault(name, {"seconds": 0.0, "calls": 0})
+                stage["seconds"] += seconds
+                stage["calls"] += 1
+
+    # Method to record one HTTP attempt: its latency, response size and status (None when it failed to connect)
+    def record_request(self, endpoint, seconds, size, status, retry):
+        bucket = 0
+        while bucket < len(LATENCY_BUCKETS) and seconds > LATENCY_BUCKETS[bucket]:
+            bucket += 1
+
+        with self._lock:
+            counters = self.endpoints.get(endpoint)
+            if counters is None:
+                counters = self.endpoints[endpoint] = {
+                    "requests": 0, "bytes": 0, "retries": 0, "errors": 0, "throttled": 0,
+                    "latency_sum": 0.0, "latency_max": 0.0, "buckets": [0] * (len(LATENCY_BUCKETS) + 1)
+                }
+            counters["requests"] += 1
+            counters["bytes"] += size
+            counters["retries"] += retry
+            counters["errors"] += status is None or status >= 400
+            counters["throttled"] += status == 429
+            counters["latency_sum"] += seconds
+            counters["latency_max"] = max(counters["latency_max"], seconds)
+            counters["buckets"][bucket] += 1
+
+        for exporter in self.exporters:
+            exporter.observe_request(endpoint, seconds)
+
+    # Method to add to a counter of a stage, e.g. count("load", "rows_written", 50)
+    def count(self, stage, name, value=1):
+        with self._lock:
+            counters = self.counters.setdefault(stage, {})
+            counters[name] = counters.get(name, 0) + value
+
+    # Method to summarize the run: wall time and counters per stage, request metrics per endpoint family
+    def report(self):
+        with self._lock:
+            stages = {name: dict(stage) for name, stage in self.stages.items()}
+            for name, counters in self.counters.items():
+                stages.setdefault(name, {"seconds": 0.0, "calls": 0}).update(counters)
+
+            endpoints = {}
+            for endpoint, counters in self.endpoints.items():
+                endpoints[endpoint] = dict(counters, buckets=list(counters["buckets"]))
+                stage = stages.setdefault(ENDPOINT_STAGES.get(endpoint, endpoint), {"seconds": 0.0, "calls": 0})
+                for name in ("requests", "bytes", "retries", "errors", "throttled"):
+                    stage[name] = stage.get(name, 0) + counters[name]
+
+        for stage in stages.values():
+            stage["seconds"] = round(stage["seconds"], 4)
+
+        return {"run_id": self.run_id, "started_at": self.started_at, "stages": stages, "endpoints": endpoints}
+
+    # Method to hand the run's report to every exporter
+    def export(self):
+        report = self.report()
+        for exporter in self.exporters:
+            try:
+                exporter.export(report)
+            except OSError as e:
+                # Metrics never fail a run
+                print(f"Failed to export metrics with {exporter.__class__.__name__}:", str(e))
+
+# Helper to estimate a latency percentile (0-100) of an endpoint from its histogram, as the upper bound
+# of the bucket it falls in (the slowest request when it falls in the unbounded bucket)
+def bucket_percentile(counters, percentile):
+    buckets = counters["buckets"]
+    rank = sum(buckets) * percentile / 100
+    if not rank:
+        return None
+
+    seen = 0
+    for bound, count in zip(LATENCY_BUCKETS, buckets):
+        seen += count
+        if seen >= rank:
+            return bound
+    return round(counters["latency_max"], 4)
+
+# Class exporting the report as structured logs: one JSON line per stage and per endpoint family
+class LogExporter:
+    def observe_request(self, endpoint, seconds):
+        pass
+
+    def export(self, report):
+        for stage, counters in report["stages"].items():
+            print(json.dumps({"event": "stage", "run_id": report["run_id"], "stage": stage, **counters}))
+
+        for endpoint, counters in report["endpoints"].items():
+            print(json.dumps({
+                "event": "endpoint",
+                "run_id": report["run_id"],
+                "endpoint": endpoint,
+                **{name: value for name, value in counters.items() if name != "buckets"},
+                "latency_p50": bucket_percentile(counters, 50),
+                "latency_p95": bucket_percentile(counters, 95),
+                "latency_p99": bucket_percentile(counters, 99),
+            }))
+
+# Helper to escape a Prometheus label value
+def label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+# Class exporting the report in the Prometheus text format to a file, e.g. for the node_exporter
+# textfile collector or to push with `curl --data-binary @file` to a Pushgateway
+class PrometheusExporter:
+    def __init__(self, path, prefix=METRICS_PREFIX):
+        self.path = path
+        self.prefix = prefix
+
+    def observe_request(self, endpoint, seconds):
+        pass
+
+    # Method to render the report in the Prometheus text exposition format
+    def render(self, report):
+        p = self.prefix
+        lines = [
+            f"# TYPE {p}_stage_seconds gauge",
+            f"# TYPE {p}_stage_total gauge",
+            f"# TYPE {p}_request_duration_seconds histogram",
+            f"# TYPE {p}_requests_total counter",
+            f"# TYPE {p}_response_bytes_total counter",
+            f"# TYPE {p}_retries_total counter",
+            f"# TYPE {p}_errors_total counter",
+            f"# TYPE {p}_throttled_total counter",
+            f"# TYPE {p}_last_run_timestamp_seconds gauge",
+            f"{p}_last_run_timestamp_seconds {report['started_at']:.3f}",
+        ]
+
+        for stage, counters in sorted(report["stages"].items()):
+            lines.append(f'{p}_stage_seconds{{stage="{label(stage)}"}} {counters["seconds"]}')
+            for name, value in sorted(counters.items()):
+                if name != "seconds":
+                    lines.append(f'{p}_stage_total{{stage="{label(stage)}",counter="{label(name)}"}} {value}')
+
+        for endpoint, counters in sorted(report["endpoints"].items()):
+            endpoint_label = f'endpoint="{label(endpoint)}"'
+            cumulative = 0
+            for bound, count in zip(LATENCY_BUCKETS + ("+Inf",), counters["buckets"]):
+                cumulative += count
+                lines.append(f'{p}_request_duration_seconds_bucket{{{endpoint_label},le="{bound}"}} {cumulative}')
+            lines.append(f"{p}_request_duration_seconds_sum{{{endpoint_label}}} {counters['latency_sum']:.6f}")
+            lines.append(f"{p}_request_duration_seconds_count{{{endpoint_label}}} {counters['requests']}")
+            lines.append(f"{p}_requests_total{{{endpoint_label}}} {counters['requests']}")
+            lines.append(f"{p}_response_bytes_total{{{endpoint_label}}} {counters['bytes']}")
+            lines.append(f"{p}_retries_total{{{endpoint_label}}} {counters['retries']}")
+            lines.append(f"{p}_errors_total{{{endpoint_label}}} {counters['errors']}")
+            lines.append(f"{p}_throttled_total{{{endpoint_label}}} {counters['throttled']}")
+
+        return "\n".join(lines) + "\n"
+
+    def export(self, report):
+        # Write to a temporary name first, the collector never reads a half-written file
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            f.write(self.render(report))
+        os.replace(tmp_path, self.path)
+
+# Class sending the metrics to a StatsD server over UDP
+# Request latencies are sent as timers as they happen; stage times and counters at the end of the run.
+class StatsdExporter:
+    def __init__(self, host="localhost", port=DEFAULT_STATSD_PORT, prefix=METRICS_PREFIX):
+        self.address = (host, port)
+        self.prefix = prefix
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    # Method to send metric lines, UDP is fire-and-forget so a missing server never slows the run down
+    def send(self, *lines):
+        try:
+            self.socket.sendto("\n".join(lines).encode(), self.address)
+        except OSError:
+            pass
+
+    def observe_request(self, endpoint, seconds):
+        self.send(f"{self.prefix}.request.{endpoint}.latency:{seconds * 1000:.3f}|ms")
+
+    def export(self, report):
+        lines = []
+        for stage, counters in report["stages"].items():
+            lines.append(f"{self.prefix}.stage.{stage}.seconds:{counters['seconds'] * 1000:.3f}|ms")
+            for name, value in counters.items():
+                if name != "seconds":
+                    lines.append(f"{self.prefix}.stage.{stage}.{name}:{value}|c")
+
+        for endpoint, counters in report["endpoints"].items():
+            for name in ("requests", "bytes", "retries", "errors", "throttled"):
+                lines.append(f"{self.prefix}.request.{endpoint}.{name}:{counters[name]}|c")
+
+        # Keep the datagrams well under the usual 1432-byte MTU budget
+        for start in range(0, len(lines), 10):
+            self.send(*lines[start:start + 10])
+
+# Helper to build the metrics of a run from environment variables, NULL_METRICS when none is set:
+# SPOTIFY_METRICS=log prints the structured logs, SPOTIFY_METRICS_PROMETHEUS_FILE writes the Prometheus
+# text file and SPOTIFY_METRICS_STATSD (host, or host:port) sends the metrics to StatsD
+def metrics_from_env(run_id=None):
+    exporters = []
+    if os.getenv("SPOTIFY_METRICS", "").lower() == "log":
+        exporters.append(LogExporter())
+    if os.getenv("SPOTIFY_METRICS_PROMETHEUS_FILE"):
+        exporters.append(PrometheusExporter(os.getenv("SPOTIFY_METRICS_PROMETHEUS_FILE")))
+    if os.getenv("SPOTIFY_METRICS_STATSD"):
+        host, _, port = os.getenv("SPOTIFY_METRICS_STATSD").partition(":")
+        exporters.append(StatsdExporter(host or "localhost", int(port or DEFAULT_STATSD_PORT)))
+
+    if not exporters:
+        return NULL_METRICS
+    return RunMetrics(run_id, exporters)
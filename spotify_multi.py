@@ -0,0 +1,204 @@
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from spotify_token import SpotifyTokenManager, SpotifyConfig, HttpClient, RateLimiter, TokenBucket, DatabaseTokenStore
+from spotify_etl import SpotifyETL, DEFAULT_MAX_WORKERS
+from spotify_cache import TrackMetadataCache, DEFAULT_CACHE_PATH
+from spotify_state import ExtractionState, DEFAULT_STATE_PATH
+from spotify_archive import RawArchive, DEFAULT_ARCHIVE_PATH
+from spotify_metrics import metrics_from_env
+from spotify_parse import typed_frame
+from spotify_schema import RECENT_TRACKS_DTYPES
+
+# Default location of the accounts file
+DEFAULT_ACCOUNTS_PATH = "spotify_accounts.json"
+
+# Default request budget of each account, in requests per second and burst size
+DEFAULT_ACCOUNT_RATE = 5
+DEFAULT_ACCOUNT_BURST = 10
+
+# Spotify endpoints
+TOKEN_URL = "https://accounts.spotify.com/api/token"
+RECENT_TRACKS_URL = "https://api.spotify.com/v1/me/player/recently-played"
+TRACKS_DETAILS_URL = "https://api.spotify.com/v1/tracks"
+TRACKS_FEATURES_URL = "https://api.spotify.com/v1/audio-features"
+
+# Helper to read the accounts file: a JSON list of objects with user_id, client_id, client_secret and
+# refresh_token (and optionally access_token and token_expiration)
+def load_accounts(path=DEFAULT_ACCOUNTS_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+# Helper to get the `token_stores` of MultiUserETL keeping every account's token in one database table,
+# under its user_id. The table is created once here rather than by each account's store.
+def database_token_stores(engine):
+    DatabaseTokenStore(engine, create=False).create_table()
+    return lambda user_id: DatabaseTokenStore(engine, key=user_id, create=False)
+
+# Class to run the ETL for many Spotify accounts in one process
+# Every account gets its own token manager and request budget, but all of them share one pooled
+# HttpClient (with its per-endpoint rate limits) and one worker pool. Plays are tagged with the account's user_id, and the details and
+# features of tracks played by several listeners are fetched only once per run. Those catalog requests serve
+# every account, so they are only held by the per-endpoint limits, not by one account's request budget.
+class MultiUserETL:
+    def __init__(self, accounts, loader, state, max_workers=DEFAULT_MAX_WORKERS, cache=None,
+                 account_rate=DEFAULT_ACCOUNT_RATE, account_burst=DEFAULT_ACCOUNT_BURST, http_client=None,
+                 token_url=TOKEN_URL, recent_tracks_url=RECENT_TRACKS_URL, tracks_details_url=TRACKS_DETAILS_URL,
+                 tracks_features_url=TRACKS_FEATURES_URL, archive=None, metrics=None, aggregator=None, token_stores=None):
+        self.loader = loader
+        # Optional ListeningAggregator refreshing the listening summaries after the load
+        self.aggregator = aggregator
+        self.state = state
+        self.max_workers = max_workers
+        self.http_client = http_client or HttpClient(pool_size=max_workers, rate_limiter=RateLimiter(), metrics=metrics)
+
+        # One ETL object per account, all on the shared HTTP client
+        # `token_stores` builds the token store of an account from its user_id (e.g. a DatabaseTokenStore keyed by
+        # it), so a token refreshed in one run is reused by the next ones instead of refreshing every account
+        # against the token endpoint's request budget on every run
+        self.etls = []
+        for account in accounts:
+            config = SpotifyConfig(
+                account["client_id"],
+                account["client_secret"],
+                account["refresh_token"],
+                account.get("access_token"),
+                account.get("token_expiration"),
+                token_url,
+                token_store=token_stores(account["user_id"]) if token_stores is not None else None
+            )
+            self.etls.append(SpotifyETL(
+                SpotifyTokenManager(config, self.http_client),
+                recent_tracks_url=recent_tracks_url,
+                tracks_details_url=tracks_details_url,
+                tracks_features_url=tracks_features_url,
+                max_workers=max_workers,
+                http_client=self.http_client,
+                cache=cache,
+                user_id=account["user_id"],
+                account_limiter=TokenBucket(account_rate, account_burst),
+                archive=archive,
+                metrics=metrics
+            ))
+
+    # Method to build the ETL enriching the tracks of every account, with the token of one of them
+    # It goes through the shared HttpClient without the account's request budget (see __init__)
+    def catalog_etl(self, etl):
+        return SpotifyETL(
+            etl.token_manager,
+            recent_tracks_url=etl.recent_tracks_url,
+            tracks_details_url=etl.tracks_details_url,
+            tracks_features_url=etl.tracks_features_url,
+            max_workers=self.max_workers,
+            http_client=self.http_client,
+            cache=etl.cache,
+            user_id=etl.user_id,
+            archive=etl.archive,
+            metrics=etl.metrics,
+            artists_url=etl.artists_url,
+            albums_url=etl.albums_url
+        )
+
+    # Method to extract the new plays of one account, returns None if the extraction failed
+    def extract_account(self, etl):
+        tracks_df = etl.extract_recently_played_tracks(self.state.get_after(etl.cursor_key))
+        if tracks_df is not None and not tracks_df.empty:
+            etl.data_quality(tracks_df, 'recent_tracks')
+        return tracks_df
+
+    # Method to run the ETL for every account, returns the number of plays loaded per user_id
+    def run(self):
+        # Extract the accounts' plays concurrently; a failing account doesn't stop the others
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [(etl, executor.submit(self.extract_account, etl)) for etl in self.etls]
+
+        extracted = {}
+        for etl, future in futures:
+            try:
+                tracks_df = future.result()
+            except Exception as e:
+                print(f"Extraction failed for {etl.user_id}:", str(e))
+                continue
+
+            if tracks_df is None:
+                print(f"Extraction failed for {etl.user_id}.")
+            elif not tracks_df.empty:
+                extracted[etl] = tracks_df
+
+        if not extracted:
+            print("No new tracks played since the last run.")
+            return {}
+
+        # Every account has its own user_id category, cast the plays back to a single one
+        tracks_df = typed_frame(pd.concat(extracted.values(), ignore_index=True), RECENT_TRACKS_DTYPES)
+
+        # Enrich the distinct tracks of all accounts at once, with the first account's token
+        # A failed details extraction raises here, before any load, so no account's cursor moves
+        enrichment_etl = self.catalog_etl(next(iter(extracted)))
+        details_df, features_df = enrichment_etl.spotify_enrichment_etl(tracks_df)
+        dimensions = enrichment_etl.spotify_dimensions_etl(tracks_df)
+        enrichment_etl.data_quality(tracks_df, 'recent_tracks', references={"track_details": details_df})
+
+        # Load every account's plays in a single transaction, then move their cursors
+        self.loader.load(tracks_df, details_df, features_df, dimensions=dimensions,
+                         observed_at=enrichment_etl.observed_times(details_df))
+        if self.aggregator is not None:
+            self.aggregator.update(tracks_df)
+        for etl, account_df in extracted.items():
+            self.state.advance(account_df, etl.cursor_key)
+
+        return {etl.user_id: len(account_df) for etl, account_df in extracted.items()}
+
+def main():
+    # Only the command line run writes to the database, MultiUserETL gets its loader from the caller
+    from sqlalchemy import create_engine
+    from spotify_load import SpotifyLoader
+    from spotify_aggregate import ListeningAggregator
+
+    # Loading environment variables
+    load_dotenv()
+
+    # Stage timings and request metrics of the run, only recorded when an exporter is configured
+    metrics = metrics_from_env()
+
+    # Defining the connection to the database
+    engine = create_engine(os.getenv("POSTGRESQL_CONN"))
+    loader = SpotifyLoader(engine, metrics=metrics)
+    loader.create_tables()
+    aggregator = ListeningAggregator(engine, metrics=metrics)
+    aggregator.create_tables()
+
+    accounts = load_accounts(os.getenv("SPOTIFY_ACCOUNTS_PATH", DEFAULT_ACCOUNTS_PATH))
+    print(f"Started for {len(accounts)} account(s)")
+
+    archive = RawArchive(os.getenv("SPOTIFY_ARCHIVE_PATH", DEFAULT_ARCHIVE_PATH), os.getenv("SPOTIFY_ARCHIVE_FORMAT", "jsonl"))
+    etl = MultiUserETL(
+        accounts,
+        loader,
+        ExtractionState(os.getenv("SPOTIFY_STATE_PATH", DEFAULT_STATE_PATH)),
+        max_workers=int(os.getenv("SPOTIFY_MAX_WORKERS", DEFAULT_MAX_WORKERS)),
+        cache=TrackMetadataCache(os.getenv("SPOTIFY_CACHE_PATH", DEFAULT_CACHE_PATH)),
+        archive=archive,
+        metrics=metrics,
+        aggregator=aggregator,
+        # Each account's token is kept in the database, under its user_id. The writes are synchronous: an
+        # account refreshes its token about once an hour, and one background writer per account would cost a
+        # thread each.
+        token_stores=database_token_stores(engine)
+    )
+    try:
+        plays = etl.run()
+    finally:
+        archive.close()
+        metrics.export()
+
+    # Print the final message
+    if plays:
+        print(f"Database updated successfully! {sum(plays.values())} play(s) from {len(plays)} account(s).")
+
+if __name__ == "__main__":
+    main()
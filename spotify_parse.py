@@ -0,0 +1,250 @@
+import json
+from itertools import islice
+
+import numpy as np
+import pandas as pd
+
+from spotify_schema import (RECENT_TRACKS_DTYPES, TRACK_DETAILS_DTYPES, TRACK_FEATURES_DTYPES, ARTISTS_DTYPES, ALBUMS_DTYPES,
+                            TRACK_ARTISTS_DTYPES, TRACK_ALBUMS_DTYPES)
+
+# orjson is optional: when installed, responses are decoded with it instead of the standard library
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Helper to decode a JSON response body (bytes or str)
+def loads(content):
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+# Helper to cast a DataFrame, or a list of row dictionaries, to the given column types and order
+def typed_frame(rows, dtypes):
+    df = rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows, columns=list(dtypes))
+    return df[list(dtypes)].astype(dtypes)
+
+# Helper to build one typed DataFrame from the column arrays of several parsed batches
+def concat_columns(batches, dtypes):
+    if not batches:
+        return typed_frame([], dtypes)
+
+    columns = {column: np.concatenate([batch[column] for batch in batches]) for column in dtypes}
+    return typed_frame(pd.DataFrame(columns, copy=False), dtypes)
+
+# Helper to get the NumPy type of a parsed column: pandas-only types (categoricals, time zone aware
+# datetimes) are left to typed_frame
+def buffer_dtype(dtype):
+    if dtype is object or dtype == "category" or dtype.startswith("datetime64"):
+        return object
+    return dtype
+
+# Helper to get the UTC day of played_at values, as datetimes at midnight without time zone
+def played_day(played_at):
+    return played_at.dt.tz_convert("UTC").dt.tz_localize(None).dt.normalize()
+
+# Helper to turn Unix fetch times given as {id: seconds} (see TrackMetadataCache.fetched_times) into UTC
+# times indexed by ID, the observation times SpotifyLoader.load records changes at
+def fetch_times(times):
+    return pd.Series(pd.to_datetime(list(times.values()), unit="s", utc=True), index=list(times.keys()), dtype="datetime64[us, UTC]")
+
+# Class holding pre-sized column buffers that the parsers fill row by row
+# Filling a preallocated list slot is the cheapest store CPython offers. Each column is converted to a
+# NumPy array of its type once the batch is parsed; categorical and datetime columns stay objects until
+# the whole DataFrame is typed, so batches parsed separately can still be concatenated.
+class ColumnBuffers:
+    def __init__(self, dtypes, size):
+        self.dtypes = dtypes
+        self.columns = {column: [None] * size for column in dtypes}
+
+    # Method to convert the first `rows` filled rows into typed NumPy arrays
+    def arrays(self, rows):
+        return {
+            column: np.array(values[:rows], dtype=buffer_dtype(self.dtypes[column]))
+            for column, values in self.columns.items()
+        }
+
+    # Method to remove rows from the first `rows` filled rows, returns the new number of rows
+    def drop(self, positions, rows):
+        positions = set(positions)
+        for column, values in self.columns.items():
+            self.columns[column] = [value for i, value in enumerate(values[:rows]) if i not in positions]
+        return rows - len(positions)
+
+# Helper to parse the items of a recently played response into a DataFrame
+def parse_recently_played_items(items, user_id):
+    size = len(items)
+    buffers = ColumnBuffers({"track_id": object, "played_at": object}, size)
+    track_ids, played_at = buffers.columns.values()
+
+    for row, item in enumerate(items):
+        track_ids[row] = item["track"]["id"]
+        # Spotify sends UTC times ending with "Z", e.g. "2024-01-01T10:00:00.123Z", NumPy reads them without it
+        played_at[row] = item["played_at"].removesuffix("Z")
+
+    # The played_at strings are parsed once for the whole page and the day of each play is derived from them.
+    # A page is small, so its columns are built with their final types: casting them costs more than parsing it.
+    played_at = np.array(played_at, dtype="datetime64[ms]")
+    return pd.DataFrame({
+        "track_id": pd.Series(track_ids, dtype=object),
+        "played_at": pd.DatetimeIndex(played_at).tz_localize("UTC"),
+        "timestamp": played_at.astype("datetime64[D]").astype("datetime64[s]"),
+        "user_id": pd.Categorical.from_codes(np.zeros(size, dtype=np.int8), [user_id]),
+    }, columns=list(RECENT_TRACKS_DTYPES), copy=False)
+
+# Helper to parse the track objects of a /v1/tracks response, in request order
+# Returns the column arrays of the details (see concat_columns) and the IDs Spotify answered with null.
+# A malformed track raises.
+def parse_tracks(track_ids, tracks):
+    buffers = ColumnBuffers(TRACK_DETAILS_DTYPES, len(track_ids))
+    ids, names, artists, albums, release_dates, lengths, popularities, explicits, types = buffers.columns.values()
+    missing_ids = []
+    row = 0
+
+    for track_id, track in zip(track_ids, tracks):
+        if track is None:
+            missing_ids.append(track_id)
+            continue
+
+        album = track["album"]
+        ids[row] = track_id
+        names[row] = track["name"]
+        artists[row] = track["artists"][0]["name"]  # This is the first artist in the list
+        albums[row] = album["name"]
+        release_dates[row] = album["release_date"]
+        lengths[row] = track["duration_ms"]
+        popularities[row] = track["popularity"]
+        explicits[row] = track["explicit"]
+        types[row] = track["type"]
+        row += 1
+
+    return buffers.arrays(row), missing_ids
+
+# Types of the values a numeric column accepts, a null (None) or a string isn't one of them
+NUMBER_TYPES = {int, float}
+
+# Helper to parse the audio features objects of a /v1/audio-features response, in request order
+# Returns the column arrays of the features (see concat_columns) and the IDs without usable features
+# (null objects, missing fields, null or non-numeric values). The value types of each column are checked
+# before the buffers become arrays: NumPy would turn a null float field into NaN, and a numeric string
+# into a number, without an error.
+def parse_audio_features(track_ids, audio_features):
+    buffers = ColumnBuffers(TRACK_FEATURES_DTYPES, len(track_ids))
+    (ids, danceability, duration_ms, energy, acousticness, instrumentalness, key, liveness, loudness, mode,
+     speechiness, tempo, time_signature, valence) = buffers.columns.values()
+    missing_ids = []
+    row = 0
+
+    for track_id, features in zip(track_ids, audio_features):
+        if features is None:
+            missing_ids.append(track_id)
+            continue
+
+        # A failing row is overwritten by the next one, since `row` only moves once it is complete
+        try:
+            ids[row] = track_id
+            danceability[row] = features["danceability"]
+            duration_ms[row] = features["duration_ms"]
+            energy[row] = features["energy"]
+            acousticness[row] = features["acousticness"]
+            instrumentalness[row] = features["instrumentalness"]
+            key[row] = features["key"]
+            liveness[row] = features["liveness"]
+            loudness[row] = features["loudness"]
+            mode[row] = features["mode"]
+            speechiness[row] = features["speechiness"]
+            tempo[row] = features["tempo"]
+            time_signature[row] = features["time_signature"]
+            valence[row] = features["valence"]
+        except (KeyError, TypeError) as e:
+            print(f"Error while processing audio features of track {track_id}:", str(e))
+            missing_ids.append(track_id)
+            continue
+
+        row += 1
+
+    # The types of a whole column are collected at C speed; rows are only looked at when a column has a
+    # null or non-numeric value
+    numeric_columns = [buffers.columns[column] for column in TRACK_FEATURES_DTYPES if column != "track_id"]
+    if any(not set(map(type, islice(values, row))) <= NUMBER_TYPES for values in numeric_columns):
+        invalid = [i for i in range(row) if not all(type(values[i]) in NUMBER_TYPES for values in numeric_columns)]
+        for i in invalid:
+            print(f"Error while processing audio features of track {ids[i]}: null or non-numeric value")
+            missing_ids.append(ids[i])
+        row = buffers.drop(invalid, row)
+
+    return buffers.arrays(row), missing_ids
+
+# Helper to get the album and every credited artist of the track objects of a /v1/tracks response
+# Returns one {"track_id", "album_id", "artist_ids"} row per returned track, artists in credit order
+def parse_track_links(track_ids, tracks):
+    return [
+        {"track_id": track_id, "album_id": track["album"]["id"], "artist_ids": [artist["id"] for artist in track["artists"]]}
+        for track_id, track in zip(track_ids, tracks)
+        if track is not None
+    ]
+
+# Helper to build the track_artists and track_albums DataFrames of link rows (see parse_track_links)
+def link_frames(links):
+    track_artists = ColumnBuffers(TRACK_ARTISTS_DTYPES, sum(len(link["artist_ids"]) for link in links))
+    track_ids, artist_ids, positions = track_artists.columns.values()
+    row = 0
+    for link in links:
+        for position, artist_id in enumerate(link["artist_ids"]):
+            track_ids[row] = link["track_id"]
+            artist_ids[row] = artist_id
+            positions[row] = position
+            row += 1
+
+    track_albums = {
+        "track_id": np.array([link["track_id"] for link in links], dtype=object),
+        "album_id": np.array([link["album_id"] for link in links], dtype=object),
+    }
+
+    return concat_columns([track_artists.arrays(row)], TRACK_ARTISTS_DTYPES), concat_columns([track_albums], TRACK_ALBUMS_DTYPES)
+
+# Helper to parse the artist objects of a /v1/artists response, in request order
+# Returns the column arrays of the artists (see concat_columns) and the IDs Spotify answered with null
+def parse_artists(artist_ids, artists):
+    buffers = ColumnBuffers(ARTISTS_DTYPES, len(artist_ids))
+    ids, names, genres, popularities, followers = buffers.columns.values()
+    missing_ids = []
+    row = 0
+
+    for artist_id, artist in zip(artist_ids, artists):
+        if artist is None:
+            missing_ids.append(artist_id)
+            continue
+
+        ids[row] = artist_id
+        names[row] = artist["name"]
+        genres[row] = ", ".join(artist["genres"])
+        popularities[row] = artist["popularity"]
+        followers[row] = artist["followers"]["total"]
+        row += 1
+
+    return buffers.arrays(row), missing_ids
+
+# Helper to parse the album objects of a /v1/albums response, in request order
+# Returns the column arrays of the albums (see concat_columns) and the IDs Spotify answered with null
+def parse_albums(album_ids, albums):
+    buffers = ColumnBuffers(ALBUMS_DTYPES, len(album_ids))
+    ids, names, album_types, release_dates, total_tracks, labels, popularities = buffers.columns.values()
+    missing_ids = []
+    row = 0
+
+    for album_id, album in zip(album_ids, albums):
+        if album is None:
+            missing_ids.append(album_id)
+            continue
+
+        ids[row] = album_id
+        names[row] = album["name"]
+        album_types[row] = album["album_type"]
+        release_dates[row] = album["release_date"]
+        total_tracks[row] = album["total_tracks"]
+        labels[row] = album.get("label")
+        popularities[row] = album["popularity"]
+        row += 1
+
+    return buffers.arrays(row), missing_ids
@@ -0,0 +1,253 @@
+import logging
+
+import numpy as np
+import pandas as pd
+
+from spotify_schema import TABLES, ddl_columns
+
+# The outcome of checks that passed is logged rather than printed: the streaming run checks several tables
+# per page, and a line for each of them would bury the rest of the output
+logger = logging.getLogger(__name__)
+
+# Audio features Spotify reports as a confidence or measure between 0 and 1
+UNIT_INTERVAL = {"ge": 0, "le": 1}
+
+# Quality rules of each table
+# - key: columns that must be unique together (composite keys are lists of several columns)
+# - not_null: columns that can't contain nulls
+# - ranges: allowed values per column, as bounds among ge (>=), gt (>), le (<=) and lt (<)
+# - references: {column: (table, column)} values that must exist in another DataFrame
+# - warn: checks reported without failing the run
+# The column types and maximum string lengths are checked against the table DDL in spotify_schema.py.
+DEFAULT_RULES = {
+    "recent_tracks": {
+        "key": ["user_id", "played_at"],
+        "not_null": ["track_id", "played_at", "timestamp", "user_id"],
+        "ranges": {},
+        "references": {"track_id": ("track_details", "track_id")},
+        # Tracks the API didn't return have no details, that alone shouldn't fail the run
+        "warn": ["references"],
+    },
+    "track_details": {
+        "key": ["track_id"],
+        "not_null": ["track_id", "track_name", "artist_name", "album_name", "release_date", "length", "popularity", "explicit", "type"],
+        "ranges": {"length": {"gt": 0}, "popularity": {"ge": 0, "le": 100}},
+        "references": {},
+        "warn": [],
+    },
+    "track_features": {
+        "key": ["track_id"],
+        "not_null": ["track_id", "danceability", "duration_ms", "energy", "acousticness", "instrumentalness", "key",
+                     "liveness", "loudness", "mode", "speechiness", "tempo", "time_signature", "valence"],
+        "ranges": {
+            "danceability": UNIT_INTERVAL,
+            "energy": UNIT_INTERVAL,
+            "acousticness": UNIT_INTERVAL,
+            "instrumentalness": UNIT_INTERVAL,
+            "liveness": UNIT_INTERVAL,
+            "speechiness": UNIT_INTERVAL,
+            "valence": UNIT_INTERVAL,
+            "duration_ms": {"gt": 0},
+            "key": {"ge": -1, "le": 11},
+            "mode": {"ge": 0, "le": 1},
+            "tempo": {"gt": 0},
+            "time_signature": {"ge": 0, "le": 7},
+        },
+        "references": {},
+        "warn": [],
+    },
+    "artists": {
+        "key": ["artist_id"],
+        "not_null": ["artist_id", "artist_name", "genres", "popularity", "followers"],
+        "ranges": {"popularity": {"ge": 0, "le": 100}, "followers": {"ge": 0}},
+        "references": {},
+        "warn": [],
+    },
+    "albums": {
+        "key": ["album_id"],
+        "not_null": ["album_id", "album_name", "album_type", "release_date", "total_tracks", "popularity"],
+        "ranges": {"total_tracks": {"gt": 0}, "popularity": {"ge": 0, "le": 100}},
+        "references": {},
+        "warn": [],
+    },
+    "track_artists": {
+        "key": ["track_id", "artist_id"],
+        "not_null": ["track_id", "artist_id", "artist_position"],
+        "ranges": {"artist_position": {"ge": 0}},
+        "references": {"artist_id": ("artists", "artist_id")},
+        # Artists the API didn't return are still credited on the track
+        "warn": ["references"],
+    },
+    "track_albums": {
+        "key": ["track_id"],
+        "not_null": ["track_id", "album_id"],
+        "ranges": {},
+        "references": {"album_id": ("albums", "album_id")},
+        "warn": ["references"],
+    },
+}
+
+# Vectorized comparisons used by the range checks
+RANGE_OPERATORS = {
+    "ge": lambda values, bound: values >= bound,
+    "gt": lambda values, bound: values > bound,
+    "le": lambda values, bound: values <= bound,
+    "lt": lambda values, bound: values < bound,
+}
+
+# Class holding the outcome of the quality checks of one DataFrame
+# `failures` maps each failed check (e.g. "range:tempo") to the index labels of the offending rows
+class QualityReport:
+    def __init__(self, table_name, rows):
+        self.table_name = table_name
+        self.rows = rows
+        self.failures = {}
+        self.warnings = {}
+
+    # Method to record the rows selected by a boolean mask under a check name
+    def add(self, check, mask, index, warn=False):
+        if mask.any():
+            target = self.warnings if warn else self.failures
+            target[check] = index[np.asarray(mask)]
+
+    @property
+    def passed(self):
+        return not self.failures
+
+    # Method to describe the outcome of the checks in one line
+    def status(self):
+        outcome = "passed" if self.passed else f"failed {len(self.failures)} check(s)"
+        warnings = f", {len(self.warnings)} warning(s)" if self.warnings else ""
+        return f"Data quality checks {outcome} for {self.table_name} ({self.rows} row(s){warnings})"
+
+    # Method to describe the failed checks with the number and first few indices of offending rows
+    def summary(self, sample=5):
+        lines = []
+        for kind, checks in (("FAILED", self.failures), ("WARNING", self.warnings)):
+            for check, rows in checks.items():
+                shown = ", ".join(str(row) for row in rows[:sample])
+                more = ", ..." if len(rows) > sample else ""
+                lines.append(f"{kind} {self.table_name} {check}: {len(rows)} row(s) [{shown}{more}]")
+        return "\n".join(lines)
+
+# Exception raised when a DataFrame fails its quality checks, carrying the full report
+class DataQualityError(Exception):
+    def __init__(self, report):
+        super().__init__(f"Data quality checks failed for {report.table_name}:\n{report.summary()}")
+        self.report = report
+
+# Class to run the quality rules of a table on a DataFrame with vectorized pandas/NumPy operations
+class DataQualityChecker:
+    def __init__(self, rules=None):
+        self.rules = DEFAULT_RULES if rules is None else rules
+        self.schemas = {table_name: ddl_columns(table["ddl"]) for table_name, table in TABLES.items()}
+
+    # Method to check a DataFrame against the rules of a table
+    # `references` maps table names to the DataFrames used by the referential checks
+    def check(self, df, table_name, references=None):
+        rules = self.rules[table_name]
+        warn = set(rules.get("warn", []))
+        report = QualityReport(table_name, len(df))
+        index = df.index
+
+        # Keys, single or composite
+        key = [column for column in rules.get("key", []) if column in df.columns]
+        if key:
+            report.add("key:" + ",".join(key), df.duplicated(subset=key, keep=False), index, "key" in warn)
+
+        # Nulls
+        not_null = [column for column in rules.get("not_null", []) if column in df.columns]
+        if not_null:
+            nulls = df[not_null].isna()
+            for column in nulls.columns[nulls.any().to_numpy()]:
+                report.add(f"not_null:{column}", nulls[column], index, "not_null" in warn)
+
+        # Column types and lengths from the DDL
+        for column, (column_type, max_length) in self.schemas.get(table_name, {}).items():
+            if column not in df.columns:
+                continue
+            report.add(f"type:{column}", self.type_mismatches(df[column], column_type, max_length), index, "type" in warn)
+
+        # Ranges
+        for column, bounds in rules.get("ranges", {}).items():
+            if column not in df.columns:
+                continue
+            values = pd.to_numeric(df[column], errors="coerce")
+            skipped = values.isna()  # nulls and non-numeric values are reported by the other checks
+            in_range = pd.Series(True, index=index)
+            for operator, bound in bounds.items():
+                in_range &= RANGE_OPERATORS[operator](values, bound)
+            report.add(f"range:{column}", ~(skipped | in_range), index, "ranges" in warn)
+
+        # References to other DataFrames
+        for column, (other_table, other_column) in rules.get("references", {}).items():
+            other_df = (references or {}).get(other_table)
+            if other_df is None or column not in df.columns:
+                continue
+            report.add(f"reference:{column}->{other_table}.{other_column}", ~df[column].isin(other_df[other_column]), index, "references" in warn)
+
+        return report
+
+    # Method to check a DataFrame about to be loaded, raising a DataQualityError when a check fails
+    # A missing (None) DataFrame always raises, as an empty one does unless `allow_empty` is set, so a
+    # failed extraction never reaches the load and the cursor move after it.
+    def validate(self, df, table_name, references=None, allow_empty=False):
+        if df is None:
+            raise Exception(f"Data quality checks failed for {table_name}: no DataFrame was extracted")
+        if df.empty:
+            if not allow_empty:
+                raise Exception(f"Data quality checks failed for {table_name}: the DataFrame is empty")
+            logger.info("Data quality checks skipped for %s: the DataFrame is empty", table_name)
+            return None
+
+        report = self.check(df, table_name, references)
+
+        if report.warnings:
+            print(report.summary())
+
+        if not report.passed:
+            raise DataQualityError(report)
+
+        logger.info(report.status())
+
+        return report
+
+    # Method to find the values of a column that don't fit its DDL type
+    def type_mismatches(self, values, column_type, max_length):
+        present = values.notna()
+
+        if column_type == "VARCHAR":
+            is_text = (pd.api.types.is_object_dtype(values) or pd.api.types.is_string_dtype(values)
+                       or isinstance(values.dtype, pd.CategoricalDtype))
+            lengths = values.str.len() if is_text else pd.Series(np.nan, index=values.index)
+            mismatch = present & lengths.isna()
+            if max_length is not None:
+                mismatch |= lengths > max_length
+            return mismatch
+
+        if column_type == "BOOLEAN":
+            if pd.api.types.is_bool_dtype(values):
+                return pd.Series(False, index=values.index)
+            return present & ~values.isin([True, False])
+
+        # Times must be datetimes: time zone aware for TIMESTAMPTZ, and at midnight without one for DATE
+        if column_type == "TIMESTAMPTZ":
+            if isinstance(values.dtype, pd.DatetimeTZDtype):
+                return pd.Series(False, index=values.index)
+            return present
+        if column_type == "DATE":
+            if pd.api.types.is_datetime64_dtype(values) and not isinstance(values.dtype, pd.DatetimeTZDtype):
+                return present & (values.dt.normalize() != values)
+            return present
+
+        numbers = pd.to_numeric(values, errors="coerce")
+        mismatch = present & numbers.isna()
+
+        # Booleans are numbers to NumPy, but not to the database
+        if pd.api.types.is_bool_dtype(values):
+            mismatch = present
+
+        if column_type in ("INTEGER", "BIGINT") and not pd.api.types.is_integer_dtype(values):
+            mismatch |= present & numbers.notna() & (numbers % 1 != 0)
+
+        return mismatch
@@ -0,0 +1,237 @@
+# Schema of the ETL tables, shared by the parsers (DataFrame column types), the quality checks
+# (DDL column types) and the loader (DDL, indexes and the SQLAlchemy tables binding the values)
+import functools
+import re
+
+# Column types of the ETL DataFrames
+# Times are datetime64: played_at in UTC with millisecond precision and timestamp as the UTC day of
+# the play (midnight, without time zone), 8 bytes each instead of a Python string. Numbers use the
+# smallest type that holds Spotify's ranges (popularity 0-100, key -1-11), audio features fit in 32-bit
+# floats, and strings that repeat across rows (listeners, artist and album names) are categoricals.
+# Object columns hold plain Python strings.
+RECENT_TRACKS_DTYPES = {
+    "track_id": object,
+    "played_at": "datetime64[ms, UTC]",
+    "timestamp": "datetime64[s]",
+    "user_id": "category",
+}
+
+TRACK_DETAILS_DTYPES = {
+    "track_id": object,
+    "track_name": object,
+    "artist_name": "category",
+    "album_name": "category",
+    "release_date": object,
+    "length": "int32",
+    "popularity": "int8",
+    "explicit": "bool",
+    "type": "category",
+}
+
+TRACK_FEATURES_DTYPES = {
+    "track_id": object,
+    "danceability": "float32",
+    "duration_ms": "int32",
+    "energy": "float32",
+    "acousticness": "float32",
+    "instrumentalness": "float32",
+    "key": "int8",
+    "liveness": "float32",
+    "loudness": "float32",
+    "mode": "int8",
+    "speechiness": "float32",
+    "tempo": "float32",
+    "time_signature": "int8",
+    "valence": "float32",
+}
+
+ARTISTS_DTYPES = {
+    "artist_id": object,
+    "artist_name": object,
+    "genres": object,
+    "popularity": "int8",
+    "followers": "int32",
+}
+
+ALBUMS_DTYPES = {
+    "album_id": object,
+    "album_name": object,
+    "album_type": "category",
+    "release_date": object,
+    "total_tracks": "int16",
+    "label": object,
+    "popularity": "int8",
+}
+
+TRACK_ARTISTS_DTYPES = {
+    "track_id": object,
+    "artist_id": object,
+    "artist_position": "int16",
+}
+
+TRACK_ALBUMS_DTYPES = {
+    "track_id": object,
+    "album_id": object,
+}
+
+# DDL of the tables loaded by the ETL
+# played_at is a TIMESTAMPTZ and timestamp (the UTC day of the play) a DATE. SQLite has no such types:
+# there the loader stores them as sortable text, "YYYY-MM-DD HH:MM:SS.ffffff" (UTC) and "YYYY-MM-DD".
+RECENT_TRACKS_DDL = """
+    CREATE TABLE IF NOT EXISTS recent_tracks(
+    user_id VARCHAR(200),
+    played_at TIMESTAMPTZ,
+    track_id VARCHAR(200),
+    timestamp DATE,
+    PRIMARY KEY (user_id, played_at)
+)
+"""
+
+TRACK_DETAILS_DDL = """
+    CREATE TABLE IF NOT EXISTS track_details(
+    track_id VARCHAR(200) PRIMARY KEY,
+    track_name VARCHAR(200),
+    artist_name VARCHAR(200),
+    album_name VARCHAR(200),
+    release_date VARCHAR(200),
+    length INTEGER,
+    popularity INTEGER,
+    explicit BOOLEAN,
+    type VARCHAR(50)
+)
+"""
+
+TRACK_FEATURES_DDL = """
+    CREATE TABLE IF NOT EXISTS track_features(
+    track_id VARCHAR(200) PRIMARY KEY,
+    danceability FLOAT,
+    duration_ms INTEGER,
+    energy FLOAT,
+    acousticness FLOAT,
+    instrumentalness FLOAT,
+    key INTEGER,
+    liveness FLOAT,
+    loudness FLOAT,
+    mode INTEGER,
+    speechiness FLOAT,
+    tempo FLOAT,
+    time_signature INTEGER,
+    valence FLOAT
+)
+"""
+
+# Artist and album dimensions, with the bridge tables linking them to tracks
+ARTISTS_DDL = """
+    CREATE TABLE IF NOT EXISTS artists(
+    artist_id VARCHAR(200) PRIMARY KEY,
+    artist_name VARCHAR(200),
+    genres VARCHAR(1000),
+    popularity INTEGER,
+    followers INTEGER
+)
+"""
+
+ALBUMS_DDL = """
+    CREATE TABLE IF NOT EXISTS albums(
+    album_id VARCHAR(200) PRIMARY KEY,
+    album_name VARCHAR(200),
+    album_type VARCHAR(50),
+    release_date VARCHAR(200),
+    total_tracks INTEGER,
+    label VARCHAR(200),
+    popularity INTEGER
+)
+"""
+
+TRACK_ARTISTS_DDL = """
+    CREATE TABLE IF NOT EXISTS track_artists(
+    track_id VARCHAR(200),
+    artist_id VARCHAR(200),
+    artist_position INTEGER,
+    PRIMARY KEY (track_id, artist_id)
+)
+"""
+
+TRACK_ALBUMS_DDL = """
+    CREATE TABLE IF NOT EXISTS track_albums(
+    track_id VARCHAR(200) PRIMARY KEY,
+    album_id VARCHAR(200)
+)
+"""
+
+# Popularity of each track over time, one row per change (see SpotifyLoader.record_changes)
+# A value holds from its valid_from until the next row of the track; fingerprint is the hash of the value.
+TRACK_POPULARITY_HISTORY_DDL = """
+    CREATE TABLE IF NOT EXISTS track_popularity_history(
+    track_id VARCHAR(200),
+    valid_from TIMESTAMPTZ,
+    popularity INTEGER,
+    fingerprint BIGINT,
+    PRIMARY KEY (track_id, valid_from)
+)
+"""
+
+# Secondary indexes of the tables. The primary key of recent_tracks already serves one listener's time
+# ranges; the played_at index serves time ranges over every listener, and the artist_id index the
+# tracks of an artist.
+RECENT_TRACKS_INDEXES = ["CREATE INDEX IF NOT EXISTS recent_tracks_played_at ON recent_tracks (played_at)"]
+
+TRACK_ARTISTS_INDEXES = ["CREATE INDEX IF NOT EXISTS track_artists_artist_id ON track_artists (artist_id)"]
+
+# Primary key of each table and whether an existing row is updated (True) or kept as is (False)
+# Plays and audio features never change, track details do (e.g. popularity), and so do artists and albums
+TABLES = {
+    "recent_tracks": {"ddl": RECENT_TRACKS_DDL, "key": ["user_id", "played_at"], "update": False, "indexes": RECENT_TRACKS_INDEXES},
+    "track_details": {"ddl": TRACK_DETAILS_DDL, "key": ["track_id"], "update": True},
+    "track_features": {"ddl": TRACK_FEATURES_DDL, "key": ["track_id"], "update": False},
+    "artists": {"ddl": ARTISTS_DDL, "key": ["artist_id"], "update": True},
+    "albums": {"ddl": ALBUMS_DDL, "key": ["album_id"], "update": True},
+    "track_artists": {"ddl": TRACK_ARTISTS_DDL, "key": ["track_id", "artist_id"], "update": False, "indexes": TRACK_ARTISTS_INDEXES},
+    "track_albums": {"ddl": TRACK_ALBUMS_DDL, "key": ["track_id"], "update": True},
+    "track_popularity_history": {"ddl": TRACK_POPULARITY_HISTORY_DDL, "key": ["track_id", "valid_from"], "update": False},
+}
+
+# Columns whose changes are kept in a history table: the table their values are loaded into, its key,
+# and the tracked columns with the type they are hashed as (so a change of DataFrame type isn't a change)
+HISTORIES = {
+    "track_popularity_history": {"source": "track_details", "key": "track_id", "columns": {"popularity": "int64"}},
+}
+
+# Helper to get the SQLAlchemy type of each DDL column type
+# SQLAlchemy is imported on first use: the parsers and quality checks read this module without it.
+@functools.cache
+def sql_types():
+    from sqlalchemy import BigInteger, Boolean, Date, DateTime, Float, Integer, String
+
+    return {
+        "VARCHAR": String,
+        "INTEGER": Integer,
+        "BIGINT": BigInteger,
+        "FLOAT": Float,
+        "BOOLEAN": Boolean,
+        "TIMESTAMPTZ": lambda: DateTime(timezone=True),
+        "DATE": Date,
+    }
+
+# Helper to read the column types of a CREATE TABLE statement, as {column: (type, max_length)}
+def ddl_columns(ddl):
+    columns = {}
+    for name, column_type, length in re.findall(r"^\s*(\w+)\s+(VARCHAR|INTEGER|BIGINT|FLOAT|BOOLEAN|TIMESTAMPTZ|DATE)\b(?:\((\d+)\))?", ddl, re.M):
+        columns[name] = (column_type, int(length) if length else None)
+    return columns
+
+# Helper to get the SQLAlchemy table of a CREATE TABLE statement, built from the DDL instead of reflected
+# from the database, so values are bound with the same types on every database (SQLite would reflect
+# TIMESTAMPTZ as NUMERIC)
+@functools.cache
+def sql_table(ddl):
+    from sqlalchemy import Column, MetaData, Table
+
+    name = re.search(r"CREATE TABLE IF NOT EXISTS (\w+)", ddl).group(1)
+    types = sql_types()
+    columns = [
+        Column(column, types[column_type](length) if length else types[column_type]())
+        for column, (column_type, length) in ddl_columns(ddl).items()
+    ]
+    return Table(name, MetaData(), *columns)
+
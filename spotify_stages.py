@@ -0,0 +1,33 @@
+# Registry of the pipeline stages run by the command line (spotify_cli.py) and the Airflow DAG
+# A stage is named by "module:function" and its module is only imported when the stage runs, so listing,
+# skipping or swapping stages doesn't import pandas, SQLAlchemy or the Spotify client.
+import importlib
+
+# Stages of a run, in order: the function running each one and the arguments it takes, among the run's ID
+# (which names its staging folder, see spotify_tasks.py) and the database engine
+STAGES = {
+    "create_tables": {"target": "spotify_tasks:create_tables_task", "args": ["engine"]},
+    "extract": {"target": "spotify_tasks:extract_task", "args": ["run_id"]},
+    "details": {"target": "spotify_tasks:details_task", "args": ["run_id"]},
+    "features": {"target": "spotify_tasks:features_task", "args": ["run_id"]},
+    "dimensions": {"target": "spotify_tasks:dimensions_task", "args": ["run_id"]},
+    "load": {"target": "spotify_tasks:load_task", "args": ["run_id", "engine"]},
+}
+
+# Helper to swap the function of a stage, e.g. register_stage("features", "my_stages:features_from_cache"),
+# or to add a stage at the end of the run
+def register_stage(name, target, args=None):
+    stage = STAGES.setdefault(name, {"args": ["run_id"]})
+    stage["target"] = target
+    if args is not None:
+        stage["args"] = list(args)
+
+# Helper to import the function of a stage
+def stage_function(name):
+    module_name, _, function_name = STAGES[name]["target"].partition(":")
+    return getattr(importlib.import_module(module_name), function_name)
+
+# Helper to run one stage, `engine` is only needed by the stages writing to the database
+def run_stage(name, run_id=None, engine=None):
+    values = {"run_id": run_id, "engine": engine}
+    return stage_function(name)(*[values[arg] for arg in STAGES[name]["args"]])
@@ -0,0 +1,85 @@
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+
+import pandas as pd
+
+# Default location of the extraction state file
+DEFAULT_STATE_PATH = "spotify_state.json"
+
+# How far back to look for plays when no cursor has been stored yet
+DEFAULT_LOOKBACK = timedelta(days=1)
+
+# Class to persist the high-water mark of the recently played extraction in a JSON state file
+# The cursor is the played_at of the latest play that was loaded successfully; the next run asks
+# Spotify only for plays after it. Each cursor is stored under a key so several streams can share a file.
+class ExtractionState:
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+
+    # Method to read the whole state file
+    def read(self):
+        if not os.path.exists(self.path):
+            return {}
+
+        with open(self.path) as f:
+            return json.load(f)
+
+    # Method to write the whole state file atomically, so a crash never leaves a truncated file
+    def write(self, state):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    # Method to get the stored cursor, as a dictionary with the played_at and its Unix timestamp in milliseconds
+    def get_cursor(self, key="recently_played"):
+        with self._lock:
+            return self.read().get(key)
+
+    # Method to get the "after" parameter (Unix timestamp in milliseconds) for the next extraction
+    def get_after(self, key="recently_played", lookback=DEFAULT_LOOKBACK):
+        cursor = self.get_cursor(key)
+        if cursor:
+            return cursor["after"]
+
+        # No cursor yet: fall back to the fixed lookback window
+        return int((datetime.now() - lookback).timestamp()) * 1000
+
+    # Method to move the cursor to the latest play of a successfully loaded DataFrame
+    # Call it only after the load succeeded, so a failed run is retried from the same point
+    def advance(self, tracks_df, key="recently_played"):
+        if tracks_df is None or tracks_df.empty:
+            return self.get_cursor(key)
+
+        latest = pd.to_datetime(tracks_df["played_at"], utc=True, format="ISO8601").max()
+        after = int(latest.value // 1_000_000)
+
+        with self._lock:
+            state = self.read()
+
+            # Never move the cursor backwards
+            current = state.get(key)
+            if current and current["after"] >= after:
+                return current
+
+            state[key] = {"played_at": latest.isoformat(), "after": after}
+            self.write(state)
+
+        print(f"Extraction cursor advanced to {latest.isoformat()}")
+
+        return state[key]
+
+    # Method to get the finished partitions of a backfill, as {partition: report}
+    def get_partitions(self, key="backfill"):
+        with self._lock:
+            return self.read().get(key, {})
+
+    # Method to checkpoint a finished backfill partition with its report (plays, timings)
+    def complete_partition(self, partition, report, key="backfill"):
+        with self._lock:
+            state = self.read()
+            state.setdefault(key, {})[partition] = report
+            self.write(state)
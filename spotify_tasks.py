@@ -0,0 +1,238 @@
+import os
+import re
+import shutil
+
+import pandas as pd
+from dotenv import load_dotenv
+
+from spotify_token import (SpotifyTokenManager, SpotifyConfig, HttpClient, RateLimiter, AsyncTokenStore, EnvFileTokenStore,
+                           AirflowVariableTokenStore)
+from spotify_etl import SpotifyETL, DEFAULT_MAX_WORKERS, DEFAULT_USER_ID, cursor_key
+from spotify_quality import DataQualityChecker
+from spotify_parse import fetch_times
+from spotify_cache import TrackMetadataCache, DEFAULT_CACHE_PATH
+from spotify_state import ExtractionState, DEFAULT_STATE_PATH
+from spotify_archive import RawArchive, DEFAULT_ARCHIVE_PATH
+from spotify_metrics import metrics_from_env
+
+# Default folder of the files handed from one task to the next, one subfolder per DAG run
+DEFAULT_STAGING_PATH = "spotify_staging"
+
+# Spotify endpoints, SPOTIFY_API_URL and SPOTIFY_TOKEN_URL point the tasks to a stub API instead
+SPOTIFY_API_URL = "https://api.spotify.com/v1"
+SPOTIFY_TOKEN_URL = "https://accounts.spotify.com/api/token"
+
+# Intermediate DataFrames are staged as Parquet when pyarrow is installed, as pickles otherwise.
+# Both keep the column types (categoricals, int32, float32) from one task to the next.
+try:
+    import pyarrow  # noqa: F401
+    STAGING_FORMAT = "parquet"
+except ImportError:
+    STAGING_FORMAT = "pickle"
+
+# Helper to get the staging folder of a run
+def staging_dir(run_id):
+    return os.path.join(os.getenv("SPOTIFY_STAGING_PATH", DEFAULT_STAGING_PATH), re.sub(r"[^\w.-]", "_", run_id))
+
+# Helper to write a DataFrame to the staging folder of a run
+def write_stage(df, run_id, name):
+    folder = staging_dir(run_id)
+    os.makedirs(folder, exist_ok=True)
+    path = os.path.join(folder, f"{name}.{STAGING_FORMAT}")
+
+    # Write to a temporary name first, a retried task never reads a half-written file
+    tmp_path = f"{path}.tmp"
+    if STAGING_FORMAT == "parquet":
+        df.to_parquet(tmp_path, index=False)
+    else:
+        df.to_pickle(tmp_path)
+    os.replace(tmp_path, path)
+
+    return path
+
+# Helper to read a DataFrame from the staging folder of a run, returns None if the stage wasn't written
+def read_stage(run_id, name):
+    path = os.path.join(staging_dir(run_id), f"{name}.{STAGING_FORMAT}")
+    if not os.path.exists(path):
+        return None
+
+    if STAGING_FORMAT == "parquet":
+        return pd.read_parquet(path)
+    return pd.read_pickle(path)
+
+# Helper to check whether the tasks run under Airflow, which exports AIRFLOW_CTX_DAG_ID to its tasks
+def under_airflow():
+    return bool(os.getenv("AIRFLOW_CTX_DAG_ID"))
+
+# Helper to get the token store of the tasks
+# Under Airflow the details and features tasks run at the same time in separate processes, and both rewriting
+# the .env file would race: the token goes to Airflow Variables.
+def task_token_store():
+    if under_airflow():
+        return AsyncTokenStore(AirflowVariableTokenStore())
+    return AsyncTokenStore(EnvFileTokenStore())
+
+# Helper to build the SpotifyETL object used by a task, from environment variables
+def build_etl(run_id):
+    load_dotenv()
+
+    # Every task exports its own metrics, tagged with the DAG run
+    metrics = metrics_from_env(run_id)
+
+    api_url = os.getenv("SPOTIFY_API_URL", SPOTIFY_API_URL)
+    config = SpotifyConfig(
+        os.getenv("SPOTIFY_CLIENT_ID"),
+        os.getenv("SPOTIFY_CLIENT_SECRET"),
+        os.getenv("SPOTIFY_REFRESH_TOKEN"),
+        os.getenv("SPOTIFY_ACCESS_TOKEN"),
+        os.getenv("SPOTIFY_TOKEN_EXPIRATION"),
+        os.getenv("SPOTIFY_TOKEN_URL", SPOTIFY_TOKEN_URL),
+        token_store=task_token_store(),
+        # The Variables hold the token refreshed by the previous tasks, the environment a stale one
+        prefer_stored_token=under_airflow()
+    )
+    http_client = HttpClient(pool_size=DEFAULT_MAX_WORKERS, rate_limiter=RateLimiter(), metrics=metrics)
+
+    return SpotifyETL(
+        SpotifyTokenManager(config, http_client),
+        recent_tracks_url=f"{api_url}/me/player/recently-played",
+        tracks_details_url=f"{api_url}/tracks",
+        tracks_features_url=f"{api_url}/audio-features",
+        http_client=http_client,
+        cache=TrackMetadataCache(os.getenv("SPOTIFY_CACHE_PATH", DEFAULT_CACHE_PATH)),
+        archive=RawArchive(os.getenv("SPOTIFY_ARCHIVE_PATH", DEFAULT_ARCHIVE_PATH), os.getenv("SPOTIFY_ARCHIVE_FORMAT", "jsonl")),
+        metrics=metrics
+    )
+
+# Helper to close the archive of a task's ETL, wait for its token to be saved, export its metrics and print the
+# time it spent waiting for the rate limiter
+def finish_etl(etl):
+    etl.archive.close()
+    etl.token_manager.config.token_store.flush()
+    etl.metrics.export()
+
+    for family, counters in etl.http_client.rate_limiter.stats().items():
+        if counters["waited"] or counters["throttled"]:
+            print(f"Rate limited {family}: waited {counters['waited']:.2f}s over {counters['requests']} request(s), {counters['throttled']} throttled response(s)")
+
+# Helper to get the extraction state shared by the extract and load tasks
+def extraction_state():
+    return ExtractionState(os.getenv("SPOTIFY_STATE_PATH", DEFAULT_STATE_PATH))
+
+# Task to create the tables if they don't exist yet
+# The loader and the summaries are imported by the tasks writing to the database only, the extraction
+# tasks don't import SQLAlchemy
+def create_tables_task(engine):
+    from spotify_load import SpotifyLoader
+    from spotify_aggregate import ListeningAggregator
+
+    SpotifyLoader(engine).create_tables()
+    ListeningAggregator(engine).create_tables()
+
+# Task to extract the tracks played since the last successful load into the run's staging folder
+def extract_task(run_id):
+    etl = build_etl(run_id)
+    try:
+        tracks_df = etl.spotify_tracks_etl(extraction_state().get_after(etl.cursor_key))
+    finally:
+        finish_etl(etl)
+
+    if tracks_df is None:
+        raise Exception("Recently played tracks extraction failed")
+
+    write_stage(tracks_df, run_id, "recent_tracks")
+
+# Task to extract the details of the staged tracks
+def details_task(run_id):
+    tracks_df = read_stage(run_id, "recent_tracks")
+    if tracks_df.empty:
+        print("No new tracks played since the last run.")
+        return
+
+    etl = build_etl(run_id)
+    try:
+        details_df = etl.spotify_details_etl(tracks_df)
+    finally:
+        finish_etl(etl)
+
+    write_stage(details_df, run_id, "track_details")
+
+# Task to extract the audio features of the staged tracks
+def features_task(run_id):
+    tracks_df = read_stage(run_id, "recent_tracks")
+    if tracks_df.empty:
+        print("No new tracks played since the last run.")
+        return
+
+    etl = build_etl(run_id)
+    try:
+        features_df = etl.spotify_features_etl(tracks_df)
+    finally:
+        finish_etl(etl)
+
+    write_stage(features_df, run_id, "track_features")
+
+# Tables written by the dimensions task
+DIMENSION_TABLES = ["artists", "albums", "track_artists", "track_albums"]
+
+# Task to extract the artist and album dimensions of the staged tracks
+# Runs after the details task, whose requests already cached the artist and album IDs of the tracks.
+# A failed extraction only skips the dimensions of this run, the plays are still loaded.
+def dimensions_task(run_id):
+    tracks_df = read_stage(run_id, "recent_tracks")
+    if tracks_df.empty:
+        print("No new tracks played since the last run.")
+        return
+
+    etl = build_etl(run_id)
+    try:
+        dimensions = etl.spotify_dimensions_etl(tracks_df)
+    finally:
+        finish_etl(etl)
+
+    if dimensions is not None:
+        for table_name in DIMENSION_TABLES:
+            write_stage(dimensions[table_name], run_id, table_name)
+
+# Task to load the staged DataFrames in one transaction, refresh the listening summaries of their days,
+# move the extraction cursor and clean the staging folder
+def load_task(run_id, engine):
+    from spotify_load import SpotifyLoader
+    from spotify_aggregate import ListeningAggregator
+
+    tracks_df = read_stage(run_id, "recent_tracks")
+
+    if not tracks_df.empty:
+        # Without the tracks' details or features (their task failed or was skipped) the plays aren't
+        # loaded, and the cursor stays before them
+        details_df = read_stage(run_id, "track_details")
+        if details_df is None:
+            raise Exception(f"No track details staged for run {run_id}")
+        features_df = read_stage(run_id, "track_features")
+        if features_df is None:
+            raise Exception(f"No track features staged for run {run_id}")
+        dimensions = {table_name: read_stage(run_id, table_name) for table_name in DIMENSION_TABLES}
+        if any(df is None for df in dimensions.values()):
+            dimensions = None
+
+        # The details task cached the details it fetched, with their fetch times
+        cache = TrackMetadataCache(os.getenv("SPOTIFY_CACHE_PATH", DEFAULT_CACHE_PATH))
+        try:
+            observed_at = fetch_times(cache.fetched_times("details", details_df["track_id"]))
+        finally:
+            cache.close()
+
+        metrics = metrics_from_env(run_id)
+        try:
+            DataQualityChecker().validate(tracks_df, 'recent_tracks', references={"track_details": details_df})
+            SpotifyLoader(engine, metrics=metrics).load(tracks_df, details_df, features_df, bulk=True, dimensions=dimensions,
+                                                        observed_at=observed_at)
+            ListeningAggregator(engine, metrics=metrics).update(tracks_df)
+        finally:
+            metrics.export()
+        extraction_state().advance(tracks_df, cursor_key(DEFAULT_USER_ID))
+        print("Database updated successfully!")
+    else:
+        print("No new tracks played since the last run.")
+
+    shutil.rmtree(staging_dir(run_id), ignore_errors=True)
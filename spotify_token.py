@@ -1,14 +1,67 @@
 import requests
+from requests.adapters import HTTPAdapter
 import os
-from dotenv import load_dotenv, set_key
+from dotenv import load_dotenv, set_key, dotenv_values
+import atexit
 import base64
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlparse
+
+from spotify_metrics import NULL_METRICS
+
+# Default settings of the HttpClient connection pool and retry policy
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 30
+DEFAULT_MAX_RETRIES = 5
+DEFAULT_BACKOFF_FACTOR = 0.5
+DEFAULT_MAX_BACKOFF = 60
+
+# Seconds before expiry at which the access token is proactively refreshed
+DEFAULT_REFRESH_MARGIN = 60
+
+# Status codes worth retrying: throttling and transient server errors
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+
+# Default request budget of each Spotify endpoint family, as (requests per second, burst size)
+# Spotify doesn't publish its limits (they apply over a rolling 30 second window), so these are
+# conservative starting points that the RateLimiter lowers when 429 responses show up
+DEFAULT_RATE_LIMITS = {
+    "recently-played": (5, 10),
+    "tracks": (10, 20),
+    "audio-features": (10, 20),
+    "artists": (10, 20),
+    "albums": (10, 20),
+    "token": (1, 5),
+    "default": (10, 20),
+}
+
+# Factor applied to a family's rate after a 429, and the fraction of its configured rate given back
+# per second without 429s (additive increase, multiplicative decrease)
+DEFAULT_RATE_DECREASE = 0.75
+DEFAULT_RATE_INCREASE = 0.05
+
+# Above this fraction of the rate that got the last 429, the rate grows ten times slower
+DEFAULT_RATE_PROBE = 0.9
+
+# Seconds after a rate cut (or until the end of the Retry-After pause, if longer) during which further 429s
+# of the family don't cut it again: they answer requests sent before the cut
+DEFAULT_RATE_HOLD = 1
 
 # Class to manage Spotify access tokens
+# The token is kept in memory and refreshed `refresh_margin` seconds before it expires. Callers holding a
+# valid token never take the lock; when a refresh is due, concurrent callers wait for a single refresh
+# instead of each sending their own request to the token endpoint.
 class SpotifyTokenManager:
-    def __init__(self, config, http_client):
+    def __init__(self, config, http_client, refresh_margin=DEFAULT_REFRESH_MARGIN):
         self.config = config
         self.http_client = http_client
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
 
     # Method to refresh the access token
     def refresh_access_token(self):
@@ -43,32 +96,61 @@ class SpotifyTokenManager:
 
     # Method to get the access token
     def get_access_token(self):
-        if self.config.access_token and self.config.is_access_token_valid():
-            print(f"Access token is still valid, expires at: {self.config.token_expiration}")
+        # Fast path: the token is valid and not about to expire
+        if self.config.is_access_token_valid(self.refresh_margin):
             return self.config.access_token
 
-        elif self.config.access_token:
-            print("Access token is present but expired. Refreshing...")
+        with self._lock:
+            # Another caller may have refreshed the token while this one waited for the lock
+            if self.config.is_access_token_valid(self.refresh_margin):
+                return self.config.access_token
+
+            if self.config.access_token:
+                print("Access token is present but expired or about to expire. Refreshing...")
+            else:
+                print("No access token found. Generating a new access token!")
+
             access_token = self.refresh_access_token()
             if access_token:
                 print(f"Access token refreshed. New expiration time: {self.config.token_expiration}")
                 return access_token
 
-        else:
-            print("No access token found. Generating a new access token!")
+            # The refresh failed, but a token that hasn't expired yet is still usable
+            if self.config.is_access_token_valid():
+                return self.config.access_token
+
+            return None
+
+    # Method to replace an access token the API rejected (401) before its expiration time
+    # Only the first caller reporting a given token refreshes it, the others get the new token
+    def refresh_rejected_token(self, rejected_token):
+        with self._lock:
+            if self.config.access_token != rejected_token and self.config.is_access_token_valid():
+                return self.config.access_token
+
+            print("Access token rejected by the Spotify API. Refreshing...")
             access_token = self.refresh_access_token()
             if access_token:
-                print(f"Access token generated. Expiration time: {self.config.token_expiration}")
-                return access_token
-
-        return None
+                print(f"Access token refreshed. New expiration time: {self.config.token_expiration}")
+            return access_token
 
 # Class to manage Spotify API configuration
 class SpotifyConfig:
-    def __init__(self, client_id, client_secret, refresh_token, access_token, token_expiration, token_url):
+    def __init__(self, client_id, client_secret, refresh_token, access_token, token_expiration, token_url, token_store=None,
+                 prefer_stored_token=False):
         self.client_id = client_id
         self.client_secret = client_secret
         self.refresh_token = refresh_token
+        self.token_store = token_store
+
+        # Without a token in the environment, start from the one persisted by the token store, if any
+        # With prefer_stored_token, a stored token wins over the environment's: when the store is shared
+        # (e.g. Airflow Variables), it holds the latest token while the environment keeps the first one
+        if token_store is not None and (not access_token or prefer_stored_token):
+            stored_token, stored_expiration = token_store.load()
+            if stored_token or not access_token:
+                access_token, token_expiration = stored_token, stored_expiration
+
         self.access_token = access_token
         if token_expiration:
             self.token_expiration = datetime.fromtimestamp(float(token_expiration))
@@ -77,30 +159,433 @@ class SpotifyConfig:
         self.token_url = token_url
 
     # Method to update the access token and its expiration time
+    # The new token is used from memory right away; the token store, if any, persists it
     def update_access_token(self, access_token, expiration_time):
         self.access_token = access_token
         self.token_expiration = expiration_time
-        self.update_env_file(access_token, expiration_time)
+        if self.token_store is not None:
+            self.token_store.save(access_token, expiration_time)
 
-    # Method to check if the access token is valid
-    def is_access_token_valid(self):
-        if self.access_token and self.token_expiration and datetime.now() < self.token_expiration:
+    # Method to check if the access token is valid for at least `margin` more seconds
+    def is_access_token_valid(self, margin=0):
+        if self.access_token and self.token_expiration and datetime.now() + timedelta(seconds=margin) < self.token_expiration:
             return True
         return False
 
-    # Method to update the environment file with the new access token and expiration time
-    def update_env_file(self, access_token, expiration_time):
+# Token store persisting the access token in the .env file
+class EnvFileTokenStore:
+    def __init__(self, path=".env"):
+        self.path = path
+
+    def load(self):
+        values = dotenv_values(self.path)
+        return values.get("SPOTIFY_ACCESS_TOKEN") or None, values.get("SPOTIFY_TOKEN_EXPIRATION") or None
+
+    def save(self, access_token, expiration_time):
         # This needs to be updated to ensure that the .env file is being updated within the Docker container!
-        set_key(".env", "SPOTIFY_ACCESS_TOKEN", access_token)
-        set_key(".env", "SPOTIFY_TOKEN_EXPIRATION", str(expiration_time.timestamp()))
+        set_key(self.path, "SPOTIFY_ACCESS_TOKEN", access_token)
+        set_key(self.path, "SPOTIFY_TOKEN_EXPIRATION", str(expiration_time.timestamp()))
+
+# Token store persisting the access token in Airflow Variables
+class AirflowVariableTokenStore:
+    def __init__(self, prefix="spotify"):
+        self.prefix = prefix
+
+    def load(self):
+        from airflow.models import Variable
+
+        return (
+            Variable.get(f"{self.prefix}_access_token", default_var=None),
+            Variable.get(f"{self.prefix}_token_expiration", default_var=None)
+        )
+
+    def save(self, access_token, expiration_time):
+        from airflow.models import Variable
+
+        Variable.set(f"{self.prefix}_access_token", access_token)
+        Variable.set(f"{self.prefix}_token_expiration", str(expiration_time.timestamp()))
+
+# Token store persisting the access token in a database table, one row per key
+class DatabaseTokenStore:
+    def __init__(self, engine, key="default", table="spotify_tokens", create=True):
+        self.engine = engine
+        self.key = key
+        self.table = table
+
+        # Stores built by the hundred (one per account) leave the table to a single create_table() call
+        if create:
+            self.create_table()
+
+    # Method to create the token table if it doesn't exist yet
+    def create_table(self):
+        from sqlalchemy import text
+
+        with self.engine.begin() as connection:
+            connection.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {self.table}(token_key VARCHAR(200) PRIMARY KEY, access_token TEXT, token_expiration FLOAT)"
+            ))
+
+    def load(self):
+        from sqlalchemy import text
+
+        with self.engine.connect() as connection:
+            row = connection.execute(
+                text(f"SELECT access_token, token_expiration FROM {self.table} WHERE token_key = :key"),
+                {"key": self.key}
+            ).fetchone()
+        return (row[0], row[1]) if row else (None, None)
+
+    def save(self, access_token, expiration_time):
+        from sqlalchemy import text
+
+        with self.engine.begin() as connection:
+            connection.execute(text(f"DELETE FROM {self.table} WHERE token_key = :key"), {"key": self.key})
+            connection.execute(
+                text(f"INSERT INTO {self.table}(token_key, access_token, token_expiration) VALUES (:key, :token, :expiration)"),
+                {"key": self.key, "token": access_token, "expiration": expiration_time.timestamp()}
+            )
+
+# Token store wrapper writing to another store in a background thread, so refreshing a token never
+# waits for file or database I/O. Only the writes still running are kept; flush() waits for them, and
+# runs at the latest when the interpreter exits.
+class AsyncTokenStore:
+    def __init__(self, store):
+        self.store = store
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="token-store")
+        self.pending = set()
+        self._lock = threading.Lock()
+        atexit.register(self.flush)
+
+    def load(self):
+        return self.store.load()
+
+    def save(self, access_token, expiration_time):
+        future = self.executor.submit(self.store.save, access_token, expiration_time)
+        with self._lock:
+            self.pending.add(future)
+        future.add_done_callback(self.finished)
+
+    # Method to wait for the pending writes
+    def flush(self):
+        with self._lock:
+            pending = list(self.pending)
+        for future in pending:
+            future.exception()
+        # A write can complete before its done callback ran
+        with self._lock:
+            self.pending.difference_update(pending)
+
+    # Method to drop a completed write from the pending ones, reporting its failure if any
+    def finished(self, future):
+        with self._lock:
+            self.pending.discard(future)
+        if future.exception() is not None:
+            print("Failed to persist the access token:", str(future.exception()))
 
 # HTTP client class for making API requests
+# Requests go through one pooled, keep-alive session. Throttled (429) and server error (5xx)
+# responses, connection errors and timeouts are retried with exponential backoff and jitter,
+# waiting for Retry-After instead when the server sends it.
 class HttpClient:
+    def __init__(self, pool_size=DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, max_retries=DEFAULT_MAX_RETRIES,
+                 backoff_factor=DEFAULT_BACKOFF_FACTOR, max_backoff=DEFAULT_MAX_BACKOFF, rate_limiter=None, metrics=None):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        # Optional RateLimiter every request goes through, shared by all the users of this client
+        self.rate_limiter = rate_limiter
+        # Optional RunMetrics recording the latency, size and status of every attempt, see spotify_metrics.py
+        self.metrics = metrics or NULL_METRICS
+
+        # Keep up to pool_size connections per host open between requests
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    # Method to compute the exponential backoff delay (with full jitter) for a retry attempt
+    def backoff_delay(self, attempt):
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** attempt)))
+
+    # Method to read the delay requested by the server through the Retry-After header, if any
+    def retry_after_delay(self, response):
+        retry_after = response.headers.get("Retry-After")
+        if not retry_after:
+            return None
+
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+
+        # Retry-After can also be an HTTP date
+        try:
+            retry_at = parsedate_to_datetime(retry_after)
+            return max(0.0, retry_at.timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    # Method to send a request, retrying throttled and failed attempts
+    def request(self, method, url, **kwargs):
+        attempt = 0
+
+        while True:
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(url)
+
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if self.metrics.enabled:
+                    self.metrics.record_request(endpoint_family(url), time.perf_counter() - started, 0, None, attempt > 0)
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.backoff_delay(attempt)
+                print(f"Request to {url} failed ({e.__class__.__name__}). Retrying in {delay:.2f}s...")
+            else:
+                if self.metrics.enabled:
+                    self.metrics.record_request(endpoint_family(url), time.perf_counter() - started, len(response.content),
+                                                response.status_code, attempt > 0)
+
+                retry = response.status_code in RETRY_STATUS_CODES
+                delay = self.retry_after_delay(response) if retry else None
+                if retry and delay is None:
+                    delay = self.backoff_delay(attempt)
+
+                paused = None
+                if self.rate_limiter is not None:
+                    if response.status_code == 429:
+                        # The limiter pauses the whole endpoint family, acquire() does the waiting
+                        paused = self.rate_limiter.throttled(url, delay)
+                    else:
+                        self.rate_limiter.succeeded(url)
+
+                if not retry or attempt >= self.max_retries:
+                    return response
+
+                if paused is not None:
+                    print(f"Request to {url} returned 429. Retrying once the {self.rate_limiter.family(url)} requests "
+                          f"resume, in {paused:.2f}s...")
+                    delay = 0
+                else:
+                    print(f"Request to {url} returned {response.status_code}. Retrying in {delay:.2f}s...")
+
+            time.sleep(delay)
+            attempt += 1
+
     def post(self, url, headers, data):
-        return requests.post(url, headers=headers, data=data)
-    
+        return self.request("POST", url, headers=headers, data=data)
+
     def get(self, url, headers):
-        return requests.get(url, headers=headers)
+        return self.request("GET", url, headers=headers)
+
+# Token bucket rate limiter: allows `rate` requests per second on average, with bursts of up to `burst`
+class TokenBucket:
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self._lock = threading.Lock()
+
+    # Method to take one token, sleeping until one is available; returns the seconds waited
+    def acquire(self):
+        waited = 0.0
+
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    delay = self.paused_until - now
+                else:
+                    self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                    self.updated_at = now
+
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return waited
+
+                    delay = (1 - self.tokens) / self.rate
+
+            time.sleep(delay)
+            waited += delay
+
+    # Method to change the refill rate, keeping the tokens earned at the previous rate
+    def set_rate(self, rate):
+        return self.update_rate(lambda _: rate)
+
+    # Method to change the refill rate to a function of the current one, returns the new rate
+    # The rate is read and written under the bucket's lock, so concurrent changes aren't lost
+    def update_rate(self, rate_function):
+        with self._lock:
+            now = time.monotonic()
+            if now >= self.paused_until:
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+            self.rate = rate_function(self.rate)
+            return self.rate
+
+    # Method to stop handing out tokens for the given number of seconds
+    # The bucket restarts empty, so the waiting requests don't all go out at once when the pause ends
+    def pause(self, seconds):
+        with self._lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+            self.tokens = 0
+            self.updated_at = self.paused_until
+
+    # Method to get the seconds left before the bucket hands out tokens again after a pause
+    def paused_for(self):
+        with self._lock:
+            return max(0.0, self.paused_until - time.monotonic())
+
+# Helper to tell which Spotify endpoint family a URL belongs to
+def endpoint_family(url):
+    path = urlparse(url).path.rstrip("/")
+    if path.endswith("/api/token"):
+        return "token"
+    if path.endswith("/recently-played"):
+        return "recently-played"
+
+    segments = path.split("/")
+    for family in ("tracks", "audio-features", "artists", "albums"):
+        if family in segments:
+            return family
+    return "default"
+
+# Class to rate limit requests with a separate token bucket per Spotify endpoint family
+# A 429 pauses the family for the Retry-After delay and cuts its rate by a quarter, then successful requests
+# give the rate back gradually, slowing down as it nears the rate that got the 429. Throughput settles
+# just below the rate Spotify accepts instead of oscillating between bursts and long backoffs.
+# The requests in flight when the limit is hit all get a 429: the rate is cut once for them, not once each.
+class RateLimiter:
+    def __init__(self, limits=None, decrease=DEFAULT_RATE_DECREASE, increase=DEFAULT_RATE_INCREASE,
+                 probe=DEFAULT_RATE_PROBE, min_rate=0.1, hold=DEFAULT_RATE_HOLD):
+        self.limits = DEFAULT_RATE_LIMITS if limits is None else limits
+        self.decrease = decrease
+        self.increase = increase
+        self.probe = probe
+        self.min_rate = min_rate
+        self.hold = hold
+
+        self.buckets = {family: TokenBucket(rate, burst) for family, (rate, burst) in self.limits.items()}
+        # Rate of each family when it last got a 429
+        self.ceilings = {}
+        # Time until which the 429s of each family don't cut its rate again
+        self.held_until = {}
+        self.counters = {family: {"requests": 0, "waited": 0.0, "throttled": 0} for family in self.limits}
+        self._lock = threading.Lock()
+
+    # Method to find the family of a URL, unknown families share the "default" budget
+    def family(self, url):
+        family = endpoint_family(url)
+        return family if family in self.buckets else "default"
+
+    # Method to wait until the family of the URL can send a request; returns the seconds waited
+    def acquire(self, url):
+        family = self.family(url)
+        waited = self.buckets[family].acquire()
+
+        with self._lock:
+            self.counters[family]["requests"] += 1
+            self.counters[family]["waited"] += waited
+
+        return waited
+
+    # Method to slow a family down after a 429, pausing it for the Retry-After delay if there is one
+    # Returns the seconds left before the family sends requests again
+    def throttled(self, url, retry_after=None):
+        family = self.family(url)
+        bucket = self.buckets[family]
+
+        with self._lock:
+            self.counters[family]["throttled"] += 1
+            now = time.monotonic()
+            cut = now >= self.held_until.get(family, 0.0)
+            if cut:
+                self.held_until[family] = now + max(self.hold, retry_after or 0)
+
+        if cut:
+            def cut_rate(rate):
+                self.ceilings[family] = rate
+                return max(self.min_rate, rate * self.decrease)
+
+            bucket.update_rate(cut_rate)
+        if retry_after:
+            bucket.pause(retry_after)
+
+        return bucket.paused_for()
+
+    # Method to speed a family back up towards its configured rate after a successful request
+    # Each request gives back increase / rate of the configured rate, so the rate grows by about
+    # `increase` of the configured rate per second, however fast the family is going
+    def succeeded(self, url):
+        family = self.family(url)
+        bucket = self.buckets[family]
+        configured_rate = self.limits[family][0]
+        if bucket.rate >= configured_rate:
+            return
+
+        # The new rate is computed from the current one under the bucket's lock: a rate read before a
+        # concurrent cut would otherwise undo the cut
+        def raise_rate(rate):
+            if rate >= configured_rate:
+                return rate
+
+            step = configured_rate * self.increase / rate
+            ceiling = self.ceilings.get(family)
+            if ceiling is not None and rate >= ceiling * self.probe:
+                step /= 10
+            return min(configured_rate, rate + step)
+
+        bucket.update_rate(raise_rate)
+
+    # Method to get the counters of each family: requests sent, seconds spent waiting, 429s and current rate
+    def stats(self):
+        with self._lock:
+            return {
+                family: {**counters, "rate": self.buckets[family].rate}
+                for family, counters in self.counters.items()
+            }
+
+# HTTP client wrapper for Spotify API requests that need an access token
+# Every request is sent with the token manager's current token, so a long run keeps working across
+# token refreshes. A request answered with 401 triggers one refresh and is replayed with the new token.
+# An optional account limiter (a TokenBucket per account, unlike the HttpClient's per-endpoint RateLimiter)
+# is acquired before every request.
+class AuthorizedHttpClient:
+    def __init__(self, http_client, token_manager, account_limiter=None):
+        self.http_client = http_client
+        self.token_manager = token_manager
+        self.account_limiter = account_limiter
+
+    # Method to send a GET request with a current access token, replaying it once after a 401
+    def get(self, url, headers):
+        access_token = self.token_manager.get_access_token()
+        response = self.send(url, self.authorize(headers, access_token))
+
+        if response.status_code == 401:
+            access_token = self.token_manager.refresh_rejected_token(access_token)
+            if access_token:
+                response = self.send(url, self.authorize(headers, access_token))
+
+        return response
+
+    # Method to send a GET request once the account limiter allows it
+    def send(self, url, headers):
+        if self.account_limiter is not None:
+            self.account_limiter.acquire()
+        return self.http_client.get(url, headers=headers)
+
+    # Helper to copy the request headers with the given access token
+    @staticmethod
+    def authorize(headers, access_token):
+        headers = dict(headers or {})
+        if access_token:
+            headers["Authorization"] = f"Bearer {access_token}"
+        return headers
 
 def main():
     load_dotenv()
@@ -112,11 +597,12 @@ def main():
         os.getenv("SPOTIFY_REFRESH_TOKEN"),
         os.getenv("SPOTIFY_ACCESS_TOKEN"),
         os.getenv("SPOTIFY_TOKEN_EXPIRATION"),
-        "https://accounts.spotify.com/api/token"
+        "https://accounts.spotify.com/api/token",
+        token_store=AsyncTokenStore(EnvFileTokenStore())
     )
 
     # Create an HttpClient object for making API requests
-    http_client = HttpClient()
+    http_client = HttpClient(rate_limiter=RateLimiter())
 
     # Create a SpotifyTokenManager object with the configuration and HTTP client
     token_manager = SpotifyTokenManager(config, http_client)
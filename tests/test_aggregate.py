@@ -0,0 +1,89 @@
+# Tests of the listening summaries: refreshing the days of each page gives the same rows as a rebuild,
+# even when pages are loaded twice or details arrive after their plays. Runs on a SQLite file, and on
+# PostgreSQL when SPOTIFY_TEST_DB_URL points to a database whose ETL tables can be dropped
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+
+from fake_data import make_details_df, make_features_df, make_tracks_df
+from spotify_aggregate import AGGREGATES, ListeningAggregator
+from spotify_load import SpotifyLoader
+from spotify_parse import typed_frame
+from spotify_schema import TABLES, TRACK_DETAILS_DTYPES, TRACK_FEATURES_DTYPES
+
+def drop_tables(engine):
+    with engine.begin() as connection:
+        for table_name in [*TABLES, *AGGREGATES]:
+            connection.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def engine(request, tmp_path):
+    if request.param == "postgresql":
+        if not os.getenv("SPOTIFY_TEST_DB_URL"):
+            pytest.skip("SPOTIFY_TEST_DB_URL is not set")
+        engine = create_engine(os.getenv("SPOTIFY_TEST_DB_URL"))
+        drop_tables(engine)
+    else:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp_path, 'spotify.db')}")
+
+    SpotifyLoader(engine).create_tables()
+    ListeningAggregator(engine).create_tables()
+    yield engine
+
+    if request.param == "postgresql":
+        drop_tables(engine)
+    engine.dispose()
+
+# Details and features of every track of the tests, the same values on every page
+TRACK_IDS = [f"id{i:07d}" for i in range(300)]
+DETAILS_DF = typed_frame(make_details_df(TRACK_IDS), TRACK_DETAILS_DTYPES)
+FEATURES_DF = typed_frame(make_features_df(TRACK_IDS), TRACK_FEATURES_DTYPES)
+
+# Helper to load a page of plays with the details and features of its tracks, then refresh its days
+def load_page(engine, tracks_df, with_details=True):
+    tracks = DETAILS_DF["track_id"].isin(tracks_df["track_id"])
+    details_df = DETAILS_DF[tracks] if with_details else None
+    SpotifyLoader(engine).load(tracks_df, details_df, FEATURES_DF[tracks])
+    ListeningAggregator(engine).update(tracks_df)
+
+def read_summaries(engine):
+    with engine.connect() as connection:
+        return {table_name: pd.read_sql(text(f"SELECT * FROM {table_name} ORDER BY 1, 2, 3"), connection) for table_name in AGGREGATES}
+
+def test_page_updates_match_a_rebuild(engine):
+    # Two and a half days of plays in pages of 500, one page crossing midnight loaded twice
+    tracks_df = make_tracks_df(3600, tracks=300)
+    pages = [tracks_df.iloc[start:start + 500] for start in range(0, len(tracks_df), 500)]
+    for page in pages[:3] + [pages[2]] + pages[3:]:
+        load_page(engine, page)
+    updated = read_summaries(engine)
+
+    with engine.begin() as connection:
+        for table_name in AGGREGATES:
+            connection.execute(text(f"DELETE FROM {table_name}"))
+    ListeningAggregator(engine).rebuild()
+
+    for table_name, df in read_summaries(engine).items():
+        pd.testing.assert_frame_equal(df, updated[table_name])
+    daily = updated["daily_listening"]
+    assert daily["plays"].tolist() == [1440, 1440, 720]
+    assert daily["distinct_tracks"].tolist() == [300, 300, 300]
+
+def test_details_loaded_after_their_plays_are_counted(engine):
+    tracks_df = make_tracks_df(100, tracks=10)
+    load_page(engine, tracks_df, with_details=False)
+    assert read_summaries(engine)["daily_listening"]["ms_played"].tolist() == [0]
+
+    # The next run brings the details and refreshes the same day
+    load_page(engine, tracks_df)
+
+    lengths = DETAILS_DF.set_index("track_id")["length"]
+    daily = read_summaries(engine)["daily_listening"]
+    assert daily["plays"].tolist() == [100]
+    assert daily["ms_played"].tolist() == [int(tracks_df["track_id"].map(lengths).sum())]
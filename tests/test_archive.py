@@ -0,0 +1,101 @@
+# Tests of the archive replay: it rebuilds every table from the raw responses, reads the newest
+# partitions first and never overwrites rows loaded by later runs
+import json
+import os
+import sys
+from datetime import date, datetime, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from mock_spotify import MockSpotifyServer, StaticTokenManager, fake_track
+from spotify_archive import ArchiveReplay, RawArchive
+from spotify_etl import SpotifyETL
+from spotify_load import SpotifyLoader
+
+TABLES = ["recent_tracks", "track_details", "track_features", "artists", "albums", "track_artists", "track_albums"]
+
+def make_loader(tmp_path, name):
+    loader = SpotifyLoader(create_engine(f"sqlite:///{os.path.join(tmp_path, name)}"))
+    loader.create_tables()
+    return loader
+
+def table_counts(loader):
+    with loader.engine.connect() as connection:
+        return {table_name: connection.execute(text(f"SELECT COUNT(*) FROM {table_name}")).scalar() for table_name in TABLES}
+
+# Helper to archive a /v1/tracks response for the given track popularities, as fetched at noon UTC on `day`
+def archive_tracks(archive, day, popularities):
+    fetched_at = datetime(day.year, day.month, day.day, 12, tzinfo=timezone.utc).timestamp()
+    body = {"tracks": [{**fake_track(track_id), "popularity": popularity} for track_id, popularity in popularities.items()]}
+    archive.write_part("tracks", [{"fetched_at": fetched_at, "user_id": "default",
+                                   "url": f"https://api.spotify.com/v1/tracks?ids={','.join(popularities)}", "body": json.dumps(body)}])
+
+@pytest.fixture
+def archived_run(tmp_path):
+    # One run through the mock API, every response archived, loaded into its own database
+    server = MockSpotifyServer(plays=60, tracks=20).start()
+    try:
+        archive = RawArchive(os.path.join(tmp_path, "archive"))
+        etl = SpotifyETL(
+            StaticTokenManager(),
+            recent_tracks_url=f"{server.base_url}/me/player/recently-played",
+            tracks_details_url=f"{server.base_url}/tracks",
+            tracks_features_url=f"{server.base_url}/audio-features",
+            archive=archive
+        )
+        tracks_df = etl.extract_recently_played_tracks(after=0)
+        details_df, features_df = etl.spotify_enrichment_etl(tracks_df)
+        dimensions = etl.spotify_dimensions_etl(tracks_df)
+        archive.close()
+    finally:
+        server.stop()
+
+    loader = make_loader(tmp_path, "api.db")
+    loader.load(tracks_df, details_df, features_df, dimensions=dimensions)
+    return archive, loader
+
+def test_replay_rebuilds_every_table(archived_run, tmp_path):
+    archive, api_loader = archived_run
+    replay_loader = make_loader(tmp_path, "replay.db")
+
+    assert ArchiveReplay(archive).run(replay_loader) == 60
+    assert table_counts(replay_loader) == table_counts(api_loader)
+    assert table_counts(replay_loader)["artists"] > 0
+
+def test_replay_keeps_rows_loaded_since(archived_run):
+    archive, loader = archived_run
+    # A later run loaded newer values than the archived ones
+    with loader.engine.begin() as connection:
+        connection.execute(text("UPDATE track_details SET popularity = 99"))
+        connection.execute(text("UPDATE artists SET followers = 7"))
+
+    ArchiveReplay(archive).run(loader)
+
+    with loader.engine.connect() as connection:
+        assert {row[0] for row in connection.execute(text("SELECT popularity FROM track_details"))} == {99}
+        assert {row[0] for row in connection.execute(text("SELECT followers FROM artists"))} == {7}
+
+def test_latest_rows_stop_at_the_newest_partition(tmp_path):
+    archive = RawArchive(os.path.join(tmp_path, "archive"))
+    archive_tracks(archive, date(2024, 1, 1), {"id0000001": 10, "id0000002": 20})
+    archive_tracks(archive, date(2024, 1, 3), {"id0000001": 30})
+
+    read_days = []
+    read = archive.read
+    archive.read = lambda endpoint, start=None, end=None: read_days.append(start) or read(endpoint, start, end)
+    replay = ArchiveReplay(archive)
+
+    # Up to the end date, each track gets its latest row
+    df, _ = replay.metadata_frame("details", ["id0000001", "id0000002"], end=date(2024, 1, 2))
+    assert df["popularity"].tolist() == [10, 20]
+    df, _ = replay.metadata_frame("details", ["id0000001", "id0000002"])
+    assert df["popularity"].tolist() == [30, 20]
+
+    # Once every track is found, older partitions aren't read
+    read_days.clear()
+    assert replay.metadata_frame("details", ["id0000001"])[0]["popularity"].tolist() == [30]
+    assert read_days == [date(2024, 1, 3)]
@@ -0,0 +1,100 @@
+# Tests of the backfill checkpoints against the mock Spotify API: failed and still open partitions are
+# retried, finished ones aren't, and plays found in overlapping dumps are loaded once
+import json
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+import pytest
+from sqlalchemy import create_engine, text
+
+from mock_spotify import MockSpotifyServer, StaticTokenManager, fake_play
+from spotify_backfill import DumpPlaySource, SpotifyBackfill, partition_name
+from spotify_etl import SpotifyETL
+from spotify_load import SpotifyLoader
+from spotify_state import ExtractionState
+
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+HOUR = timedelta(hours=1)
+
+# Loader failing the first load of the plays of one hour, like a lost database connection
+class FlakyLoader(SpotifyLoader):
+    def __init__(self, engine, failing_hour):
+        super().__init__(engine)
+        self.failing_hour = failing_hour
+
+    def load(self, tracks_df, *args, **kwargs):
+        if self.failing_hour is not None and tracks_df["played_at"].min().floor("h") == self.failing_hour:
+            self.failing_hour = None
+            raise ConnectionError("server closed the connection unexpectedly")
+        return super().load(tracks_df, *args, **kwargs)
+
+@pytest.fixture
+def server():
+    server = MockSpotifyServer(tracks=20).start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{os.path.join(tmp_path, 'spotify.db')}")
+    SpotifyLoader(engine).create_tables()
+    yield engine
+    engine.dispose()
+
+def spotify_etl(server):
+    return SpotifyETL(
+        StaticTokenManager(),
+        recent_tracks_url=f"{server.base_url}/me/player/recently-played",
+        tracks_details_url=f"{server.base_url}/tracks",
+        tracks_features_url=f"{server.base_url}/audio-features",
+    )
+
+# Helper to write the plays first..last - 1 of the mocked listening history as a raw dump
+def write_dump(tmp_path, name, first, last):
+    path = os.path.join(tmp_path, name)
+    with open(path, "w") as f:
+        json.dump({"items": [fake_play(i, 20) for i in range(first, last)]}, f)
+    return path
+
+def count_plays(engine):
+    with engine.connect() as connection:
+        return connection.execute(text("SELECT COUNT(*) FROM recent_tracks")).scalar()
+
+def test_failed_partition_is_retried_alone(server, engine, tmp_path):
+    etl = spotify_etl(server)
+    # Two overlapping dumps of the first two hours
+    source = DumpPlaySource([write_dump(tmp_path, "a.json", 0, 90), write_dump(tmp_path, "b.json", 60, 120)], etl)
+    state = ExtractionState(os.path.join(tmp_path, "state.json"))
+    hours = [partition_name(START + i * HOUR, START + (i + 1) * HOUR) for i in range(3)]
+
+    reports = SpotifyBackfill(etl, FlakyLoader(engine, START + HOUR), state, source=source,
+                              partition_size=HOUR).run(START, START + 3 * HOUR)
+
+    # The third hour has no plays but is over, so it's finished too
+    assert {name: report["plays"] for name, report in reports.items()} == {hours[0]: 60, hours[2]: 0}
+    assert set(state.get_partitions()) == {hours[0], hours[2]}
+
+    reports = SpotifyBackfill(etl, SpotifyLoader(engine), state, source=source,
+                              partition_size=HOUR).run(START, START + 3 * HOUR)
+
+    assert {name: report["plays"] for name, report in reports.items()} == {hours[1]: 60}
+    assert set(state.get_partitions()) == set(hours)
+    assert len(source.plays) == 120
+    assert count_plays(engine) == 120
+
+def test_partitions_ending_after_the_run_started_are_not_checkpointed(server, engine, tmp_path):
+    etl = spotify_etl(server)
+    source = DumpPlaySource([write_dump(tmp_path, "a.json", 0, 10)], etl)
+    state = ExtractionState(os.path.join(tmp_path, "state.json"))
+    start = datetime.now(timezone.utc).replace(minute=0, second=0, microsecond=0) - HOUR
+
+    backfill = SpotifyBackfill(etl, SpotifyLoader(engine), state, source=source, partition_size=HOUR)
+    assert len(backfill.run(start, start + 2 * HOUR)) == 2
+    assert set(state.get_partitions()) == {partition_name(start, start + HOUR)}
+
+    # The current hour is processed again by the next run
+    assert list(backfill.run(start, start + 2 * HOUR)) == [partition_name(start + HOUR, start + 2 * HOUR)]
@@ -0,0 +1,97 @@
+# Tests of the metadata cache: field TTLs, LRU eviction and the offline mode, on a clock the tests move
+import os
+import sys
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import pytest
+
+import spotify_cache
+from spotify_cache import TrackMetadataCache
+
+FIELD_TTLS = {"details": {"popularity": 100, "track_name": 1000}, "features": {}}
+
+# Clock replacing the time module of spotify_cache
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def time(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(spotify_cache, "time", clock)
+    return clock
+
+def make_cache(tmp_path, **kwargs):
+    return TrackMetadataCache(os.path.join(tmp_path, "cache.db"), field_ttls=FIELD_TTLS, **kwargs)
+
+def test_row_expires_with_its_shortest_field_ttl(tmp_path, clock):
+    cache = make_cache(tmp_path)
+    cache.put_many("details", [
+        {"track_id": "a", "track_name": "A", "popularity": 50},
+        {"track_id": "b", "track_name": "B"},
+    ])
+
+    clock.now += 99
+    assert set(cache.get_many("details", ["a", "b"])) == {"a", "b"}
+
+    # Past the popularity TTL only the row holding a popularity expires
+    clock.now += 2
+    assert set(cache.get_many("details", ["a", "b"])) == {"b"}
+    assert cache.stats()["expired"] == 1
+
+    clock.now += 1000
+    assert cache.get_many("details", ["a", "b"]) == {}
+
+def test_rows_without_ttl_never_expire(tmp_path, clock):
+    cache = make_cache(tmp_path)
+    cache.put_many("features", [{"track_id": "a", "tempo": 120.0}])
+
+    clock.now += 10 ** 9
+
+    assert cache.get_many("features", ["a"]) == {"a": {"track_id": "a", "tempo": 120.0}}
+
+def test_least_recently_used_rows_are_evicted(tmp_path, clock):
+    cache = make_cache(tmp_path, max_entries=3)
+    for track_id in ["a", "b", "c"]:
+        clock.now += 1
+        cache.put_many("features", [{"track_id": track_id}])
+
+    # Reading "a" makes "b" the least recently used row
+    clock.now += 1
+    cache.get_many("features", ["a"])
+    clock.now += 1
+    cache.put_many("features", [{"track_id": "d"}])
+
+    assert set(cache.get_many("features", ["a", "b", "c", "d"])) == {"a", "c", "d"}
+    assert cache.stats()["size"] == 3
+
+def test_offline_cache_serves_expired_rows(tmp_path, clock):
+    make_cache(tmp_path).put_many("details", [{"track_id": "a", "track_name": "A", "popularity": 50}])
+    clock.now += 10 ** 6
+
+    cache = make_cache(tmp_path, offline=True)
+
+    assert set(cache.get_many("details", ["a"])) == {"a"}
+    assert cache.stats()["expired"] == 0
+
+def test_a_write_waits_for_another_process_holding_the_file(tmp_path):
+    path = os.path.join(tmp_path, "cache.db")
+    holder, cache = TrackMetadataCache(path), TrackMetadataCache(path)
+    assert cache.connection.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    # Another process is in the middle of a write for a while; reads go on, the write waits for it
+    holder.connection.execute("BEGIN IMMEDIATE")
+    holder.connection.execute("INSERT INTO track_metadata VALUES ('features', 'id0000002', '{}', 0, 0)")
+    releaser = threading.Timer(0.5, holder.connection.commit)
+    releaser.start()
+
+    assert cache.get_many("details", ["id0000001"]) == {}
+    cache.put_many("details", [{"track_id": "id0000001", "track_name": "a"}])
+    releaser.join()
+
+    assert cache.stats()["size"] == 2
@@ -0,0 +1,62 @@
+# Tests of the artist and album parsers and of the track links they are joined through
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+from mock_spotify import fake_album, fake_artist, fake_track
+from spotify_parse import concat_columns, link_frames, parse_albums, parse_artists, parse_track_links
+from spotify_schema import ALBUMS_DTYPES, ARTISTS_DTYPES
+
+def test_artists_in_request_order_and_nulls_missing():
+    artist_ids = ["artist-b", "artist-a", "artist-unknown", "artist-cc"]
+    artists = [fake_artist(artist_id) for artist_id in artist_ids]
+    artists[1]["genres"] = []
+    artists[2] = None
+
+    columns, missing_ids = parse_artists(artist_ids, artists)
+    artists_df = concat_columns([columns], ARTISTS_DTYPES)
+
+    assert missing_ids == ["artist-unknown"]
+    assert artists_df["artist_id"].tolist() == ["artist-b", "artist-a", "artist-cc"]
+    # Genres are flattened, followers come from the nested object
+    assert artists_df["genres"].tolist() == ["pop", "", "rock, indie rock"]
+    assert artists_df["followers"].tolist() == [12345] * 3
+    assert (str(artists_df["popularity"].dtype), str(artists_df["followers"].dtype)) == ("int8", "int32")
+
+def test_albums_without_label_and_nulls_missing():
+    album_ids = ["album-a", "album-b", "album-c"]
+    albums = [fake_album(album_id) for album_id in album_ids]
+    del albums[0]["label"]
+    albums[1] = None
+
+    columns, missing_ids = parse_albums(album_ids, albums)
+    albums_df = concat_columns([columns], ALBUMS_DTYPES)
+
+    assert missing_ids == ["album-b"]
+    assert albums_df["album_id"].tolist() == ["album-a", "album-c"]
+    assert albums_df["label"].isna().tolist() == [True, False]
+    assert albums_df["total_tracks"].tolist() == [10, 10]
+    assert str(albums_df["album_type"].dtype) == "category"
+
+def test_empty_responses():
+    artists_df = concat_columns([parse_artists([], [])[0]], ARTISTS_DTYPES)
+    albums_df = concat_columns([parse_albums([], [])[0]], ALBUMS_DTYPES)
+
+    assert artists_df.empty and list(artists_df.columns) == list(ARTISTS_DTYPES)
+    assert albums_df.empty and list(albums_df.columns) == list(ALBUMS_DTYPES)
+
+def test_links_keep_every_credited_artist_in_order():
+    # id0000004 credits a featured artist, id0000009 isn't returned
+    track_ids = ["id0000003", "id0000004", "id0000009"]
+    tracks = [fake_track("id0000003"), fake_track("id0000004"), None]
+
+    track_artists_df, track_albums_df = link_frames(parse_track_links(track_ids, tracks))
+
+    assert track_artists_df.values.tolist() == [
+        ["id0000003", "artist-id000000", 0],
+        ["id0000004", "artist-id000000", 0],
+        ["id0000004", "artist-id00000", 1],
+    ]
+    assert track_albums_df.values.tolist() == [["id0000003", "album-id000000"], ["id0000004", "album-id000000"]]
@@ -0,0 +1,47 @@
+# Tests of the enrichment stages against the mock Spotify API: tracks without audio features vs failed requests
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+import pandas as pd
+import pytest
+
+from mock_spotify import MockSpotifyServer, StaticTokenManager
+from spotify_etl import SpotifyETL
+
+TRACK_IDS = [f"id{i:07d}" for i in range(150)]
+
+@pytest.fixture
+def server():
+    server = MockSpotifyServer(missing_ids={"id0000001", "id0000120"}).start()
+    yield server
+    server.stop()
+
+def spotify_etl(server, tracks_features_url=None):
+    return SpotifyETL(
+        StaticTokenManager(),
+        recent_tracks_url=f"{server.base_url}/me/player/recently-played",
+        tracks_details_url=f"{server.base_url}/tracks",
+        tracks_features_url=tracks_features_url or f"{server.base_url}/audio-features",
+    )
+
+def test_null_features_are_missing_tracks(server):
+    etl = spotify_etl(server)
+
+    features_df, missing_ids = etl.fetch_track_features_batched(TRACK_IDS, {})
+
+    assert missing_ids == ["id0000001", "id0000120"]
+    assert len(features_df) == len(TRACK_IDS) - 2
+    assert len(etl.spotify_features_etl(pd.DataFrame({"track_id": TRACK_IDS}))) == len(TRACK_IDS) - 2
+
+def test_failed_features_request_fails_the_stage(server):
+    # Every audio features request gets a 404, no track is reported as merely missing features
+    etl = spotify_etl(server, tracks_features_url=f"{server.base_url}/unavailable")
+    tracks_df = pd.DataFrame({"track_id": TRACK_IDS})
+
+    with pytest.raises(Exception, match="Track features extraction failed"):
+        etl.spotify_features_etl(tracks_df)
+    with pytest.raises(Exception, match="Track features extraction failed"):
+        etl.spotify_enrichment_etl(tracks_df)
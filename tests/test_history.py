@@ -0,0 +1,149 @@
+# Tests of the popularity history: only changes are recorded, each valid from the time its value was
+# fetched from the API, and values fetched before the latest recorded one (archive replays, offline
+# backfills from the cache) are skipped. Runs on a SQLite file, and on PostgreSQL when SPOTIFY_TEST_DB_URL
+# points to a database whose ETL tables can be dropped
+import json
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+
+from fake_data import make_details_df, make_features_df, make_tracks_df
+from mock_spotify import StaticTokenManager, fake_play, fake_track
+from spotify_archive import ArchiveReplay, RawArchive
+from spotify_backfill import DumpPlaySource, SpotifyBackfill
+from spotify_cache import TrackMetadataCache
+from spotify_etl import SpotifyETL
+from spotify_load import SpotifyLoader
+from spotify_parse import typed_frame
+from spotify_schema import TABLES, TRACK_DETAILS_DTYPES, TRACK_FEATURES_DTYPES
+from spotify_state import ExtractionState
+
+JAN_1 = datetime(2024, 1, 1, 12, tzinfo=timezone.utc)
+
+def drop_tables(engine):
+    with engine.begin() as connection:
+        for table_name in TABLES:
+            connection.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def loader(request, tmp_path):
+    if request.param == "postgresql":
+        if not os.getenv("SPOTIFY_TEST_DB_URL"):
+            pytest.skip("SPOTIFY_TEST_DB_URL is not set")
+        engine = create_engine(os.getenv("SPOTIFY_TEST_DB_URL"))
+        drop_tables(engine)
+    else:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp_path, 'spotify.db')}")
+
+    loader = SpotifyLoader(engine)
+    loader.create_tables()
+    yield loader
+
+    if request.param == "postgresql":
+        drop_tables(engine)
+    engine.dispose()
+
+def frames(tracks=5):
+    tracks_df = make_tracks_df(tracks, tracks=tracks)
+    track_ids = tracks_df["track_id"].tolist()
+    return tracks_df, typed_frame(make_details_df(track_ids), TRACK_DETAILS_DTYPES), typed_frame(make_features_df(track_ids), TRACK_FEATURES_DTYPES)
+
+# Helper to read a track's history as (valid_from, popularity) pairs, oldest first
+def history(loader, track_id):
+    with loader.engine.connect() as connection:
+        rows = connection.execute(text("SELECT valid_from, popularity FROM track_popularity_history WHERE track_id = :track_id "
+                                       "ORDER BY valid_from"), {"track_id": track_id}).fetchall()
+    # SQLite returns valid_from as UTC text, PostgreSQL as datetimes
+    return [(pd.to_datetime(valid_from, utc=True), popularity) for valid_from, popularity in rows]
+
+def count_history(loader):
+    with loader.engine.connect() as connection:
+        return connection.execute(text("SELECT COUNT(*) FROM track_popularity_history")).scalar()
+
+def test_only_changes_are_recorded(loader):
+    tracks_df, details_df, features_df = frames()
+    loader.load(tracks_df, details_df, features_df)
+    loader.load(tracks_df, details_df, features_df)
+    assert count_history(loader) == 5
+
+    changed_df = details_df.assign(popularity=details_df["popularity"].where(details_df.index >= 2, 100 - details_df["popularity"]))
+    loader.load(tracks_df, changed_df, features_df, bulk=True)
+
+    assert count_history(loader) == 7
+    assert [popularity for _, popularity in history(loader, "id0000000")] == [details_df["popularity"][0], changed_df["popularity"][0]]
+
+def test_changes_are_valid_from_their_observation_time(loader):
+    tracks_df, details_df, features_df = frames()
+    # Two tracks were fetched on January 1st, the others weren't in the cache: fetched now
+    observed_at = pd.Series([JAN_1, JAN_1], index=["id0000000", "id0000001"])
+
+    before = datetime.now(timezone.utc)
+    loader.load(tracks_df, details_df, features_df, observed_at=observed_at)
+
+    assert history(loader, "id0000000")[0][0] == JAN_1
+    assert history(loader, "id0000004")[0][0] >= pd.Timestamp(before).floor("ms")
+
+def test_values_observed_before_the_latest_row_are_skipped(loader, capsys):
+    tracks_df, details_df, features_df = frames()
+    loader.load(tracks_df, details_df, features_df)
+    stale_df = details_df.assign(popularity=100 - details_df["popularity"])
+
+    loader.load(tracks_df, stale_df, features_df, observed_at=JAN_1)
+
+    assert count_history(loader) == 5
+    assert "Skipped 5 track_popularity_history change(s)" in capsys.readouterr().out
+
+    # The same values observed later are real changes
+    loader.load(tracks_df, stale_df, features_df, observed_at=datetime.now(timezone.utc) + timedelta(seconds=1))
+    assert count_history(loader) == 10
+
+def test_replay_records_the_archived_fetch_time(loader, tmp_path):
+    archive = RawArchive(os.path.join(tmp_path, "archive"))
+    fetched_at = JAN_1.timestamp()
+    track_ids = ["id0000001", "id0000002"]
+    records = {
+        "recently-played": {"items": [fake_play(i, 3) for i in (1, 2)]},
+        "tracks": {"tracks": [{**fake_track(track_id), "popularity": 10} for track_id in track_ids]},
+    }
+    for endpoint, body in records.items():
+        url = f"https://api.spotify.com/v1/{endpoint}?ids={','.join(track_ids)}"
+        archive.write_part(endpoint, [{"fetched_at": fetched_at, "user_id": "default", "url": url, "body": json.dumps(body)}])
+
+    ArchiveReplay(archive).run(loader)
+    assert history(loader, "id0000001") == [(JAN_1, 10)]
+
+    # A newer popularity is loaded, then the archive is replayed again: its older value isn't a change
+    _, details_df, features_df = frames(3)
+    details_df = details_df[details_df["track_id"].isin(track_ids)].assign(popularity=55)
+    loader.load(None, details_df, features_df)
+    ArchiveReplay(archive).run(loader)
+
+    assert [popularity for _, popularity in history(loader, "id0000001")] == [10, 55]
+
+def test_offline_backfill_records_the_cache_fetch_time(loader, tmp_path):
+    cache = TrackMetadataCache(os.path.join(tmp_path, "cache.db"), offline=True)
+    track_ids = ["id0000000", "id0000001"]
+    cache.put_many("details", make_details_df(track_ids).to_dict("records"))
+    cache.put_many("features", make_features_df(track_ids).to_dict("records"))
+    cache.connection.execute("UPDATE track_metadata SET fetched_at = ?", (JAN_1.timestamp(),))
+    cache.connection.commit()
+
+    etl = SpotifyETL(StaticTokenManager(), "http://unused/recently-played", "http://unused/tracks", "http://unused/audio-features",
+                     cache=cache)
+    dump = os.path.join(tmp_path, "dump.json")
+    with open(dump, "w") as f:
+        json.dump({"items": [fake_play(i, 2) for i in range(2)]}, f)
+
+    start = datetime(2020, 1, 1, tzinfo=timezone.utc)
+    SpotifyBackfill(etl, loader, ExtractionState(os.path.join(tmp_path, "state.json")), source=DumpPlaySource([dump], etl)).run(
+        start, start + timedelta(days=1))
+
+    assert history(loader, "id0000000")[0][0] == JAN_1
+    assert history(loader, "id0000001")[0][0] == JAN_1
@@ -0,0 +1,91 @@
+# Tests of the loader's upserts on a SQLite file, and on PostgreSQL when SPOTIFY_TEST_DB_URL points to a
+# database whose ETL tables can be dropped
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, text
+
+from fake_data import make_details_df, make_features_df, make_tracks_df
+from spotify_load import SpotifyLoader
+from spotify_parse import typed_frame
+from spotify_schema import TABLES, TRACK_DETAILS_DTYPES, TRACK_FEATURES_DTYPES
+
+def drop_tables(engine):
+    with engine.begin() as connection:
+        for table_name in TABLES:
+            connection.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def loader(request, tmp_path):
+    if request.param == "postgresql":
+        if not os.getenv("SPOTIFY_TEST_DB_URL"):
+            pytest.skip("SPOTIFY_TEST_DB_URL is not set")
+        engine = create_engine(os.getenv("SPOTIFY_TEST_DB_URL"))
+        drop_tables(engine)
+    else:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp_path, 'spotify.db')}")
+
+    loader = SpotifyLoader(engine)
+    loader.create_tables()
+    yield loader
+
+    if request.param == "postgresql":
+        drop_tables(engine)
+    engine.dispose()
+
+def frames(plays=100, tracks=40):
+    tracks_df = make_tracks_df(plays, tracks=tracks)
+    track_ids = tracks_df["track_id"].unique()
+    details_df = typed_frame(make_details_df(track_ids), TRACK_DETAILS_DTYPES)
+    features_df = typed_frame(make_features_df(track_ids), TRACK_FEATURES_DTYPES)
+    return tracks_df, details_df, features_df
+
+def read_table(loader, table_name, order_by):
+    with loader.engine.connect() as connection:
+        return pd.read_sql(text(f"SELECT * FROM {table_name} ORDER BY {order_by}"), connection)
+
+def test_rerun_is_idempotent(loader):
+    tracks_df, details_df, features_df = frames()
+
+    loader.load(tracks_df, details_df, features_df)
+    first = {table_name: read_table(loader, table_name, "1, 2") for table_name in ["recent_tracks", "track_details", "track_features"]}
+    loader.load(tracks_df, details_df, features_df)
+
+    for table_name, df in first.items():
+        pd.testing.assert_frame_equal(read_table(loader, table_name, "1, 2"), df)
+    assert len(first["recent_tracks"]) == 100
+    assert len(first["track_details"]) == len(first["track_features"]) == 40
+
+def test_conflicts_update_details_and_keep_plays_and_features(loader):
+    tracks_df, details_df, features_df = frames()
+    loader.load(tracks_df, details_df, features_df)
+
+    # Same keys, new values: track details are updated, plays and audio features never change
+    details_df = details_df.assign(popularity=details_df["popularity"] // 2 + 1)
+    features_df = features_df.assign(tempo=features_df["tempo"] + 1)
+    tracks_df = tracks_df.assign(track_id="id9999999")
+    loader.load(tracks_df, details_df, features_df)
+
+    assert read_table(loader, "track_details", "track_id")["popularity"].tolist() == details_df["popularity"].tolist()
+    assert (read_table(loader, "track_features", "track_id")["tempo"] < features_df["tempo"].to_numpy() - 0.5).all()
+    assert "id9999999" not in set(read_table(loader, "recent_tracks", "played_at")["track_id"])
+
+# Both write paths agree: multi-row upserts, and COPY into a staging table on PostgreSQL (bulk=True)
+@pytest.mark.parametrize("bulk", [False, True])
+def test_duplicate_keys_in_one_batch_keep_the_last_row(loader, bulk):
+    tracks_df, details_df, features_df = frames(plays=10, tracks=10)
+
+    # Each key appears twice in the batch, the second row with other values
+    tracks_df = pd.concat([tracks_df, tracks_df.assign(track_id=tracks_df["track_id"].shift(1, fill_value="id0000009"))], ignore_index=True)
+    details_df = pd.concat([details_df, details_df.assign(popularity=details_df["popularity"] // 2 + 1)], ignore_index=True)
+    features_df = pd.concat([features_df, features_df.assign(tempo=features_df["tempo"] + 1)], ignore_index=True)
+    loader.load(tracks_df, details_df, features_df, bulk=bulk)
+
+    assert read_table(loader, "recent_tracks", "played_at")["track_id"].tolist() == tracks_df["track_id"].tolist()[10:]
+    assert read_table(loader, "track_details", "track_id")["popularity"].tolist() == details_df["popularity"].tolist()[10:]
+    assert read_table(loader, "track_features", "track_id")["tempo"].tolist() == pytest.approx(features_df["tempo"].tolist()[10:])
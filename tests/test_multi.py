@@ -0,0 +1,87 @@
+# Tests of the multi-account run against the mock Spotify API: request budgets and token storage
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine, event, text
+
+import spotify_multi
+from mock_spotify import MockSpotifyServer, play_timestamp
+from spotify_etl import cursor_key
+from spotify_load import SpotifyLoader
+from spotify_multi import MultiUserETL, database_token_stores
+from spotify_state import ExtractionState
+from spotify_token import TokenBucket
+
+ACCOUNTS = [{"user_id": user_id, "client_id": "client-id", "client_secret": "client-secret", "refresh_token": "refresh-token"}
+            for user_id in ("alice", "bob", "carol")]
+
+# Token bucket counting the requests it lets through
+class CountingBucket(TokenBucket):
+    acquired = 0
+
+    def acquire(self):
+        CountingBucket.acquired += 1
+        return super().acquire()
+
+@pytest.fixture
+def server():
+    server = MockSpotifyServer(plays=100, tracks=100).start()
+    yield server
+    server.stop()
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{os.path.join(tmp_path, 'spotify.db')}")
+    SpotifyLoader(engine).create_tables()
+    yield engine
+    engine.dispose()
+
+# Helper to build the run, every account's cursor starting before the mocked listening history
+def multi_etl(server, engine, tmp_path, **kwargs):
+    state = ExtractionState(os.path.join(tmp_path, "state.json"))
+    for account in ACCOUNTS:
+        if state.get_cursor(cursor_key(account["user_id"])) is None:
+            state.advance(pd.DataFrame({"played_at": [pd.Timestamp(play_timestamp(-1), unit="ms", tz="UTC").isoformat()]}),
+                          cursor_key(account["user_id"]))
+
+    return MultiUserETL(
+        ACCOUNTS,
+        SpotifyLoader(engine),
+        state,
+        token_url=server.token_url,
+        recent_tracks_url=f"{server.base_url}/me/player/recently-played",
+        tracks_details_url=f"{server.base_url}/tracks",
+        tracks_features_url=f"{server.base_url}/audio-features",
+        **kwargs
+    )
+
+def test_catalog_requests_skip_the_account_budgets(server, engine, tmp_path, monkeypatch):
+    monkeypatch.setattr(spotify_multi, "TokenBucket", CountingBucket)
+    CountingBucket.acquired = 0
+
+    plays = multi_etl(server, engine, tmp_path).run()
+
+    # Two pages of recently played tracks per account go through its budget; the details, features,
+    # artists and albums requests of the shared enrichment don't
+    assert plays == {"alice": 100, "bob": 100, "carol": 100}
+    assert CountingBucket.acquired == 2 * len(ACCOUNTS)
+    assert server.request_count > CountingBucket.acquired + len(ACCOUNTS)
+
+def test_tokens_are_kept_per_account_in_one_table(server, engine, tmp_path):
+    statements = []
+    event.listen(engine, "before_cursor_execute", lambda conn, cursor, statement, *args: statements.append(statement))
+
+    token_stores = database_token_stores(engine)
+    multi_etl(server, engine, tmp_path, token_stores=token_stores).run()
+    # The next run reuses the stored tokens
+    multi_etl(server, engine, tmp_path, token_stores=token_stores).run()
+
+    assert sum("CREATE TABLE IF NOT EXISTS spotify_tokens" in statement for statement in statements) == 1
+    assert server.tokens_issued == len(ACCOUNTS)
+    with engine.connect() as connection:
+        assert connection.execute(text("SELECT COUNT(*) FROM spotify_tokens")).scalar() == len(ACCOUNTS)
@@ -0,0 +1,46 @@
+# Tests of the audio features parser on responses with unusable values
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+from mock_spotify import fake_audio_features
+from spotify_parse import concat_columns, parse_audio_features
+from spotify_schema import TRACK_FEATURES_DTYPES
+
+TRACK_IDS = ["id0", "id1", "id2", "id3"]
+
+def parse(audio_features):
+    columns, missing_ids = parse_audio_features(TRACK_IDS, audio_features)
+    return concat_columns([columns], TRACK_FEATURES_DTYPES), missing_ids
+
+def test_null_float_field_is_missing():
+    audio_features = [fake_audio_features(track_id) for track_id in TRACK_IDS]
+    audio_features[1]["tempo"] = None
+
+    features_df, missing_ids = parse(audio_features)
+
+    assert missing_ids == ["id1"]
+    assert features_df["track_id"].tolist() == ["id0", "id2", "id3"]
+    assert not features_df.isna().any().any()
+
+def test_null_int_and_non_numeric_fields_are_missing():
+    audio_features = [fake_audio_features(track_id) for track_id in TRACK_IDS]
+    audio_features[0]["key"] = None
+    audio_features[2]["energy"] = "0.5"
+    audio_features[3] = None
+
+    features_df, missing_ids = parse(audio_features)
+
+    assert sorted(missing_ids) == ["id0", "id2", "id3"]
+    assert features_df["track_id"].tolist() == ["id1"]
+
+def test_valid_features_are_all_kept():
+    features_df, missing_ids = parse([fake_audio_features(track_id) for track_id in TRACK_IDS])
+
+    assert missing_ids == []
+    assert features_df["track_id"].tolist() == TRACK_IDS
+    assert features_df.dtypes.to_dict() == {column: np.dtype(dtype) for column, dtype in TRACK_FEATURES_DTYPES.items()}
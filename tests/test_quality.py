@@ -0,0 +1,90 @@
+# Tests of the vectorized quality rules: keys, nulls, ranges, DDL types, references and empty DataFrames
+import logging
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+import pandas as pd
+import pytest
+
+from fake_data import make_details_df, make_tracks_df
+from spotify_parse import typed_frame
+from spotify_quality import DataQualityChecker, DataQualityError
+from spotify_schema import TRACK_DETAILS_DTYPES
+
+@pytest.fixture
+def checker():
+    return DataQualityChecker()
+
+def details(n=5):
+    return typed_frame(make_details_df([f"id{i:07d}" for i in range(n)]), TRACK_DETAILS_DTYPES)
+
+def test_valid_frames_pass_silently(checker, capsys, caplog):
+    tracks_df = make_tracks_df(10, tracks=5)
+
+    with caplog.at_level(logging.INFO, logger="spotify_quality"):
+        report = checker.validate(tracks_df, "recent_tracks", references={"track_details": details()})
+
+    assert report.passed and not report.warnings
+    assert capsys.readouterr().out == ""
+    assert caplog.messages == ["Data quality checks passed for recent_tracks (10 row(s))"]
+
+def test_composite_key_duplicates_fail(checker):
+    tracks_df = make_tracks_df(6, tracks=3)
+    # Same listener and time twice, and the same time for another listener, which is fine
+    tracks_df = pd.concat([tracks_df, tracks_df.iloc[[2]], tracks_df.iloc[[3]].assign(user_id="alice")], ignore_index=True)
+
+    report = checker.check(tracks_df, "recent_tracks")
+
+    assert report.failures["key:user_id,played_at"].tolist() == [2, 6]
+
+def test_nulls_and_ranges_fail_with_their_rows(checker):
+    details_df = details()
+    details_df.loc[1, "track_name"] = None
+    details_df["popularity"] = details_df["popularity"].astype("int64")
+    details_df.loc[3, "popularity"] = 101
+    details_df.loc[4, "length"] = 0
+
+    with pytest.raises(DataQualityError) as error:
+        checker.validate(details_df, "track_details")
+
+    failures = error.value.report.failures
+    assert set(failures) == {"not_null:track_name", "range:popularity", "range:length"}
+    assert failures["not_null:track_name"].tolist() == [1]
+    assert failures["range:popularity"].tolist() == [3]
+    assert failures["range:length"].tolist() == [4]
+
+def test_type_mismatches(checker):
+    assert checker.type_mismatches(pd.Series(["abc", "abcdef", None]), "VARCHAR", 5).tolist() == [False, True, False]
+    assert checker.type_mismatches(pd.Series([1, 2]), "VARCHAR", None).tolist() == [True, True]
+    assert checker.type_mismatches(pd.Series([1.0, 1.5, None]), "INTEGER", None).tolist() == [False, True, False]
+    assert checker.type_mismatches(pd.Series(["1", "x"]), "FLOAT", None).tolist() == [False, True]
+    assert checker.type_mismatches(pd.Series([True, False]), "INTEGER", None).tolist() == [True, True]
+    assert checker.type_mismatches(pd.Series([True, "yes"], dtype=object), "BOOLEAN", None).tolist() == [False, True]
+
+    # Times: time zone aware for TIMESTAMPTZ, midnight without a time zone for DATE
+    naive = pd.Series(pd.to_datetime(["2024-01-01 00:00", "2024-01-01 10:30"]))
+    assert checker.type_mismatches(naive, "TIMESTAMPTZ", None).tolist() == [True, True]
+    assert checker.type_mismatches(naive.dt.tz_localize("UTC"), "TIMESTAMPTZ", None).tolist() == [False, False]
+    assert checker.type_mismatches(naive, "DATE", None).tolist() == [False, True]
+    assert checker.type_mismatches(pd.Series(["2024-01-01"]), "DATE", None).tolist() == [True]
+
+def test_missing_references_only_warn(checker, capsys):
+    tracks_df = make_tracks_df(10, tracks=5)
+
+    report = checker.validate(tracks_df, "recent_tracks", references={"track_details": details(3)})
+
+    assert report.passed
+    assert report.warnings["reference:track_id->track_details.track_id"].tolist() == [3, 4, 8, 9]
+    assert "WARNING recent_tracks reference:track_id->track_details.track_id: 4 row(s)" in capsys.readouterr().out
+
+def test_missing_and_empty_frames(checker):
+    empty_df = details(0)
+
+    with pytest.raises(Exception, match="no DataFrame was extracted"):
+        checker.validate(None, "track_details", allow_empty=True)
+    with pytest.raises(Exception, match="the DataFrame is empty"):
+        checker.validate(empty_df, "track_details")
+    assert checker.validate(empty_df, "track_details", allow_empty=True) is None
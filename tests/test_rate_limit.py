@@ -0,0 +1,76 @@
+# Tests of the RateLimiter's reaction to 429 responses
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+from mock_spotify import MockSpotifyServer
+from spotify_token import HttpClient, RateLimiter
+
+LIMITS = {"tracks": (10, 20), "default": (10, 20)}
+TRACKS_URL = "https://api.spotify.com/v1/tracks?ids=a,b"
+
+# Helper to report a 429 from many threads at once, like the requests in flight when the limit is hit
+def concurrent_throttles(rate_limiter, count, retry_after=None):
+    barrier = threading.Barrier(count)
+
+    def throttled():
+        barrier.wait()
+        rate_limiter.throttled(TRACKS_URL, retry_after)
+
+    threads = [threading.Thread(target=throttled) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+def test_burst_of_429s_cuts_the_rate_once():
+    rate_limiter = RateLimiter(LIMITS)
+
+    concurrent_throttles(rate_limiter, 32, retry_after=0.1)
+
+    stats = rate_limiter.stats()["tracks"]
+    assert stats["throttled"] == 32
+    assert stats["rate"] == 10 * rate_limiter.decrease
+
+def test_429_after_the_hold_cuts_the_rate_again():
+    rate_limiter = RateLimiter(LIMITS, hold=0.05)
+
+    concurrent_throttles(rate_limiter, 8)
+    time.sleep(0.1)
+    concurrent_throttles(rate_limiter, 8)
+
+    assert rate_limiter.stats()["tracks"]["rate"] == 10 * rate_limiter.decrease ** 2
+
+def test_429s_of_one_family_dont_slow_the_others():
+    rate_limiter = RateLimiter(LIMITS)
+
+    concurrent_throttles(rate_limiter, 8)
+
+    assert rate_limiter.stats()["default"]["rate"] == 10
+
+def test_successes_after_a_cut_raise_the_cut_rate():
+    rate_limiter = RateLimiter(LIMITS)
+
+    assert rate_limiter.throttled(TRACKS_URL) == 0
+    for _ in range(10):
+        rate_limiter.succeeded(TRACKS_URL)
+
+    rate = rate_limiter.stats()["tracks"]["rate"]
+    assert 10 * rate_limiter.decrease < rate < 10
+
+def test_throttled_retries_report_the_family_pause(capsys):
+    server = MockSpotifyServer(rate_limit=2, retry_after=0.3).start()
+    try:
+        client = HttpClient(rate_limiter=RateLimiter(LIMITS, hold=0))
+        statuses = [client.get(f"{server.base_url}/tracks?ids=a", headers={}).status_code for _ in range(4)]
+    finally:
+        server.stop()
+
+    output = capsys.readouterr().out
+    assert statuses == [200] * 4
+    assert "returned 429. Retrying once the tracks requests resume, in 0.30s..." in output
+    assert "Retrying in" not in output
@@ -0,0 +1,108 @@
+# Tests of the shared schema: the DDL matches the DataFrame column types, and int8/float32 values and
+# TIMESTAMPTZ keys come back from the database as they went in. Runs on a SQLite file, and on PostgreSQL
+# when SPOTIFY_TEST_DB_URL points to a database whose ETL tables can be dropped
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+import numpy as np
+import pandas as pd
+import pytest
+from sqlalchemy import DateTime, String, create_engine, text
+
+from fake_data import make_tracks_df
+from spotify_load import SpotifyLoader
+from spotify_parse import typed_frame
+from spotify_schema import (ALBUMS_DTYPES, ARTISTS_DTYPES, RECENT_TRACKS_DTYPES, TABLES, TRACK_ALBUMS_DTYPES,
+                            TRACK_ARTISTS_DTYPES, TRACK_DETAILS_DTYPES, TRACK_FEATURES_DTYPES, ddl_columns, sql_table)
+
+TABLE_DTYPES = {
+    "recent_tracks": RECENT_TRACKS_DTYPES,
+    "track_details": TRACK_DETAILS_DTYPES,
+    "track_features": TRACK_FEATURES_DTYPES,
+    "artists": ARTISTS_DTYPES,
+    "albums": ALBUMS_DTYPES,
+    "track_artists": TRACK_ARTISTS_DTYPES,
+    "track_albums": TRACK_ALBUMS_DTYPES,
+}
+
+def drop_tables(engine):
+    with engine.begin() as connection:
+        for table_name in TABLES:
+            connection.execute(text(f"DROP TABLE IF EXISTS {table_name}"))
+
+@pytest.fixture(params=["sqlite", "postgresql"])
+def loader(request, tmp_path):
+    if request.param == "postgresql":
+        if not os.getenv("SPOTIFY_TEST_DB_URL"):
+            pytest.skip("SPOTIFY_TEST_DB_URL is not set")
+        engine = create_engine(os.getenv("SPOTIFY_TEST_DB_URL"))
+        drop_tables(engine)
+    else:
+        engine = create_engine(f"sqlite:///{os.path.join(tmp_path, 'spotify.db')}")
+
+    loader = SpotifyLoader(engine)
+    loader.create_tables()
+    yield loader
+
+    if request.param == "postgresql":
+        drop_tables(engine)
+    engine.dispose()
+
+def read_table(loader, table_name, order_by):
+    with loader.engine.connect() as connection:
+        return pd.read_sql(text(f"SELECT * FROM {table_name} ORDER BY {order_by}"), connection)
+
+def test_ddl_has_every_dataframe_column():
+    for table_name, dtypes in TABLE_DTYPES.items():
+        assert set(ddl_columns(TABLES[table_name]["ddl"])) == set(dtypes), table_name
+
+def test_sql_table_types_come_from_the_ddl():
+    assert ddl_columns(TABLES["recent_tracks"]["ddl"]) == {
+        "user_id": ("VARCHAR", 200), "played_at": ("TIMESTAMPTZ", None), "track_id": ("VARCHAR", 200), "timestamp": ("DATE", None),
+    }
+
+    table = sql_table(TABLES["recent_tracks"]["ddl"])
+    assert table.name == "recent_tracks"
+    assert isinstance(table.c.played_at.type, DateTime) and table.c.played_at.type.timezone
+    assert isinstance(table.c.user_id.type, String) and table.c.user_id.type.length == 200
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_narrow_types_and_timestamp_keys_round_trip(loader, bulk):
+    tracks_df = make_tracks_df(5, tracks=5)
+    # Milliseconds of played_at are part of the key
+    tracks_df["played_at"] = tracks_df["played_at"] + pd.to_timedelta([0, 1, 2, 3, 999], unit="ms")
+    features_df = typed_frame(pd.DataFrame({
+        "track_id": tracks_df["track_id"].tolist(),
+        "danceability": [0.123, 0.5, 0.999, 0.0, 1.0],
+        "duration_ms": [200_000] * 5,
+        "energy": [0.1] * 5,
+        "acousticness": [0.2] * 5,
+        "instrumentalness": [0.3] * 5,
+        "key": [-1, 0, 5, 11, 127],
+        "liveness": [0.4] * 5,
+        "loudness": [-60.0, -5.25, 0.0, -12.5, 3.3],
+        "mode": [0, 1, 0, 1, 0],
+        "speechiness": [0.05] * 5,
+        "tempo": [120.123, 90.0, 60.5, 200.0, 0.0],
+        "time_signature": [4] * 5,
+        "valence": [0.7] * 5,
+    }), TRACK_FEATURES_DTYPES)
+
+    loader.load(tracks_df, None, features_df, bulk=bulk)
+    # A rerun finds the same keys, no play is written twice
+    loader.load(tracks_df, None, features_df, bulk=bulk)
+
+    plays = read_table(loader, "recent_tracks", "played_at")
+    assert pd.to_datetime(plays["played_at"], utc=True, format="ISO8601").tolist() == tracks_df["played_at"].tolist()
+    assert pd.to_datetime(plays["timestamp"]).dt.date.tolist() == tracks_df["timestamp"].dt.date.tolist()
+
+    features = read_table(loader, "track_features", "track_id")
+    # float32 values are stored as their shortest text form: 0.123, not 0.12300000339746475
+    assert features["danceability"].tolist() == [0.123, 0.5, 0.999, 0.0, 1.0]
+    assert features["tempo"].tolist() == [120.123, 90.0, 60.5, 200.0, 0.0]
+    assert features["loudness"].tolist() == [-60.0, -5.25, 0.0, -12.5, 3.3]
+    assert features["key"].tolist() == [-1, 0, 5, 11, 127]
+    assert np.issubdtype(features["key"].dtype, np.integer)
@@ -0,0 +1,97 @@
+# Tests of the extraction cursor: it never moves backwards, survives a crash mid-write and only moves
+# once a run's plays are loaded
+import json
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+import pandas as pd
+import pytest
+
+import spotify_state
+from mock_spotify import MockSpotifyServer, StaticTokenManager, play_timestamp
+from spotify_etl import SpotifyETL
+from spotify_state import ExtractionState
+
+def plays_df(*played_at):
+    return pd.DataFrame({"played_at": list(played_at)})
+
+def test_cursor_never_moves_backwards(tmp_path):
+    state = ExtractionState(os.path.join(tmp_path, "state.json"))
+
+    state.advance(plays_df("2024-01-01T10:00:00.000Z", "2024-01-01T12:00:00.000Z"))
+    state.advance(plays_df("2024-01-01T11:00:00.000Z"))
+
+    assert state.get_cursor()["played_at"] == "2024-01-01T12:00:00+00:00"
+    assert state.get_after() == int(datetime.fromisoformat("2024-01-01T12:00:00+00:00").timestamp() * 1000)
+
+def test_cursors_are_kept_per_key(tmp_path):
+    state = ExtractionState(os.path.join(tmp_path, "state.json"))
+
+    state.advance(plays_df("2024-01-01T12:00:00.000Z"), "recently_played:alice")
+
+    assert state.get_cursor("recently_played") is None
+    assert state.get_cursor("recently_played:alice")["played_at"] == "2024-01-01T12:00:00+00:00"
+
+def test_without_cursor_the_lookback_applies(tmp_path):
+    state = ExtractionState(os.path.join(tmp_path, "state.json"))
+
+    after = state.get_after(lookback=timedelta(hours=2))
+
+    assert abs(after / 1000 - (datetime.now() - timedelta(hours=2)).timestamp()) < 5
+
+def test_crash_while_writing_keeps_the_previous_file(tmp_path, monkeypatch):
+    path = os.path.join(tmp_path, "state.json")
+    state = ExtractionState(path)
+    state.advance(plays_df("2024-01-01T10:00:00.000Z"))
+
+    # The process dies halfway through writing the new state
+    def partial_dump(data, f, **kwargs):
+        f.write('{"recently_played": {"played_at": "2024-')
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(spotify_state.json, "dump", partial_dump)
+    with pytest.raises(KeyboardInterrupt):
+        state.advance(plays_df("2024-01-01T12:00:00.000Z"))
+    monkeypatch.undo()
+
+    with open(path) as f:
+        assert json.load(f)["recently_played"]["played_at"] == "2024-01-01T10:00:00+00:00"
+
+# Loader stand-in recording the plays it loads, or failing like a lost database connection
+class RecordingLoader:
+    def __init__(self, fail=False):
+        self.fail = fail
+        self.plays = 0
+
+    def load(self, tracks_df, details_df, features_df, bulk=False, dimensions=None, observed_at=None):
+        if self.fail:
+            raise ConnectionError("server closed the connection unexpectedly")
+        self.plays += len(tracks_df)
+
+def test_failed_run_leaves_the_cursor_and_the_next_one_resumes(tmp_path):
+    server = MockSpotifyServer(plays=120, tracks=40).start()
+    try:
+        etl = SpotifyETL(
+            StaticTokenManager(),
+            recent_tracks_url=f"{server.base_url}/me/player/recently-played",
+            tracks_details_url=f"{server.base_url}/tracks",
+            tracks_features_url=f"{server.base_url}/audio-features",
+        )
+        state = ExtractionState(os.path.join(tmp_path, "state.json"))
+        state.advance(pd.DataFrame({"played_at": [pd.Timestamp(play_timestamp(-1), unit="ms", tz="UTC").isoformat()]}))
+        after = state.get_after()
+
+        with pytest.raises(ConnectionError):
+            etl.spotify_streaming_etl(RecordingLoader(fail=True), state)
+        assert state.get_after() == after
+
+        loader = RecordingLoader()
+        assert etl.spotify_streaming_etl(loader, state) == 120
+        assert loader.plays == 120
+        assert state.get_after() == play_timestamp(119)
+    finally:
+        server.stop()
@@ -0,0 +1,97 @@
+# Tests of the access token refresh against the mock Spotify API: concurrent callers share one refresh
+import os
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+import pytest
+
+from mock_spotify import MockSpotifyServer
+from spotify_token import SpotifyTokenManager, SpotifyConfig, HttpClient, AsyncTokenStore
+
+CALLERS = 64
+
+@pytest.fixture
+def server():
+    server = MockSpotifyServer().start()
+    yield server
+    server.stop()
+
+# Helper to call a function from CALLERS threads released at the same time
+def call_concurrently(function):
+    barrier = threading.Barrier(CALLERS)
+
+    def call():
+        barrier.wait()
+        return function()
+
+    with ThreadPoolExecutor(max_workers=CALLERS) as executor:
+        return list(executor.map(lambda _: call(), range(CALLERS)))
+
+def token_manager(server, token_store=None):
+    config = SpotifyConfig("client-id", "client-secret", "refresh-token", None, None, server.token_url, token_store=token_store)
+    return SpotifyTokenManager(config, HttpClient(pool_size=CALLERS))
+
+def test_concurrent_callers_share_one_refresh(server):
+    manager = token_manager(server)
+
+    tokens = call_concurrently(manager.get_access_token)
+
+    assert server.tokens_issued == 1
+    assert set(tokens) == {"mock-token-1"}
+
+def test_rejected_token_is_refreshed_once(server):
+    manager = token_manager(server)
+    rejected = manager.get_access_token()
+
+    # A 401 storm: every in-flight request reports the same rejected token
+    tokens = call_concurrently(lambda: manager.refresh_rejected_token(rejected))
+
+    assert server.tokens_issued == 2
+    assert set(tokens) == {"mock-token-2"}
+
+# Token store recording the saved tokens
+class MemoryTokenStore:
+    def __init__(self):
+        self.saved = []
+
+    def load(self):
+        return None, None
+
+    def save(self, access_token, expiration_time):
+        self.saved.append(access_token)
+
+def test_async_token_store_drops_completed_writes():
+    memory = MemoryTokenStore()
+    store = AsyncTokenStore(memory)
+
+    for i in range(100):
+        store.save(f"token-{i}", datetime.now() + timedelta(hours=1))
+    store.flush()
+
+    assert memory.saved == [f"token-{i}" for i in range(100)]
+    assert not store.pending
+
+# Token store holding a token refreshed by another process
+class StoredTokenStore(MemoryTokenStore):
+    def load(self):
+        return "stored-token", str((datetime.now() + timedelta(hours=1)).timestamp())
+
+def test_stored_token_is_preferred_over_the_environment():
+    expiration = str((datetime.now() + timedelta(hours=1)).timestamp())
+
+    config = SpotifyConfig("client-id", "client-secret", "refresh-token", "env-token", expiration, "", token_store=StoredTokenStore())
+    assert config.access_token == "env-token"
+
+    config = SpotifyConfig("client-id", "client-secret", "refresh-token", "env-token", expiration, "", token_store=StoredTokenStore(),
+                           prefer_stored_token=True)
+    assert config.access_token == "stored-token"
+
+    # An empty store keeps the environment's token
+    config = SpotifyConfig("client-id", "client-secret", "refresh-token", "env-token", expiration, "", token_store=MemoryTokenStore(),
+                           prefer_stored_token=True)
+    assert config.access_token == "env-token"